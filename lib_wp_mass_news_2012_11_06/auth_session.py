@@ -0,0 +1,170 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import os, os.path
+import time
+import threading
+import collections
+import hashlib
+from http import cookiejar
+from urllib import request
+from . import urllib_request_helper
+
+DEFAULT_POOL_SIZE = 1000
+DEFAULT_IDLE_TIMEOUT = 1800.0
+DEFAULT_STORE_EXT = 'cookies'
+
+class Session:
+    # cookies and opener of one logged-in account. ``params`` keeps
+    # per-session data of platform module (user-id, form params, etc)
+    
+    def __init__(self, cookies=None):
+        if cookies is None:
+            cookies = cookiejar.CookieJar()
+        
+        self.cookies = cookies
+        self.opener = urllib_request_helper.build_opener(
+                request.HTTPCookieProcessor(cookiejar=cookies),
+                )
+        self.params = {}
+        self.last_used = None
+        # ``True`` for session loaded from ``SessionStore``. platform module
+        # must check it (with cheap request) before trusting
+        self.is_restored = False
+
+class SessionStore:
+    # directory of saved cookies (one file per account), shared across runs.
+    # file is replaced atomically, so concurrent writers (threads or
+    # processes) never make broken file
+    
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        
+        self._path = path
+    
+    def get_path(self, key):
+        key_hash = hashlib.sha1(repr(key).encode('utf-8', 'replace')).hexdigest()
+        
+        return os.path.join(self._path, '{}.{}'.format(key_hash, DEFAULT_STORE_EXT))
+    
+    def load(self, key):
+        # this function is thread-safe
+        
+        path = self.get_path(key)
+        cookies = cookiejar.LWPCookieJar()
+        
+        try:
+            cookies.load(path, ignore_discard=True)
+        except (OSError, cookiejar.LoadError):
+            return
+        
+        session = Session(cookies=cookies)
+        session.is_restored = True
+        
+        return session
+    
+    def save(self, key, session):
+        # this function is thread-safe
+        
+        path = self.get_path(key)
+        temp_path = '{}.{}-{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        cookies = cookiejar.LWPCookieJar()
+        
+        for cookie in session.cookies:
+            cookies.set_cookie(cookie)
+        
+        try:
+            cookies.save(temp_path, ignore_discard=True)
+            os.replace(temp_path, path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+class SessionPool:
+    # bounded LRU pool of logged-in sessions keyed by account.
+    # session is taken out of pool by ``acquire()``, so two threads
+    # never use one session at the same time
+    
+    def __init__(self, size=None, idle_timeout=None, store=None):
+        if size is None:
+            size = DEFAULT_POOL_SIZE
+        
+        if idle_timeout is None:
+            idle_timeout = DEFAULT_IDLE_TIMEOUT
+        
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._store = store
+        self._lock = threading.Lock()
+        self._session_map = collections.OrderedDict()
+    
+    def acquire(self, key):
+        # this function is thread-safe
+        
+        with self._lock:
+            session = self._session_map.pop(key, None)
+        
+        if session is not None and \
+                time.monotonic() - session.last_used <= self._idle_timeout:
+            return session
+        
+        if self._store is not None:
+            # not in memory (or expired) -- try saved one
+            
+            return self._store.load(key)
+    
+    def save(self, key, session):
+        # saves cookies of just logged-in session to store (if any).
+        # this function is thread-safe
+        
+        if self._store is not None:
+            self._store.save(key, session)
+    
+    def release(self, key, session):
+        # puts logged-in session back to pool.
+        # this function is thread-safe
+        
+        session.last_used = time.monotonic()
+        
+        with self._lock:
+            self._session_map.pop(key, None)
+            self._session_map[key] = session
+            
+            while len(self._session_map) > self._size:
+                self._session_map.popitem(last=False)
+
+def acquire_session(session_pool, key):
+    if session_pool is None:
+        return
+    
+    return session_pool.acquire(key)
+
+def save_session(session_pool, key, session):
+    if session_pool is None:
+        return
+    
+    session_pool.save(key, session)
+
+def release_session(session_pool, key, session):
+    if session_pool is None:
+        return
+    
+    session_pool.release(key, session)
@@ -0,0 +1,151 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+from tornado import ioloop, stack_context
+
+DEFAULT_MIN_CONC = 1
+DEFAULT_INTERVAL = 10.0
+DEFAULT_MAX_ERROR_RATE = 0.2
+DEFAULT_LATENCY_FACTOR = 2.0
+DEFAULT_INCREASE = 1
+DEFAULT_DECREASE_FACTOR = 0.75
+
+class AimdController:
+    # additive-increase/multiplicative-decrease of concurrence (count of
+    # active workers) by latency and error rate of finished tasks.
+    # this class must be used from IOLoop thread
+    
+    def __init__(self, max_conc, min_conc=None, conc=None,
+            interval=None, target_latency=None, max_error_rate=None,
+            increase=None, decrease_factor=None,
+            change_callback=None, log_callback=None):
+        if min_conc is None:
+            min_conc = DEFAULT_MIN_CONC
+        
+        if conc is None:
+            conc = min_conc
+        
+        if interval is None:
+            interval = DEFAULT_INTERVAL
+        
+        if max_error_rate is None:
+            max_error_rate = DEFAULT_MAX_ERROR_RATE
+        
+        if increase is None:
+            increase = DEFAULT_INCREASE
+        
+        if decrease_factor is None:
+            decrease_factor = DEFAULT_DECREASE_FACTOR
+        
+        assert 1 <= min_conc <= max_conc
+        
+        self._min_conc = min_conc
+        self._max_conc = max_conc
+        self._conc = max(min(conc, max_conc), min_conc)
+        self._interval = interval
+        self._target_latency = target_latency
+        self._max_error_rate = max_error_rate
+        self._increase = increase
+        self._decrease_factor = decrease_factor
+        self._change_callback = stack_context.wrap(change_callback)
+        self._log_callback = stack_context.wrap(log_callback)
+        self._base_latency = None
+        self._timer = None
+        self._reset_counters()
+    
+    def _reset_counters(self):
+        self._task_count = 0
+        self._error_count = 0
+        self._latency_sum = 0.0
+    
+    def get_conc(self):
+        return self._conc
+    
+    def get_max_conc(self):
+        return self._max_conc
+    
+    def set_change_callback(self, change_callback):
+        self._change_callback = stack_context.wrap(change_callback)
+    
+    def report(self, latency, is_error):
+        self._task_count += 1
+        self._latency_sum += latency
+        
+        if is_error:
+            self._error_count += 1
+    
+    def start(self):
+        assert self._timer is None
+        
+        self._timer = ioloop.PeriodicCallback(self._adjust, self._interval * 1000.0)
+        self._timer.start()
+    
+    def stop(self):
+        if self._timer is None:
+            return
+        
+        self._timer.stop()
+        self._timer = None
+    
+    def _adjust(self):
+        task_count = self._task_count
+        
+        if not task_count:
+            return
+        
+        error_rate = self._error_count / task_count
+        latency = self._latency_sum / task_count
+        
+        self._reset_counters()
+        
+        if error_rate <= self._max_error_rate and \
+                (self._base_latency is None or latency < self._base_latency):
+            self._base_latency = latency
+        
+        if self._target_latency is not None:
+            target_latency = self._target_latency
+        elif self._base_latency is not None:
+            target_latency = self._base_latency * DEFAULT_LATENCY_FACTOR
+        else:
+            target_latency = None
+        
+        if error_rate > self._max_error_rate:
+            reason = 'error rate {:.0%}'.format(error_rate)
+            new_conc = int(self._conc * self._decrease_factor)
+        elif target_latency is not None and latency > target_latency:
+            reason = 'latency {:.2f}s > {:.2f}s'.format(latency, target_latency)
+            new_conc = int(self._conc * self._decrease_factor)
+        else:
+            reason = 'latency {:.2f}s, error rate {:.0%}'.format(latency, error_rate)
+            new_conc = self._conc + self._increase
+        
+        new_conc = max(min(new_conc, self._max_conc), self._min_conc)
+        
+        if new_conc == self._conc:
+            return
+        
+        old_conc = self._conc
+        self._conc = new_conc
+        
+        if self._log_callback is not None:
+            self._log_callback('conc: {!r} -> {!r} ({}, {!r} tasks)'.format(
+                    old_conc, new_conc, reason, task_count))
+        
+        if self._change_callback is not None:
+            self._change_callback()
@@ -0,0 +1,195 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# compiled corpus file:
+#   header -- magic, flags, kind, count of records, position of offset table;
+#   records -- one after another (each may be compressed by zlib);
+#   offset table -- ``count + 1`` positions of records (8 bytes each).
+# record of text item is ``title_start, title_end, body_start`` (positions of
+# title and body in item, see ``get_items.split_item()``) and utf-8 text.
+# record of csv row is utf-8 json array
+
+import os
+import sys
+import mmap
+import array
+import struct
+import threading
+import json
+import zlib
+
+DEFAULT_CORPUS_EXT = 'corpus'
+
+KIND_TEXT = 1
+KIND_CSV = 2
+
+FLAG_COMPRESS = 1
+
+_HEADER = struct.Struct('<8sIIQQ')
+_MAGIC = b'WMNCRP01'
+_SPLIT = struct.Struct('<III')
+# ``title_start`` of item which can not be split
+_NO_SPLIT = 0xffffffff
+
+class CorpusError(Exception):
+    pass
+
+def get_corpus_path(path):
+    return '{}.{}'.format(path, DEFAULT_CORPUS_EXT)
+
+class CorpusFile:
+    # random access to records of compiled corpus (``len()``, ``[i]``,
+    # ``close()``). file is memory-mapped, so opening does not depend on
+    # size of corpus. if ``is_split``, text item is pair ``(title, body)``
+    # split when corpus was compiled (``None`` if item can not be split)
+    
+    def __init__(self, path, is_split=None):
+        if is_split is None:
+            is_split = False
+        
+        self._is_split = is_split
+        self._fd = open(path, 'rb')
+        self._mm = None
+        self._offsets = None
+        
+        try:
+            header = self._fd.read(_HEADER.size)
+            
+            if len(header) != _HEADER.size:
+                raise CorpusError('invalid corpus file: {!r}'.format(path))
+            
+            magic, flags, self.kind, count, table_pos = _HEADER.unpack(header)
+            
+            if magic != _MAGIC or self.kind not in (KIND_TEXT, KIND_CSV):
+                raise CorpusError('invalid corpus file: {!r}'.format(path))
+            
+            self._is_compressed = bool(flags & FLAG_COMPRESS)
+            self._mm = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+            
+            if len(self._mm) != table_pos + (count + 1) * 8:
+                raise CorpusError('invalid corpus file: {!r}'.format(path))
+            
+            if sys.byteorder == 'little':
+                self._offsets = memoryview(self._mm)[table_pos:].cast('Q')
+            else:
+                self._offsets = array.array('Q', self._mm[table_pos:])
+                self._offsets.byteswap()
+        except:
+            self.close()
+            raise
+    
+    def __len__(self):
+        return len(self._offsets) - 1
+    
+    def __getitem__(self, i):
+        record = self._mm[self._offsets[i]:self._offsets[i + 1]]
+        
+        if self._is_compressed:
+            record = zlib.decompress(record)
+        
+        if self.kind == KIND_CSV:
+            return json.loads(record.decode('utf-8'))
+        
+        item = record[_SPLIT.size:].decode('utf-8')
+        
+        if not self._is_split:
+            return item
+        
+        title_start, title_end, body_start = _SPLIT.unpack_from(record)
+        
+        if title_start == _NO_SPLIT:
+            return
+        
+        return item[title_start:title_end], item[body_start:]
+    
+    def close(self):
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        
+        self._fd.close()
+
+def write_corpus(path, items_iter, kind, split_func=None, is_compressed=None):
+    # ``split_func(item)`` gives ``(title_start, title_end, body_start)`` or
+    # ``None`` (for ``KIND_TEXT``). file is replaced atomically.
+    # returns count of records
+    
+    if is_compressed is None:
+        is_compressed = False
+    
+    if is_compressed:
+        flags = FLAG_COMPRESS
+    else:
+        flags = 0
+    
+    offsets = array.array('Q')
+    temp_path = '{}.{}-{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    
+    try:
+        with open(temp_path, 'wb') as fd:
+            fd.write(_HEADER.pack(_MAGIC, flags, kind, 0, 0))
+            pos = _HEADER.size
+            
+            for item in items_iter:
+                if kind == KIND_CSV:
+                    record = json.dumps(item, ensure_ascii=False).encode('utf-8')
+                else:
+                    split = split_func(item) if split_func is not None else None
+                    
+                    if split is None:
+                        split = _NO_SPLIT, 0, 0
+                    
+                    record = _SPLIT.pack(*split) + item.encode('utf-8')
+                
+                if is_compressed:
+                    record = zlib.compress(record)
+                
+                offsets.append(pos)
+                fd.write(record)
+                pos += len(record)
+            
+            offsets.append(pos)
+            
+            # offset table is aligned to 8 bytes
+            
+            padding = -pos % 8
+            fd.write(b'\0' * padding)
+            table_pos = pos + padding
+            
+            if sys.byteorder != 'little':
+                offsets.byteswap()
+            
+            offsets.tofile(fd)
+            
+            fd.seek(0)
+            fd.write(_HEADER.pack(_MAGIC, flags, kind, len(offsets) - 1, table_pos))
+        
+        os.replace(temp_path, path)
+    except:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        
+        raise
+    
+    return len(offsets) - 1
@@ -0,0 +1,132 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import time
+import socket
+import threading
+from concurrent import futures
+
+DEFAULT_TTL = 300.0
+DEFAULT_NEGATIVE_TTL = 60.0
+DEFAULT_PREFETCH_WORKERS = 50
+
+class DnsCache:
+    # cache of ``socket.getaddrinfo()`` results. ``getaddrinfo()`` does not
+    # give TTL of records, so one TTL (and separate TTL for failures) is used
+    # for all hosts. this class is thread-safe
+    
+    def __init__(self, ttl=None, negative_ttl=None):
+        if ttl is None:
+            ttl = DEFAULT_TTL
+        
+        if negative_ttl is None:
+            negative_ttl = DEFAULT_NEGATIVE_TTL
+        
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        # ``(host, port) -> (expire, addr_info_list, error)``
+        self._entry_map = {}
+    
+    def getaddrinfo(self, host, port):
+        key = host, port
+        
+        with self._lock:
+            entry = self._entry_map.get(key)
+        
+        if entry is None or entry[0] < time.monotonic():
+            entry = self._resolve(key)
+        
+        expire, addr_info_list, error = entry
+        
+        if error is not None:
+            raise error
+        
+        return addr_info_list
+    
+    def _resolve(self, key):
+        host, port = key
+        
+        try:
+            addr_info_list = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            entry = time.monotonic() + self._negative_ttl, None, e
+        else:
+            entry = time.monotonic() + self._ttl, addr_info_list, None
+        
+        with self._lock:
+            self._entry_map[key] = entry
+        
+        return entry
+    
+    def create_connection(self, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+            source_address=None):
+        # the same as ``socket.create_connection()``, but uses cache
+        
+        host, port = address
+        error = None
+        
+        for family, socktype, proto, canonname, sockaddr in self.getaddrinfo(host, port):
+            sock = None
+            try:
+                sock = socket.socket(family, socktype, proto)
+                
+                if timeout is not socket._GLOBAL_DEFAULT_TIMEOUT:
+                    sock.settimeout(timeout)
+                
+                if source_address is not None:
+                    sock.bind(source_address)
+                
+                sock.connect(sockaddr)
+                
+                return sock
+            except OSError as e:
+                error = e
+                
+                if sock is not None:
+                    sock.close()
+        
+        if error is not None:
+            raise error
+        
+        raise OSError('getaddrinfo returns an empty list')
+    
+    def prefetch(self, address_list, workers=None):
+        # resolves all ``(host, port)`` in parallel.
+        # returns dict ``host -> error`` of hosts which are not resolved
+        
+        if workers is None:
+            workers = DEFAULT_PREFETCH_WORKERS
+        
+        address_list = list(set(address_list))
+        dead_map = {}
+        
+        if not address_list:
+            return dead_map
+        
+        with futures.ThreadPoolExecutor(max_workers=min(workers, len(address_list))) \
+                as executor:
+            for address, entry in zip(address_list, executor.map(self._resolve, address_list)):
+                expire, addr_info_list, error = entry
+                
+                if error is not None:
+                    host, port = address
+                    dead_map[host] = error
+        
+        return dead_map
@@ -17,19 +17,16 @@
 
 assert str is not bytes
 
-import traceback
-import threading
 import json
 import csv
 import weakref
 from urllib import parse as url
-from http import cookiejar
-from urllib import request
-from tornado import ioloop, stack_context, gen
+from tornado import stack_context, gen
 from . import get_items
 from . import urllib_request_helper
-from . import lib_html_parse
-html_parse = lib_html_parse.import_module('html_parse')
+from . import worker_pool
+from . import auth_session
+from . import html_stream
 
 FF_HTTPS_URL = 'https://friendfeed.com'
 FF_HTTP_URL = 'http://friendfeed.com'
@@ -48,22 +45,9 @@ class PublishFfError(FfError):
 class Task:
     pass
 
-def ff_post_blocking(username=None, password=None,
-        content=None, ua_name=None, proxy_kwargs=None):
-    assert username is not None
-    assert password is not None
-    assert content is not None
-    
-    if ua_name is None:
-        ua_name = urllib_request_helper.DEFAULT_USER_AGENT_NAME
-    
+def ff_auth(opener, username, password, ua_name,
+        proxy_kwargs=None, retry_policy=None):
     ff_login_url = url.urljoin(FF_HTTPS_URL, 'account/login?v=2')
-    ff_share_url = url.urljoin(FF_HTTP_URL, 'a/share')
-    
-    cookies = cookiejar.CookieJar()
-    opener = request.build_opener(
-            request.HTTPCookieProcessor(cookiejar=cookies),
-            )
     
     # *** PHASE: get params for auth ***
     
@@ -75,32 +59,27 @@ def ff_post_blocking(username=None, password=None,
                     ),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
             )
     
     if resp.getcode() != 200 or resp.geturl() != ff_login_url:
         raise FfError('phase: get params for auth: http-error')
     
-    data = resp.read(urllib_request_helper.DEFAULT_RESPONSE_LIMIT).decode('utf-8', 'replace')
-    
-    at_nodes = tuple(html_parse.find_tags(
-            html_parse.find_tags(
-                    (html_parse.html_parse(data),),
-                    'form',
+    at_params = urllib_request_helper.stream_read(
+            resp,
+            html_stream.FormExtractor(
                     attrs={
                             'method': 'post',
                             'action': '/account/login?v=2',
                             },
+                    names=('at',),
                     ),
-            'input',
-            attrs={
-                    'name': 'at',
-                    },
-            ))
+            ).get_params()
     
-    if not at_nodes:
+    if 'at' not in at_params:
         raise FfError('phase -- get params for auth: not found at_param')
     
-    at_param = at_nodes[0].attrs.get('value')
+    at_param = at_params['at']
     
     # *** PHASE: auth ***
     
@@ -119,44 +98,105 @@ def ff_post_blocking(username=None, password=None,
                     }).encode(),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
             )
     
     if resp.getcode() != 200 or \
             (resp.geturl() != FF_HTTP_URL and resp.geturl() != FF_HTTP_URL + '/'):
         raise AuthFfError('ff auth error')
     
-    # *** PHASE: publish ***
+    return resp
+
+def ff_open_home(opener, ua_name,
+        proxy_kwargs=None, retry_policy=None):
+    # home page of logged-in session (it has share form)
     
-    data = resp.read(urllib_request_helper.DEFAULT_RESPONSE_LIMIT).decode('utf-8', 'replace')
+    resp = urllib_request_helper.ext_open(
+            opener,
+            FF_HTTP_URL,
+            headers=(
+                    ('User-Agent', ua_name),
+                    ),
+            timeout=urllib_request_helper.DEFAULT_TIMEOUT,
+            proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
+            )
+    
+    if resp.getcode() != 200 or \
+            (resp.geturl() != FF_HTTP_URL and resp.geturl() != FF_HTTP_URL + '/'):
+        return
+    
+    return resp
+
+def ff_get_share_params(resp):
+    # returns ``(streams_param, at_param)`` or ``None``
     
-    form_nodes = tuple(html_parse.find_tags(
-            (html_parse.html_parse(data),),
-            'form',
-            attrs={
-                    'method': 'post',
-                    'action': '/a/share',
-                    },
-            ))
-    streams_nodes = tuple(html_parse.find_tags(
-            form_nodes,
-            'input',
-            attrs={
-                    'name': 'streams',
-                    },
-            ))
-    at_nodes = tuple(html_parse.find_tags(
-            form_nodes,
-            'input',
-            attrs={
-                    'name': 'at',
-                    },
-            ))
-    
-    if not streams_nodes or not at_nodes :
+    share_params = urllib_request_helper.stream_read(
+            resp,
+            html_stream.FormExtractor(
+                    attrs={
+                            'method': 'post',
+                            'action': '/a/share',
+                            },
+                    names=('streams', 'at'),
+                    ),
+            ).get_params()
+    
+    if 'streams' not in share_params or 'at' not in share_params:
+        return
+    
+    return share_params['streams'], share_params['at']
+
+def ff_post_blocking(username=None, password=None,
+        content=None, ua_name=None, proxy_kwargs=None, session_pool=None,
+        retry_policy=None):
+    assert username is not None
+    assert password is not None
+    assert content is not None
+    
+    if ua_name is None:
+        ua_name = urllib_request_helper.DEFAULT_USER_AGENT_NAME
+    
+    if retry_policy is not None:
+        # time budget of task starts now
+        retry_policy = retry_policy.begin()
+    
+    ff_share_url = url.urljoin(FF_HTTP_URL, 'a/share')
+    
+    session_key = 'ff', username, password
+    session = auth_session.acquire_session(session_pool, session_key)
+    
+    if session is not None:
+        # *** PHASE: check session ***
+        
+        resp = ff_open_home(session.opener, ua_name,
+                proxy_kwargs=proxy_kwargs, retry_policy=retry_policy)
+        
+        if resp is not None:
+            share_params = ff_get_share_params(resp)
+        else:
+            share_params = None
+        
+        if share_params is None:
+            # session from pool is logged out. it will be replaced by new one
+            
+            session = None
+    
+    if session is None:
+        session = auth_session.Session()
+        resp = ff_auth(session.opener, username, password, ua_name,
+                proxy_kwargs=proxy_kwargs, retry_policy=retry_policy)
+        auth_session.save_session(session_pool, session_key, session)
+        share_params = ff_get_share_params(resp)
+    
+    opener = session.opener
+    
+    # *** PHASE: publish ***
+    
+    if share_params is None:
         raise FfError('phase -- publish: not found -- streams_param or/and at_param')
     
-    streams_param = streams_nodes[0].attrs.get('value')
-    at_param = at_nodes[0].attrs.get('value')
+    streams_param, at_param = share_params
     
     resp = urllib_request_helper.ext_open(
             opener,
@@ -176,6 +216,7 @@ def ff_post_blocking(username=None, password=None,
                     }).encode(),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
             )
     
     if resp.getcode() != 200 or resp.geturl() != ff_share_url:
@@ -191,38 +232,23 @@ def ff_post_blocking(username=None, password=None,
     
     publish_html = str(data_json.get('html', ''))
     
-    publish_nodes = tuple(html_parse.find_tags(
-            (html_parse.html_parse(publish_html),),
-            'a', attrs={'class': 'date'},
-            ))
+    publish_finder = html_stream.TagFinder('a', attrs={'class': 'date'})
+    publish_finder.feed(publish_html)
+    publish_finder.close()
     
-    if not publish_nodes:
+    if not publish_finder.tags:
         raise PublishFfError('ff publish error (can not get post_url)')
     
-    post_url = url.urljoin(FF_HTTP_URL, publish_nodes[0].attrs.get('href'))
+    post_url = url.urljoin(FF_HTTP_URL, publish_finder.tags[0].attrs.get('href'))
     
     # *** PHASE: end ***
     
+    auth_session.release_session(session_pool, session_key, session)
+    
     return post_url
 
 def ff_post(*args, callback=None, **kwargs):
-    callback = stack_context.wrap(callback)
-    
-    def ff_post_thread():
-        result = None
-        error = None
-        
-        try:
-            result = ff_post_blocking(*args, **kwargs)
-        except Exception as e:
-            error = type(e), str(e), traceback.format_exc()
-        
-        if callback is not None:
-            ioloop.IOLoop.instance().add_callback(lambda: callback(result, error))
-    
-    t = threading.Thread(target=ff_post_thread)
-    t.daemon = True
-    t.start()
+    worker_pool.run_blocking(ff_post_blocking, *args, callback=callback, **kwargs)
 
 def ff_acc_save(task_cfg, task):
     fd = task_cfg.out.get_fd(ext='accs.csv')
@@ -245,7 +271,8 @@ def get_ff_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
     task_begin_handle = stack_context.wrap(task_begin_handle)
     task_end_handle = stack_context.wrap(task_end_handle)
     
-    raw_accs_iter = get_items.get_random_infinite_items(task_cfg.accs, is_csv=True)
+    raw_accs_iter = get_items.get_random_infinite_items(
+            task_cfg.accs, is_csv=True, shard=task_cfg.acc_shard)
     content_iter = get_items.get_random_infinite_items(task_cfg.content)
     
     def next_acc():
@@ -267,7 +294,14 @@ def get_ff_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
         
         raise NotImplementedError('not implemented account format')
     
-    for task_i in range(task_cfg.count):
+    for task_i in task_cfg.task_indexes:
+        if task_i is None:
+            # no task yet (see ``work_queue.QueueClient``)
+            
+            yield None
+            
+            continue
+        
         task = Task()
         
         task.i = task_i
@@ -276,6 +310,8 @@ def get_ff_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
         task.content = next(content_iter)
         task.ua_name = task_cfg.ua_name
         task.proxy_kwargs = task_cfg.proxy_kwargs
+        task.retry_policy = task_cfg.retry_policy
+        task.session_pool = task_cfg.session_pool
         
         task.acc_save = lambda _task=task: ff_acc_save(
                 task_cfg,
@@ -301,6 +337,8 @@ def ff_post_task(task, callback=None):
             content=task.content,
             ua_name=task.ua_name,
             proxy_kwargs=task.proxy_kwargs,
+            retry_policy=task.retry_policy,
+            session_pool=task.session_pool,
             )).args
     
     if task.task_end_handle is not None:
@@ -0,0 +1,130 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+# compares parse time and memory of ``html_parse`` (full tree and
+# ``find_tags()``) with ``html_stream.FormExtractor`` on saved pages.
+#
+# usage: python3 -m lib_wp_mass_news_2012_11_06.form_bench \
+#         --attr id=post --attr method=post --attr action=post.php PAGE.html
+
+import argparse
+import time
+import tracemalloc
+from . import html_stream
+from . import urllib_request_helper
+from . import lib_html_parse
+
+DEFAULT_REPEAT = 20
+
+def tree_params(data, attrs):
+    html_parse = lib_html_parse.import_module('html_parse')
+    
+    form_html_nodes = tuple(html_parse.find_tags(
+            (html_parse.html_parse(data),),
+            'form',
+            attrs=attrs,
+            ))
+    
+    params = {}
+    for node in html_parse.find_tags(
+            form_html_nodes,
+            'input',
+            ):
+        name = node.attrs.get('name')
+        if not name:
+            continue
+        value = node.attrs.get('value')
+        if not value:
+            continue
+        
+        params[name] = value
+    
+    return params
+
+def stream_params(data, attrs, chunk_size=None):
+    if chunk_size is None:
+        chunk_size = urllib_request_helper.DEFAULT_READ_CHUNK_SIZE
+    
+    extractor = html_stream.FormExtractor(attrs=attrs)
+    
+    for chunk_pos in range(0, len(data), chunk_size):
+        if extractor.is_done:
+            break
+        
+        extractor.feed(data[chunk_pos:chunk_pos + chunk_size])
+    
+    if not extractor.is_done:
+        extractor.close()
+    
+    return extractor.get_params()
+
+def measure(func, *args, repeat=None):
+    # returns ``(result, seconds per call, peak of allocated bytes)``
+    
+    if repeat is None:
+        repeat = DEFAULT_REPEAT
+    
+    started = time.perf_counter()
+    for repeat_i in range(repeat):
+        result = func(*args)
+    elapsed = (time.perf_counter() - started) / repeat
+    
+    tracemalloc.start()
+    try:
+        func(*args)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    
+    return result, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(
+            description='compare form parsing of html_parse and html_stream on saved pages.')
+    parser.add_argument('pages', metavar='PAGE', nargs='+',
+            help='saved html page')
+    parser.add_argument('--attr', metavar='NAME=VALUE', action='append', default=[],
+            help='attribute of wanted form (may be repeated)')
+    parser.add_argument('--encoding', default='utf-8',
+            help='encoding of pages')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+            help='count of parses of each page')
+    args = parser.parse_args()
+    
+    attrs = dict(attr.partition('=')[::2] for attr in args.attr)
+    
+    for page in args.pages:
+        with open(page, 'rb') as fd:
+            data = fd.read().decode(args.encoding, 'replace')
+        
+        tree_result, tree_time, tree_peak = measure(
+                tree_params, data, attrs, repeat=args.repeat)
+        stream_result, stream_time, stream_peak = measure(
+                stream_params, data, attrs, repeat=args.repeat)
+        
+        print('{}: {!r} chars, {!r} params{}'.format(
+                page, len(data), len(stream_result),
+                '' if stream_result == tree_result else ' (RESULTS DIFFER)'))
+        print('    html_parse:  {:.3f} ms, peak {!r} bytes'.format(
+                tree_time * 1000.0, tree_peak))
+        print('    html_stream: {:.3f} ms, peak {!r} bytes'.format(
+                stream_time * 1000.0, stream_peak))
+
+if __name__ == '__main__':
+    main()
@@ -24,6 +24,10 @@ import csv
 import itertools
 import random
 import re
+import array
+import collections
+from . import line_index
+from . import corpus
 
 class NotFoundError(IOError):
     pass
@@ -72,10 +76,68 @@ def csv_items_open(path):
             # TODO: for Python-3.3+ -- need fix to PEP-0380
             yield csv_row
 
-def items_open(path, is_csv=None):
-    if is_csv is None:
-        is_csv = False
+def corpus_items_open(path, is_split=None):
+    corpus_file = corpus.CorpusFile(path, is_split=is_split)
+    
+    try:
+        for item_i in range(len(corpus_file)):
+            item = corpus_file[item_i]
+            
+            if item is None:
+                continue
+            
+            yield item
+    finally:
+        corpus_file.close()
+
+def get_source_path(path, is_csv=None):
+    # file or directory which ``items_open()`` reads for ``path``
+    # (``None`` if there is no such)
+    
+    if is_csv:
+        candidate_list = (path, '{}.csv'.format(path))
+    else:
+        candidate_list = (path, '{}.d'.format(path), '{}.txt'.format(path))
+    
+    for candidate in candidate_list:
+        if os.path.exists(candidate):
+            return candidate
+
+def find_corpus(path, is_csv=None):
+    # compiled corpus ``<path>.corpus`` (see ``compile_items()``). corpus
+    # which is older than its source is not used. corpus of other kind
+    # (text instead of csv or back) is error
+    
+    corpus_path = corpus.get_corpus_path(path)
+    
+    try:
+        corpus_mtime = os.stat(corpus_path).st_mtime
+    except OSError:
+        return
+    
+    source_path = get_source_path(path, is_csv=is_csv)
+    
+    if source_path is not None and os.stat(source_path).st_mtime > corpus_mtime:
+        return
     
+    if is_csv:
+        kind = corpus.KIND_CSV
+    else:
+        kind = corpus.KIND_TEXT
+    
+    corpus_file = corpus.CorpusFile(corpus_path)
+    
+    try:
+        if corpus_file.kind != kind:
+            raise corpus.CorpusError(
+                    'corpus {!r} is compiled {} csv option'.format(
+                            corpus_path, 'without' if is_csv else 'with'))
+    finally:
+        corpus_file.close()
+    
+    return corpus_path
+
+def source_items_open(path, is_csv=None):
     if is_csv:
         if not os.path.isfile(path):
             path = '{}.csv'.format(path)
@@ -99,48 +161,269 @@ def items_open(path, is_csv=None):
     
     raise NotFoundError('No such file or directory: ' + repr(path))
 
-def get_finite_items(path, is_csv=None):
-    return items_open(path, is_csv=is_csv)
+def items_open(path, is_csv=None, is_split=None):
+    # items of compiled corpus (if it is) or of source. if ``is_split``,
+    # items are pairs ``(title, body)`` (see ``split_title_and_content()``)
+    
+    corpus_path = find_corpus(path, is_csv=is_csv)
+    
+    if corpus_path is not None:
+        return corpus_items_open(corpus_path, is_split=is_split)
+    
+    items_iter = source_items_open(path, is_csv=is_csv)
+    
+    if is_split:
+        return split_title_and_content(items_iter)
+    
+    return items_iter
 
-def get_infinite_items(path, is_csv=None):
-    for item in itertools.cycle(items_open(path, is_csv=is_csv)):
-        # TODO: for Python-3.3+ -- need fix to PEP-0380
-        yield item
+DEFAULT_DIR_CACHE_SIZE = 1000
 
-def get_random_finite_items(path, is_csv=None):
-    items = []
+class DirItems:
+    # random access to ``.txt`` files of directory (the same items as
+    # ``dir_items_open()`` gives). only names are listed at start, file is
+    # read when its item is taken. recently read items are kept in bounded
+    # LRU cache. item of empty file is empty string -- such items must be
+    # skipped
     
-    for item in items_open(path, is_csv=is_csv):
-        items.append(item)
+    def __init__(self, path, cache_size=None):
+        if cache_size is None:
+            cache_size = DEFAULT_DIR_CACHE_SIZE
+        
+        self._path = path
+        self._cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self._names = [
+                entry.name for entry in os.scandir(path)
+                if entry.name.endswith('.txt')
+                ]
     
-    random.shuffle(items)
+    def __len__(self):
+        return len(self._names)
     
-    for item in items:
-        # TODO: for Python-3.3+ -- need fix to PEP-0380
-        yield item
+    def __getitem__(self, i):
+        item = self._cache.pop(i, None)
+        
+        if item is None:
+            file_path = os.path.join(self._path, self._names[i])
+            
+            with open(file_path, 'r', encoding='utf-8', newline='\n', errors='replace') \
+                    as fd:
+                item = fd.read().strip()
+        
+        self._cache[i] = item
+        
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        
+        return item
+    
+    def close(self):
+        self._cache.clear()
 
-def get_random_infinite_items(path, is_csv=None):
-    items = []
+class SplitItems:
+    # pairs ``(title, body)`` of items of random-access ``item_seq``
+    # (``None`` if item can not be split)
+    
+    def __init__(self, item_seq):
+        self._item_seq = item_seq
     
-    for item in items_open(path, is_csv=is_csv):
-        items.append(item)
+    def __len__(self):
+        return len(self._item_seq)
     
-    if not items:
+    def __getitem__(self, i):
+        item = self._item_seq[i]
+        split = split_item(item)
+        
+        if split is None:
+            return
+        
+        title_start, title_end, body_start = split
+        
+        return item[title_start:title_end], item[body_start:]
+    
+    def close(self):
+        self._item_seq.close()
+
+def source_item_seq_open(path, is_csv=None):
+    if is_csv:
         return
     
-    while True:
+    if os.path.isdir(path):
+        return DirItems(path)
+    
+    if os.path.isfile(path):
+        return line_index.LineIndex(path)
+    
+    d_path = '{}.d'.format(path)
+    txt_path = '{}.txt'.format(path)
+    
+    if os.path.isdir(d_path):
+        return DirItems(d_path)
+    
+    if os.path.isfile(txt_path):
+        return line_index.LineIndex(txt_path)
+    
+    raise NotFoundError('No such file or directory: ' + repr(path))
+
+def open_item_seq(path, is_csv=None, is_split=None):
+    # random-access items (``len()``, ``[i]``, ``close()``) without loading
+    # all of them (the same source as ``items_open()`` opens).
+    # ``None`` if source has no such access (csv without corpus)
+    
+    corpus_path = find_corpus(path, is_csv=is_csv)
+    
+    if corpus_path is not None:
+        return corpus.CorpusFile(corpus_path, is_split=is_split)
+    
+    item_seq = source_item_seq_open(path, is_csv=is_csv)
+    
+    if item_seq is not None and is_split:
+        return SplitItems(item_seq)
+    
+    return item_seq
+
+def get_item_order(count, shard=None):
+    # positions of items (of shard) in compact array
+    
+    if shard is None:
+        return array.array('Q', range(count))
+    
+    shard_i, shard_n = shard
+    
+    return array.array('Q', range(shard_i, count, shard_n))
+
+def lazy_shuffle(order):
+    # Fisher-Yates shuffle (in place) which is made step by step while
+    # items are taken, so first item is given without shuffling of all
+    
+    count = len(order)
+    
+    for i in range(count):
+        j = random.randrange(i, count)
+        order[i], order[j] = order[j], order[i]
+        
+        yield order[i]
+
+def get_seq_items(item_seq, get_order_iter, is_infinite=None, filter_func=None):
+    # items of ``item_seq`` in order given by ``get_order_iter()``
+    # (it is called for each pass). items which ``filter_func(item)`` rejects
+    # are skipped. ``item_seq`` is closed at the end
+    
+    if is_infinite is None:
+        is_infinite = False
+    
+    try:
+        while True:
+            is_empty = True
+            
+            for item_i in get_order_iter():
+                item = item_seq[item_i]
+                
+                if not item or filter_func is not None and not filter_func(item):
+                    continue
+                
+                is_empty = False
+                
+                yield item
+            
+            if not is_infinite or is_empty:
+                return
+    finally:
+        item_seq.close()
+
+def get_finite_items(path, is_csv=None, is_split=None):
+    return items_open(path, is_csv=is_csv, is_split=is_split)
+
+def get_infinite_items(path, is_csv=None, is_split=None):
+    item_seq = open_item_seq(path, is_csv=is_csv, is_split=is_split)
+    
+    if item_seq is None:
+        for item in itertools.cycle(items_open(path, is_csv=is_csv, is_split=is_split)):
+            # TODO: for Python-3.3+ -- need fix to PEP-0380
+            yield item
+        
+        return
+    
+    for item in get_seq_items(item_seq, lambda: range(len(item_seq)), is_infinite=True):
+        # TODO: for Python-3.3+ -- need fix to PEP-0380
+        yield item
+
+def get_random_finite_items(path, is_csv=None, is_split=None):
+    item_seq = open_item_seq(path, is_csv=is_csv, is_split=is_split)
+    
+    if item_seq is None:
+        items = []
+        
+        for item in items_open(path, is_csv=is_csv, is_split=is_split):
+            items.append(item)
+        
         random.shuffle(items)
         
         for item in items:
             # TODO: for Python-3.3+ -- need fix to PEP-0380
             yield item
+        
+        return
+    
+    order = get_item_order(len(item_seq))
+    
+    for item in get_seq_items(item_seq, lambda: lazy_shuffle(order)):
+        # TODO: for Python-3.3+ -- need fix to PEP-0380
+        yield item
 
-def clean_title(title):
-    m = re.match(
+def shard_items(items_iter, shard):
+    # ``shard`` is ``(I, N)`` -- every N-th item beginning from I-th
+    
+    if shard is None:
+        return items_iter
+    
+    shard_i, shard_n = shard
+    
+    return itertools.islice(items_iter, shard_i, None, shard_n)
+
+def get_random_infinite_items(path, is_csv=None, shard=None, is_split=None,
+        filter_func=None):
+    # ends (instead of infinite loop) if there is no item which
+    # ``filter_func(item)`` accepts
+    
+    item_seq = open_item_seq(path, is_csv=is_csv, is_split=is_split)
+    
+    if item_seq is None:
+        items = []
+        
+        for item in shard_items(items_open(path, is_csv=is_csv, is_split=is_split), shard):
+            if filter_func is not None and not filter_func(item):
+                continue
+            
+            items.append(item)
+        
+        if not items:
+            return
+        
+        while True:
+            random.shuffle(items)
+            
+            for item in items:
+                # TODO: for Python-3.3+ -- need fix to PEP-0380
+                yield item
+    
+    order = get_item_order(len(item_seq), shard=shard)
+    
+    for item in get_seq_items(item_seq, lambda: lazy_shuffle(order),
+            is_infinite=True, filter_func=filter_func):
+        # TODO: for Python-3.3+ -- need fix to PEP-0380
+        yield item
+
+def _match_title_h1(title):
+    return re.match(
             r'^\<h1\>(?P<h1>[^<>]*)\<\/h1\>$',
             title,
             re.S | re.U,
             )
+
+def clean_title(title):
+    m = _match_title_h1(title)
     
     if m is None:
         return title
@@ -152,31 +435,70 @@ def clean_title(title):
     
     return title
 
+def split_item(item):
+    # positions ``(title_start, title_end, body_start)`` of title (first
+    # line, see ``clean_title()``) and body (rest) of item.
+    # ``None`` if item can not be split
+    
+    title_start = len(item) - len(item.lstrip())
+    line_end = item.find('\n', title_start)
+    
+    if line_end == -1:
+        return
+    
+    title_end = title_start + len(item[title_start:line_end].rstrip())
+    m = _match_title_h1(item[title_start:title_end])
+    
+    if m is not None and m.group('h1'):
+        title_start, title_end = title_start + m.start('h1'), title_start + m.end('h1')
+    
+    body_start = len(item) - len(item[line_end + 1:].lstrip())
+    
+    if title_start == title_end or body_start == len(item):
+        return
+    
+    return title_start, title_end, body_start
+
 def split_title_and_content(items_iter):
     for item in items_iter:
-        spl_item = item.lstrip().split('\n', 1)
+        split = split_item(item)
         
-        if len(spl_item) != 2:
+        if split is None:
             continue
         
-        title, body = spl_item
-        
-        title = clean_title(title.rstrip())
-        body = body.lstrip()
+        title_start, title_end, body_start = split
         
-        if not title or not body:
-            continue
-        
-        yield title, body
+        yield item[title_start:title_end], item[body_start:]
 
-def get_title_and_content(get_func, title_path, content_path):
-    content_iter = get_func(content_path)
+def compile_items(path, is_csv=None, is_compressed=None):
+    # writes items of ``path`` to compiled corpus ``<path>.corpus``, which
+    # ``items_open()`` and random generators use instead of source.
+    # returns path of corpus and count of items
     
+    corpus_path = corpus.get_corpus_path(path)
+    
+    if is_csv:
+        kind = corpus.KIND_CSV
+    else:
+        kind = corpus.KIND_TEXT
+    
+    count = corpus.write_corpus(
+            corpus_path,
+            source_items_open(path, is_csv=is_csv),
+            kind,
+            split_func=split_item,
+            is_compressed=is_compressed,
+            )
+    
+    return corpus_path, count
+
+def get_title_and_content(get_func, title_path, content_path):
     if title_path == '__use_first_line__':
-        for title, content in split_title_and_content(content_iter):
+        for title, content in get_func(content_path, is_split=True):
             # TODO: for Python-3.3+ -- need fix to PEP-0380
             yield title, content
     
+    content_iter = get_func(content_path)
     title_iter = get_func(title_path)
     
     while True:
@@ -0,0 +1,154 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+from html import parser as html_parser
+
+class Tag:
+    # found tag (without childs). ``attrs`` is the same as ``attrs`` of
+    # ``html_parse`` node
+    
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+
+def get_attrs(attrs):
+    return {
+            attr_name: attr_value if attr_value is not None else ''
+            for attr_name, attr_value in attrs
+            }
+
+def match_attrs(tag_attrs, attrs=None, in_attrs=None):
+    # ``attrs`` -- attribute values must be equal.
+    # ``in_attrs`` -- value must be one of space-separated words of attribute
+    # (for example ``class``)
+    
+    if attrs is not None:
+        for attr_name, attr_value in attrs.items():
+            if tag_attrs.get(attr_name) != attr_value:
+                return False
+    
+    if in_attrs is not None:
+        for attr_name, attr_value in in_attrs.items():
+            if attr_value not in tag_attrs.get(attr_name, '').split():
+                return False
+    
+    return True
+
+class TagFinder(html_parser.HTMLParser):
+    # incremental (fed by chunks) finder of tags. ``is_done`` becomes
+    # ``True`` when ``count`` tags are found, so reading of rest of page
+    # can be stopped
+    
+    def __init__(self, name, attrs=None, in_attrs=None, count=None):
+        if count is None:
+            count = 1
+        
+        super().__init__(convert_charrefs=True)
+        
+        self._name = name
+        self._attrs = attrs
+        self._in_attrs = in_attrs
+        self._count = count
+        self.tags = []
+        self.is_done = False
+    
+    def handle_starttag(self, name, attrs):
+        if self.is_done or name != self._name:
+            return
+        
+        tag_attrs = get_attrs(attrs)
+        
+        if not match_attrs(tag_attrs, attrs=self._attrs, in_attrs=self._in_attrs):
+            return
+        
+        self.tags.append(Tag(name, tag_attrs))
+        
+        if len(self.tags) >= self._count:
+            self.is_done = True
+    
+    def handle_startendtag(self, name, attrs):
+        self.handle_starttag(name, attrs)
+
+class FormExtractor(html_parser.HTMLParser):
+    # incremental extractor of ``<input>`` name/value pairs of one form.
+    # form is matched by ``attrs`` and ``in_attrs`` (see ``match_attrs()``).
+    # ``names`` -- only these inputs are wanted (``None`` -- all inputs
+    # which have name). no tree is built. ``is_done`` becomes ``True`` when
+    # form is closed (or when all ``names`` are found)
+    
+    def __init__(self, attrs=None, in_attrs=None, names=None):
+        super().__init__(convert_charrefs=True)
+        
+        self._attrs = attrs
+        self._in_attrs = in_attrs
+        
+        if names is not None:
+            self._names = frozenset(names)
+        else:
+            self._names = None
+        
+        self._is_in_form = False
+        self._found_names = set()
+        # ``(name, value)`` in order of document
+        self.inputs = []
+        self.is_found = False
+        self.is_done = False
+    
+    def get_params(self):
+        # inputs with not empty value. later input overrides earlier one
+        
+        return {name: value for name, value in self.inputs if value}
+    
+    def handle_starttag(self, name, attrs):
+        if self.is_done:
+            return
+        
+        if name == 'form':
+            if not self._is_in_form and \
+                    match_attrs(get_attrs(attrs), attrs=self._attrs, in_attrs=self._in_attrs):
+                self._is_in_form = True
+                self.is_found = True
+            
+            return
+        
+        if name != 'input' or not self._is_in_form:
+            return
+        
+        tag_attrs = get_attrs(attrs)
+        input_name = tag_attrs.get('name')
+        
+        if not input_name or \
+                (self._names is not None and input_name not in self._names):
+            return
+        
+        self.inputs.append((input_name, tag_attrs.get('value', '')))
+        
+        if self._names is not None:
+            self._found_names.add(input_name)
+            
+            if self._found_names == self._names:
+                self.is_done = True
+    
+    def handle_startendtag(self, name, attrs):
+        self.handle_starttag(name, attrs)
+    
+    def handle_endtag(self, name):
+        if name == 'form' and self._is_in_form:
+            self._is_in_form = False
+            self.is_done = True
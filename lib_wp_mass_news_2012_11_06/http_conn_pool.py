@@ -0,0 +1,327 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import time
+import ssl
+import threading
+import collections
+import contextlib
+import functools
+from http import client as http_client
+from urllib import request
+from urllib import error as url_error
+from . import socks5
+
+DEFAULT_POOL_SIZE = 100
+DEFAULT_IDLE_TIMEOUT = 30.0
+
+# errors of reused connection which was closed by server while it was idle.
+# if sending of request fails, request is repeated on new connection. if
+# request is sent, but response fails, server may have processed it, so
+# only idempotent request is repeated (see ``IDEMPOTENT_METHOD_LIST``)
+STALE_ERROR_LIST = (
+        http_client.RemoteDisconnected,
+        http_client.BadStatusLine,
+        ConnectionResetError,
+        ConnectionAbortedError,
+        BrokenPipeError,
+        )
+IDEMPOTENT_METHOD_LIST = ('GET', 'HEAD')
+
+_local = threading.local()
+
+def get_proxy_key(proxy_kwargs):
+    if proxy_kwargs is None:
+        return
+    
+    return tuple(sorted(proxy_kwargs.items()))
+
+@contextlib.contextmanager
+def proxy_key_context(proxy_kwargs):
+    # new connections are made through ``proxy_address`` of ``proxy_kwargs``
+    # (SOCKS5). connections made through different proxies are never mixed
+    # in pool
+    
+    orig_proxy_key = getattr(_local, 'proxy_key', None)
+    _local.proxy_key = get_proxy_key(proxy_kwargs)
+    try:
+        yield
+    finally:
+        _local.proxy_key = orig_proxy_key
+
+class PooledHTTPResponse(http_client.HTTPResponse):
+    # gives connection back to pool when body is read to the end
+    
+    _release = None
+    _is_trailer_read = False
+    
+    def _read_and_discard_trailer(self):
+        super()._read_and_discard_trailer()
+        
+        self._is_trailer_read = True
+    
+    def _close_conn(self):
+        if self.chunked:
+            is_complete = self._is_trailer_read
+        else:
+            is_complete = self.length == 0
+        
+        super()._close_conn()
+        
+        release = self._release
+        self._release = None
+        
+        if release is not None:
+            release(not self.will_close and is_complete)
+
+class PooledHTTPConnection(http_client.HTTPConnection):
+    response_class = PooledHTTPResponse
+
+class PooledHTTPSConnection(http_client.HTTPSConnection):
+    response_class = PooledHTTPResponse
+    
+    def __init__(self, *args, conn_pool=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        
+        self._conn_pool = conn_pool
+    
+    def connect(self):
+        http_client.HTTPConnection.connect(self)
+        
+        if self._tunnel_host:
+            server_hostname = self._tunnel_host
+        else:
+            server_hostname = self.host
+        
+        self.sock = self._context.wrap_socket(
+                self.sock,
+                server_hostname=server_hostname,
+                session=self._conn_pool.get_tls_session(server_hostname, self.port),
+                )
+        
+        self._conn_pool.put_tls_session(server_hostname, self.port, self.sock.session)
+
+class ConnPool:
+    # idle keep-alive connections keyed by ``(scheme, host, proxy)``.
+    # connection is taken out of pool while it is used.
+    # this class is thread-safe
+    
+    def __init__(self, size=None, idle_timeout=None, dns_cache=None):
+        if size is None:
+            size = DEFAULT_POOL_SIZE
+        
+        if idle_timeout is None:
+            idle_timeout = DEFAULT_IDLE_TIMEOUT
+        
+        self._size = size
+        self._idle_timeout = idle_timeout
+        self._lock = threading.Lock()
+        # ``key -> deque of (conn, idle_since)``. most recently used is at right
+        self._conn_map = {}
+        self._count = 0
+        self._tls_context = ssl.create_default_context()
+        self._tls_session_map = {}
+        self.dns_cache = dns_cache
+    
+    def get_tls_context(self):
+        return self._tls_context
+    
+    def get_tls_session(self, host, port):
+        with self._lock:
+            return self._tls_session_map.get((host, port))
+    
+    def put_tls_session(self, host, port, tls_session):
+        if tls_session is None:
+            return
+        
+        with self._lock:
+            self._tls_session_map[host, port] = tls_session
+    
+    def get(self, key):
+        now = time.monotonic()
+        expired_list = []
+        conn = None
+        
+        with self._lock:
+            conn_queue = self._conn_map.get(key)
+            
+            while conn_queue:
+                idle_conn, idle_since = conn_queue.pop()
+                self._count -= 1
+                
+                if now - idle_since > self._idle_timeout or idle_conn.sock is None:
+                    expired_list.append(idle_conn)
+                    continue
+                
+                conn = idle_conn
+                break
+            
+            if not conn_queue:
+                self._conn_map.pop(key, None)
+        
+        for expired_conn in expired_list:
+            expired_conn.close()
+        
+        return conn
+    
+    def put(self, key, conn):
+        now = time.monotonic()
+        evicted_list = []
+        
+        with self._lock:
+            self._conn_map.setdefault(key, collections.deque()).append((conn, now))
+            self._count += 1
+            
+            while self._count > self._size:
+                # evicts the oldest idle connection of all
+                
+                oldest_key = min(
+                        self._conn_map,
+                        key=lambda k: self._conn_map[k][0][1],
+                        )
+                oldest_queue = self._conn_map[oldest_key]
+                evicted_list.append(oldest_queue.popleft()[0])
+                self._count -= 1
+                
+                if not oldest_queue:
+                    del self._conn_map[oldest_key]
+        
+        for evicted_conn in evicted_list:
+            evicted_conn.close()
+    
+    def close(self):
+        with self._lock:
+            conn_map = self._conn_map
+            self._conn_map = {}
+            self._count = 0
+        
+        for conn_queue in conn_map.values():
+            for conn, idle_since in conn_queue:
+                conn.close()
+
+class _PooledHandlerMixin:
+    def _pooled_open(self, conn_factory, req):
+        host = req.host
+        if not host:
+            raise url_error.URLError('no host given')
+        
+        key = req.type, host, getattr(_local, 'proxy_key', None)
+        
+        headers = dict(req.unredirected_hdrs)
+        headers.update({k: v for k, v in req.headers.items() if k not in headers})
+        headers['Connection'] = 'keep-alive'
+        headers = {name.title(): val for name, val in headers.items()}
+        
+        while True:
+            conn = self.conn_pool.get(key)
+            
+            if conn is not None:
+                is_reused = True
+                conn.timeout = req.timeout
+                conn.sock.settimeout(req.timeout)
+            else:
+                is_reused = False
+                conn = conn_factory(host, timeout=req.timeout)
+                
+                if key[2] is not None:
+                    # proxy is set per connection (by ``proxy_key_context()``)
+                    
+                    conn._create_connection = functools.partial(
+                            socks5.create_connection, dict(key[2])['proxy_address'])
+                elif self.conn_pool.dns_cache is not None:
+                    # without proxy only. proxy resolves names itself
+                    conn._create_connection = self.conn_pool.dns_cache.create_connection
+            
+            try:
+                try:
+                    conn.request(req.get_method(), req.selector, req.data, headers,
+                            encode_chunked=req.has_header('Transfer-encoding'))
+                except OSError as e:
+                    if is_reused and isinstance(e, STALE_ERROR_LIST):
+                        conn.close()
+                        continue
+                    
+                    raise url_error.URLError(e)
+                
+                try:
+                    resp = conn.getresponse()
+                except STALE_ERROR_LIST as e:
+                    if not is_reused:
+                        raise
+                    
+                    if req.get_method() not in IDEMPOTENT_METHOD_LIST:
+                        # retry policy of caller decides
+                        
+                        raise url_error.URLError(e)
+                    
+                    conn.close()
+                    continue
+            except:
+                conn.close()
+                raise
+            
+            break
+        
+        def release(is_reusable, conn=conn):
+            if is_reusable and conn.sock is not None:
+                self.conn_pool.put(key, conn)
+            else:
+                conn.close()
+        
+        if resp.will_close:
+            conn.close()
+        else:
+            resp._release = release
+        
+        resp.url = req.get_full_url()
+        resp.msg = resp.reason
+        
+        return resp
+
+class PooledHTTPHandler(_PooledHandlerMixin, request.HTTPHandler):
+    def __init__(self, conn_pool, **kwargs):
+        super().__init__(**kwargs)
+        
+        self.conn_pool = conn_pool
+    
+    def http_open(self, req):
+        if req._tunnel_host:
+            return super().http_open(req)
+        
+        return self._pooled_open(PooledHTTPConnection, req)
+
+class PooledHTTPSHandler(_PooledHandlerMixin, request.HTTPSHandler):
+    def __init__(self, conn_pool, **kwargs):
+        super().__init__(context=conn_pool.get_tls_context(), **kwargs)
+        
+        self.conn_pool = conn_pool
+    
+    def https_open(self, req):
+        if req._tunnel_host:
+            return super().https_open(req)
+        
+        def conn_factory(host, timeout=None):
+            return PooledHTTPSConnection(
+                    host,
+                    timeout=timeout,
+                    context=self.conn_pool.get_tls_context(),
+                    conn_pool=self.conn_pool,
+                    )
+        
+        return self._pooled_open(conn_factory, req)
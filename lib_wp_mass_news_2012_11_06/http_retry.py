@@ -0,0 +1,268 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import time
+import random
+import socket
+import threading
+import collections
+from http import client as http_client
+from urllib import error as url_error
+
+DEFAULT_EXCEPTION_LIST = (
+        http_client.BadStatusLine,
+        )
+DEFAULT_STATUS_LIST = ()
+DEFAULT_COUNT = 5
+DEFAULT_DELAY = 0.5
+DEFAULT_DELAY_MULTIPLIER = 2.0
+DEFAULT_DELAY_MAX = 30.0
+DEFAULT_JITTER = 0.5
+
+DEFAULT_BUDGET_RATIO = 0.1
+DEFAULT_BUDGET_MIN = 10
+DEFAULT_BUDGET_WINDOW = 10
+
+# names of exceptions for config file
+EXCEPTION_MAP = {
+        'BadStatusLine': http_client.BadStatusLine,
+        'RemoteDisconnected': http_client.RemoteDisconnected,
+        'IncompleteRead': http_client.IncompleteRead,
+        'ConnectionResetError': ConnectionResetError,
+        'ConnectionRefusedError': ConnectionRefusedError,
+        'ConnectionAbortedError': ConnectionAbortedError,
+        'timeout': socket.timeout,
+        'URLError': url_error.URLError,
+        }
+
+class TimeBudgetError(socket.timeout):
+    # time budget of task is over (before request is made)
+    pass
+
+def parse_exception_list(exceptions_str):
+    # ``'BadStatusLine, timeout'`` -> tuple of exception classes
+    
+    exception_list = []
+    
+    for exception_name in exceptions_str.split(','):
+        exception_name = exception_name.strip()
+        
+        if not exception_name:
+            continue
+        
+        try:
+            exception_list.append(EXCEPTION_MAP[exception_name])
+        except KeyError:
+            raise ValueError('unknown exception: {!r}'.format(exception_name))
+    
+    return tuple(exception_list)
+
+def parse_status_list(statuses_str):
+    # ``'502, 503'`` -> ``(502, 503)``
+    
+    return tuple(
+            int(status_str)
+            for status_str in statuses_str.split(',')
+            if status_str.strip()
+            )
+
+class RetryBudget:
+    # global limit of retries: retries may not exceed ``ratio`` of requests
+    # (plus ``min_count``) during last ``window`` seconds. when many hosts
+    # fail at once, it stops retries from multiplying the load.
+    # this class is thread-safe
+    
+    def __init__(self, ratio=None, min_count=None, window=None):
+        if ratio is None:
+            ratio = DEFAULT_BUDGET_RATIO
+        
+        if min_count is None:
+            min_count = DEFAULT_BUDGET_MIN
+        
+        if window is None:
+            window = DEFAULT_BUDGET_WINDOW
+        
+        self._ratio = ratio
+        self._min_count = min_count
+        self._window = window
+        self._lock = threading.Lock()
+        # ``[second, requests, retries]`` for each second of window
+        self._bucket_list = collections.deque()
+    
+    def _get_bucket(self):
+        now = int(time.monotonic())
+        
+        while self._bucket_list and self._bucket_list[0][0] <= now - self._window:
+            self._bucket_list.popleft()
+        
+        if not self._bucket_list or self._bucket_list[-1][0] != now:
+            self._bucket_list.append([now, 0, 0])
+        
+        return self._bucket_list[-1]
+    
+    def on_request(self):
+        with self._lock:
+            self._get_bucket()[1] += 1
+    
+    def try_retry(self):
+        # ``True`` (and retry is counted) if budget is not exhausted
+        
+        with self._lock:
+            bucket = self._get_bucket()
+            request_count = sum(b[1] for b in self._bucket_list)
+            retry_count = sum(b[2] for b in self._bucket_list)
+            
+            if retry_count >= self._min_count + self._ratio * request_count:
+                return False
+            
+            bucket[2] += 1
+            
+            return True
+
+class RetryPolicy:
+    # which errors of http request are retried and how long to wait.
+    # ``time_budget`` is limit of time (in seconds) for all requests of one
+    # task: policy returned by ``begin()`` does not retry after it is over
+    
+    def __init__(self, exception_list=None, status_list=None,
+            count=None, delay=None, delay_multiplier=None, delay_max=None,
+            jitter=None, time_budget=None, budget=None):
+        if exception_list is None:
+            exception_list = DEFAULT_EXCEPTION_LIST
+        
+        if status_list is None:
+            status_list = DEFAULT_STATUS_LIST
+        
+        if count is None:
+            count = DEFAULT_COUNT
+        
+        if delay is None:
+            delay = DEFAULT_DELAY
+        
+        if delay_multiplier is None:
+            delay_multiplier = DEFAULT_DELAY_MULTIPLIER
+        
+        if delay_max is None:
+            delay_max = DEFAULT_DELAY_MAX
+        
+        if jitter is None:
+            jitter = DEFAULT_JITTER
+        
+        self.exception_list = tuple(exception_list)
+        self.status_list = tuple(status_list)
+        self.count = count
+        self.delay = delay
+        self.delay_multiplier = delay_multiplier
+        self.delay_max = delay_max
+        self.jitter = jitter
+        self.time_budget = time_budget
+        self.budget = budget
+        self.deadline = None
+    
+    def begin(self):
+        # copy of policy for one task (its deadline starts now)
+        
+        policy = RetryPolicy(
+                exception_list=self.exception_list,
+                status_list=self.status_list,
+                count=self.count,
+                delay=self.delay,
+                delay_multiplier=self.delay_multiplier,
+                delay_max=self.delay_max,
+                jitter=self.jitter,
+                time_budget=self.time_budget,
+                budget=self.budget,
+                )
+        
+        if self.time_budget is not None:
+            policy.deadline = time.monotonic() + self.time_budget
+        
+        return policy
+    
+    def without_retries(self):
+        # copy of policy (with the same deadline) which does not retry. for
+        # requests which must not be repeated (publishing)
+        
+        policy = RetryPolicy(
+                exception_list=self.exception_list,
+                status_list=self.status_list,
+                count=0,
+                time_budget=self.time_budget,
+                budget=self.budget,
+                )
+        policy.deadline = self.deadline
+        
+        return policy
+    
+    def get_timeout(self, timeout):
+        # request timeout which does not go beyond deadline. zero timeout
+        # would mean non-blocking socket (urllib) or no timeout at all
+        # (tornado), so ``TimeBudgetError`` is raised instead
+        
+        if self.deadline is None:
+            return timeout
+        
+        left = self.deadline - time.monotonic()
+        
+        if left <= 0.0:
+            raise TimeBudgetError('time budget of task is over')
+        
+        if timeout is None:
+            return left
+        
+        return min(timeout, left)
+    
+    def get_sleep(self, delay):
+        # ``delay`` which does not go beyond deadline
+        
+        if self.deadline is None:
+            return delay
+        
+        return max(min(delay, self.deadline - time.monotonic()), 0.0)
+    
+    def on_request(self):
+        if self.budget is not None:
+            self.budget.on_request()
+    
+    def is_retryable(self, error):
+        if isinstance(error, TimeBudgetError):
+            return False
+        
+        if isinstance(error, url_error.HTTPError):
+            return error.code in self.status_list
+        
+        return isinstance(error, self.exception_list)
+    
+    def get_retry_delay(self, error, retry_i):
+        # seconds to wait before retry number ``retry_i`` (from 0),
+        # or ``None`` if error must not be retried
+        
+        if retry_i >= self.count or not self.is_retryable(error):
+            return
+        
+        delay = min(self.delay * self.delay_multiplier ** retry_i, self.delay_max)
+        delay -= random.uniform(0.0, delay * self.jitter)
+        
+        if self.deadline is not None and time.monotonic() + delay >= self.deadline:
+            return
+        
+        if self.budget is not None and not self.budget.try_retry():
+            return
+        
+        return delay
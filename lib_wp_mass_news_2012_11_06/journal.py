@@ -0,0 +1,122 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import os, os.path
+import threading
+from . import out_mgr
+
+DEFAULT_EXT = 'journal'
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+def get_journal_file(out_file):
+    if out_file is None:
+        return
+    
+    return out_mgr.change_ext(out_mgr.normalize_ext(out_file), DEFAULT_EXT)
+
+def load_done_set(path):
+    done_set = set()
+    
+    if not os.path.isfile(path):
+        return done_set
+    
+    with open(path, 'r', encoding='utf-8', newline='\n', errors='replace') as fd:
+        for line in fd:
+            if not line.endswith('\n'):
+                # incomplete record (the process was killed while writing)
+                continue
+            
+            record = line.split()
+            
+            if len(record) != 2 or record[0] != 'done':
+                continue
+            
+            try:
+                done_set.add(int(record[1]))
+            except ValueError:
+                continue
+    
+    return done_set
+
+def is_incomplete(path):
+    # ``True`` if last record has no line end
+    
+    if not os.path.isfile(path) or not os.path.getsize(path):
+        return False
+    
+    with open(path, 'rb') as fd:
+        fd.seek(-1, os.SEEK_END)
+        
+        return fd.read(1) != b'\n'
+
+def append_journal(path, src_path):
+    # appends records of journal ``src_path`` to journal ``path``
+    
+    done_set = load_done_set(src_path)
+    is_spoiled = is_incomplete(path)
+    
+    with open(path, 'a', encoding='utf-8', newline='\n') as fd:
+        if is_spoiled:
+            # spoils incomplete record, so it will not be read as valid one
+            fd.write(' -\n')
+        
+        fd.write(''.join('done {}\n'.format(task_i) for task_i in sorted(done_set)))
+
+class Journal:
+    # append-only journal of finished tasks. records are buffered and
+    # written by ``flush()``, so no file I/O is made per task
+    
+    def __init__(self, path, is_resume=None):
+        if is_resume is None:
+            is_resume = False
+        
+        self._lock = threading.Lock()
+        self._buf = []
+        
+        if is_resume:
+            if is_incomplete(path):
+                # spoils incomplete record, so it will not be read as valid one
+                self._buf.append(' -\n')
+            
+            self._fd = open(path, 'a', encoding='utf-8', newline='\n')
+        else:
+            self._fd = out_mgr.create_file(path)
+    
+    def mark_done(self, task_i):
+        # this function is thread-safe
+        
+        with self._lock:
+            self._buf.append('done {}\n'.format(task_i))
+    
+    def flush(self):
+        # this function is thread-safe
+        
+        with self._lock:
+            if not self._buf:
+                return
+            
+            self._fd.write(''.join(self._buf))
+            self._fd.flush()
+            self._buf[:] = ()
+    
+    def close(self):
+        self.flush()
+        
+        with self._lock:
+            self._fd.close()
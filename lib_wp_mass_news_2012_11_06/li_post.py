@@ -17,20 +17,18 @@
 
 assert str is not bytes
 
-import traceback
-import threading
 import json
 import csv
 import weakref
 import random
 from urllib import parse as url
-from http import cookiejar
-from urllib import request
-from tornado import ioloop, stack_context, gen
+from tornado import stack_context, gen
 from . import get_items
 from . import urllib_request_helper
-from . import lib_html_parse
-html_parse = lib_html_parse.import_module('html_parse')
+from . import worker_pool
+from . import auth_session
+from . import html_stream
+from . import http_retry
 
 LI_HTTPS_URL = 'https://www.liveinternet.ru'
 LI_HTTP_URL = 'http://www.liveinternet.ru'
@@ -52,28 +50,9 @@ class PublishLiError(LiError):
 class Task:
     pass
 
-def li_post_blocking(username=None, password=None,
-        title=None, content=None, tags=None, ua_name=None, proxy_kwargs=None):
-    assert username is not None
-    assert password is not None
-    assert title is not None
-    assert content is not None
-    
-    if tags is None:
-        tags = ''
-    
-    if ua_name is None:
-        ua_name = urllib_request_helper.DEFAULT_USER_AGENT_NAME
-    
+def li_auth(opener, username, password, ua_name,
+        proxy_kwargs=None, retry_policy=None):
     li_login_url = url.urljoin(LI_HTTPS_URL, 'member.php')
-    li_pda_url = url.urljoin(LI_HTTPS_URL, 'interface/pda/')
-    
-    cookies = cookiejar.CookieJar()
-    opener = request.build_opener(
-            request.HTTPCookieProcessor(cookiejar=cookies),
-            )
-    
-    # *** PHASE: auth ***
     
     resp = urllib_request_helper.ext_open(
             opener,
@@ -90,20 +69,106 @@ def li_post_blocking(username=None, password=None,
                     }).encode(),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
             )
     
     if resp.getcode() != 200 or \
             (resp.geturl() != LI_HTTPS_URL and resp.geturl() != LI_HTTPS_URL + '/' and
                     resp.geturl() != url.urljoin(LI_HTTP_URL, 'top/')):
         raise AuthLiError('li auth error')
+
+def li_get_user_id(cookies):
+    return cookies._cookies['www.liveinternet.ru']['/']['bbuserid'].value
+
+def li_check_session(opener, addpost_url, ua_name,
+        proxy_kwargs=None, retry_policy=None):
+    # logged-out session is redirected to login page
     
-    # *** PHASE: get params ***
+    resp = urllib_request_helper.ext_open(
+            opener,
+            addpost_url,
+            headers=(
+                    ('User-Agent', ua_name),
+                    ),
+            timeout=urllib_request_helper.DEFAULT_TIMEOUT,
+            proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
+            )
     
-    user_id = cookies._cookies['www.liveinternet.ru']['/']['bbuserid'].value
-    addpost_url = url.urljoin(li_pda_url,
-            '?jid={}&act=addpostform'.format(url.quote_plus(user_id)))
-    blog_url = url.urljoin(LI_HTTPS_URL,
-            'users/{}/'.format(url.quote_plus(user_id)))
+    return resp.getcode() == 200 and resp.geturl() == addpost_url
+
+def li_post_blocking(username=None, password=None,
+        title=None, content=None, tags=None, ua_name=None, proxy_kwargs=None,
+        session_pool=None, retry_policy=None):
+    assert username is not None
+    assert password is not None
+    assert title is not None
+    assert content is not None
+    
+    if tags is None:
+        tags = ''
+    
+    if ua_name is None:
+        ua_name = urllib_request_helper.DEFAULT_USER_AGENT_NAME
+    
+    if retry_policy is not None:
+        # time budget of task starts now
+        retry_policy = retry_policy.begin()
+        publish_retry_policy = retry_policy.without_retries()
+    else:
+        publish_retry_policy = http_retry.RetryPolicy(count=0)
+    
+    li_pda_url = url.urljoin(LI_HTTPS_URL, 'interface/pda/')
+    
+    session_key = 'li', username, password
+    session = auth_session.acquire_session(session_pool, session_key)
+    
+    while True:
+        if session is not None:
+            is_new_session = False
+        else:
+            is_new_session = True
+            
+            # *** PHASE: auth ***
+            
+            session = auth_session.Session()
+            li_auth(session.opener, username, password, ua_name,
+                    proxy_kwargs=proxy_kwargs, retry_policy=retry_policy)
+            auth_session.save_session(session_pool, session_key, session)
+        
+        opener = session.opener
+        
+        # *** PHASE: get params ***
+        
+        try:
+            user_id = li_get_user_id(session.cookies)
+        except KeyError:
+            if is_new_session:
+                raise AuthLiError('li auth error (no user id)')
+            
+            session = None
+            continue
+        
+        addpost_url = url.urljoin(li_pda_url,
+                '?jid={}&act=addpostform'.format(url.quote_plus(user_id)))
+        blog_url = url.urljoin(LI_HTTPS_URL,
+                'users/{}/'.format(url.quote_plus(user_id)))
+        
+        if not is_new_session:
+            # *** PHASE: check session (from pool or saved by previous run) ***
+            
+            # session is checked before publishing, because publishing is not
+            # repeated (failed publishing may be made on server anyway, so
+            # repeating could make duplicate post)
+            
+            if not li_check_session(opener, addpost_url, ua_name,
+                    proxy_kwargs=proxy_kwargs, retry_policy=retry_policy):
+                session = None
+                continue
+            
+            session.is_restored = False
+        
+        break
     
     # *** PHASE: publishing ***
     
@@ -124,18 +189,19 @@ def li_post_blocking(username=None, password=None,
                     }).encode(),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=publish_retry_policy,
             )
     
     if resp.getcode() != 200 or resp.geturl() != addpost_url:
         raise PublishLiError('li publishing error')
     
-    data = resp.read(urllib_request_helper.DEFAULT_RESPONSE_LIMIT).decode(
-            'windows-1251', 'replace')
-    refresh_nodes = tuple(html_parse.find_tags(
-            (html_parse.html_parse(data),),
-            'meta', in_attrs={'http-equiv': 'Refresh'}))
+    refresh_finder = urllib_request_helper.stream_read(
+            resp,
+            html_stream.TagFinder('meta', in_attrs={'http-equiv': 'Refresh'}),
+            encoding='windows-1251',
+            )
     
-    if not refresh_nodes:
+    if not refresh_finder.tags:
         raise PublishLiError('li publishing error (may be limit?)')
     
     # *** PHASE: get post url ***
@@ -148,41 +214,28 @@ def li_post_blocking(username=None, password=None,
                     ),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
             )
     
-    data = resp.read(urllib_request_helper.DEFAULT_RESPONSE_LIMIT).decode(
-            'windows-1251', 'replace')
-    post_link_nodes = tuple(html_parse.find_tags(
-            (html_parse.html_parse(data),),
-            'a', in_attrs={'class': 'TTL'}))
+    post_link_finder = urllib_request_helper.stream_read(
+            resp,
+            html_stream.TagFinder('a', in_attrs={'class': 'TTL'}),
+            encoding='windows-1251',
+            )
     
-    if not post_link_nodes:
+    if not post_link_finder.tags:
         raise PublishLiError('li publishing error (PHASE: get post url)')
     
-    post_url = post_link_nodes[0].attrs['href']
+    post_url = post_link_finder.tags[0].attrs['href']
     
     # *** END ***
     
+    auth_session.release_session(session_pool, session_key, session)
+    
     return post_url
 
 def li_post(*args, callback=None, **kwargs):
-    callback = stack_context.wrap(callback)
-    
-    def li_post_thread():
-        result = None
-        error = None
-        
-        try:
-            result = li_post_blocking(*args, **kwargs)
-        except Exception as e:
-            error = type(e), str(e), traceback.format_exc()
-        
-        if callback is not None:
-            ioloop.IOLoop.instance().add_callback(lambda: callback(result, error))
-    
-    t = threading.Thread(target=li_post_thread)
-    t.daemon = True
-    t.start()
+    worker_pool.run_blocking(li_post_blocking, *args, callback=callback, **kwargs)
 
 def li_acc_save(task_cfg, task):
     fd = task_cfg.out.get_fd(ext='accs.csv')
@@ -205,7 +258,8 @@ def get_li_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
     task_begin_handle = stack_context.wrap(task_begin_handle)
     task_end_handle = stack_context.wrap(task_end_handle)
     
-    raw_accs_iter = get_items.get_random_infinite_items(task_cfg.accs, is_csv=True)
+    raw_accs_iter = get_items.get_random_infinite_items(
+            task_cfg.accs, is_csv=True, shard=task_cfg.acc_shard)
     if task_cfg.tags is not None:
         tags_iter = get_items.get_random_infinite_items(task_cfg.tags)
     else:
@@ -232,7 +286,14 @@ def get_li_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
         
         raise NotImplementedError('not implemented account format')
     
-    for task_i in range(task_cfg.count):
+    for task_i in task_cfg.task_indexes:
+        if task_i is None:
+            # no task yet (see ``work_queue.QueueClient``)
+            
+            yield None
+            
+            continue
+        
         task = Task()
         
         task.i = task_i
@@ -241,6 +302,8 @@ def get_li_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
         task.title, task.content = next(title_and_content_iter)
         task.ua_name = task_cfg.ua_name
         task.proxy_kwargs = task_cfg.proxy_kwargs
+        task.retry_policy = task_cfg.retry_policy
+        task.session_pool = task_cfg.session_pool
         
         if tags_iter is not None:
             tags_list = []
@@ -279,6 +342,8 @@ def li_post_task(task, callback=None):
             content=task.content,
             ua_name=task.ua_name,
             proxy_kwargs=task.proxy_kwargs,
+            retry_policy=task.retry_policy,
+            session_pool=task.session_pool,
             )).args
     
     if task.task_end_handle is not None:
@@ -0,0 +1,171 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import os
+import sys
+import mmap
+import array
+import struct
+import threading
+
+DEFAULT_INDEX_EXT = 'idx'
+
+# magic, size of source file, mtime of source file (ns), count of offsets
+_HEADER = struct.Struct('<8sQQQ')
+_MAGIC = b'WMNIDX01'
+
+class LineIndex:
+    # random access to not empty lines of text file (the same items as
+    # ``get_items.file_items_open()`` gives). file is memory-mapped, and only
+    # requested item is decoded. offsets of lines are cached in
+    # ``<file>.idx`` next to file (if directory is writable), so file is
+    # scanned only once
+    
+    def __init__(self, path):
+        self._path = path
+        self._fd = open(path, 'rb')
+        self._mm = b''
+        self._index_mm = None
+        self._offsets = None
+        
+        try:
+            stat = os.fstat(self._fd.fileno())
+            
+            if stat.st_size:
+                self._mm = mmap.mmap(self._fd.fileno(), 0, access=mmap.ACCESS_READ)
+            
+            self._offsets = self._load_index(stat)
+            
+            if self._offsets is None:
+                self._offsets = self._build_index()
+                self._save_index(stat)
+        except:
+            self.close()
+            raise
+    
+    def get_index_path(self):
+        return '{}.{}'.format(self._path, DEFAULT_INDEX_EXT)
+    
+    def _load_index(self, stat):
+        if sys.byteorder != 'little':
+            # cache is written in little-endian only
+            
+            return
+        
+        try:
+            with open(self.get_index_path(), 'rb') as index_fd:
+                header = index_fd.read(_HEADER.size)
+                
+                if len(header) != _HEADER.size:
+                    return
+                
+                magic, size, mtime_ns, count = _HEADER.unpack(header)
+                
+                if magic != _MAGIC or size != stat.st_size or \
+                        mtime_ns != stat.st_mtime_ns:
+                    return
+                
+                if not count:
+                    return array.array('Q')
+                
+                index_mm = mmap.mmap(index_fd.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+        
+        if len(index_mm) != _HEADER.size + count * 8:
+            index_mm.close()
+            
+            return
+        
+        self._index_mm = index_mm
+        
+        return memoryview(index_mm)[_HEADER.size:].cast('Q')
+    
+    def _build_index(self):
+        # pairs ``start, end`` of not empty lines
+        
+        offsets = array.array('Q')
+        mm = self._mm
+        size = len(mm)
+        pos = 0
+        
+        while pos < size:
+            end = mm.find(b'\n', pos)
+            
+            if end == -1:
+                end = size
+            
+            line = mm[pos:end].strip()
+            
+            if line and (0x20 < line[0] < 0x80 and 0x20 < line[-1] < 0x80 or
+                    line.decode('utf-8', 'replace').strip()):
+                # line is decoded only if it may have not-ASCII spaces at
+                # edges (``str.strip()`` removes them, ``bytes.strip()`` does not)
+                
+                offsets.append(pos)
+                offsets.append(end)
+            
+            pos = end + 1
+        
+        return offsets
+    
+    def _save_index(self, stat):
+        if sys.byteorder != 'little':
+            return
+        
+        index_path = self.get_index_path()
+        temp_path = '{}.{}-{}.tmp'.format(index_path, os.getpid(), threading.get_ident())
+        offsets = self._offsets
+        
+        try:
+            with open(temp_path, 'wb') as index_fd:
+                index_fd.write(_HEADER.pack(
+                        _MAGIC, stat.st_size, stat.st_mtime_ns, len(offsets)))
+                offsets.tofile(index_fd)
+            
+            os.replace(temp_path, index_path)
+        except OSError:
+            # for example, directory is read-only. index is kept in memory only
+            
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+    
+    def __len__(self):
+        return len(self._offsets) // 2
+    
+    def __getitem__(self, i):
+        start = self._offsets[i * 2]
+        end = self._offsets[i * 2 + 1]
+        
+        return self._mm[start:end].decode('utf-8', 'replace').strip()
+    
+    def close(self):
+        if isinstance(self._offsets, memoryview):
+            self._offsets.release()
+        
+        if self._index_mm is not None:
+            self._index_mm.close()
+            self._index_mm = None
+        
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        
+        self._fd.close()
@@ -17,20 +17,17 @@
 
 assert str is not bytes
 
-import traceback
-import threading
 import json
 import csv
 import weakref
 import random
 from urllib import parse as url
-from http import cookiejar
-from urllib import request
-from tornado import ioloop, stack_context, gen
+from tornado import stack_context, gen
 from . import get_items
 from . import urllib_request_helper
-from . import lib_html_parse
-html_parse = lib_html_parse.import_module('html_parse')
+from . import worker_pool
+from . import auth_session
+from . import html_stream
 
 LJ_HTTPS_URL = 'https://www.livejournal.com'
 LJ_HTTP_URL = 'http://www.livejournal.com'
@@ -52,29 +49,11 @@ class PublishLjError(LjError):
 class Task:
     pass
 
-def lj_post_blocking(username=None, password=None,
-        title=None, content=None, tags=None, ua_name=None, proxy_kwargs=None):
-    assert username is not None
-    assert password is not None
-    assert title is not None
-    assert content is not None
-    
-    if tags is None:
-        tags = ''
-    
-    if ua_name is None:
-        ua_name = urllib_request_helper.DEFAULT_USER_AGENT_NAME
-    
+def lj_auth(opener, username, password, ua_name,
+        proxy_kwargs=None, retry_policy=None):
     lj_login_url = url.urljoin(LJ_HTTPS_URL, 'login.bml?ret=1')
     lj_update_url = url.urljoin(LJ_HTTP_URL, 'update.bml')
     
-    cookies = cookiejar.CookieJar()
-    opener = request.build_opener(
-            request.HTTPCookieProcessor(cookiejar=cookies),
-            )
-    
-    # *** PHASE: auth ***
-    
     resp = urllib_request_helper.ext_open(
             opener,
             lj_login_url,
@@ -91,43 +70,85 @@ def lj_post_blocking(username=None, password=None,
                     }).encode(),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
             )
     
     if resp.getcode() != 200 or resp.geturl() != lj_update_url:
         raise AuthLjError('lj auth error')
     
-    # *** PHASE: get params ***
+    return resp
+
+def lj_get_params(resp):
+    return urllib_request_helper.stream_read(
+            resp,
+            html_stream.FormExtractor(
+                    attrs={
+                            'id': 'post',
+                            'method': 'post',
+                            'action': '',
+                            },
+                    ),
+            ).get_params()
+
+def lj_post_blocking(username=None, password=None,
+        title=None, content=None, tags=None, ua_name=None, proxy_kwargs=None,
+        session_pool=None, retry_policy=None):
+    assert username is not None
+    assert password is not None
+    assert title is not None
+    assert content is not None
     
-    data = resp.read(urllib_request_helper.DEFAULT_RESPONSE_LIMIT).decode('utf-8', 'replace')
+    if tags is None:
+        tags = ''
+    
+    if ua_name is None:
+        ua_name = urllib_request_helper.DEFAULT_USER_AGENT_NAME
+    
+    if retry_policy is not None:
+        # time budget of task starts now
+        retry_policy = retry_policy.begin()
+    
+    lj_update_url = url.urljoin(LJ_HTTP_URL, 'update.bml')
     
-    form_html_nodes = tuple(html_parse.find_tags(
-            (html_parse.html_parse(data),),
-            'form',
-            attrs={
-                    'id': 'post',
-                    'method': 'post',
-                    'action': '',
-                    },
-            ))
+    session_key = 'lj', username, password
+    session = auth_session.acquire_session(session_pool, session_key)
+    params = None
     
-    def get_params():
-        params = {}
-        for node in html_parse.find_tags(
-                form_html_nodes,
-                'input',
-                ):
-            name = node.attrs.get('name')
-            if not name:
-                continue
-            value = node.attrs.get('value')
-            if not value:
-                continue
+    if session is not None:
+        # *** PHASE: get params (session from pool) ***
+        
+        resp = urllib_request_helper.ext_open(
+                session.opener,
+                lj_update_url,
+                headers=(
+                        ('User-Agent', ua_name),
+                        ),
+                timeout=urllib_request_helper.DEFAULT_TIMEOUT,
+                proxy_kwargs=proxy_kwargs,
+                retry_policy=retry_policy,
+                )
+        
+        if resp.getcode() == 200 and resp.geturl() == lj_update_url:
+            params = lj_get_params(resp)
+        
+        if params is None or 'lj_form_auth' not in params:
+            # session from pool is logged out
             
-            params[name] = value
+            params = None
+    
+    if params is None:
+        # *** PHASE: auth ***
         
-        return params
+        session = auth_session.Session()
+        resp = lj_auth(session.opener, username, password, ua_name,
+                proxy_kwargs=proxy_kwargs, retry_policy=retry_policy)
+        auth_session.save_session(session_pool, session_key, session)
+        
+        # *** PHASE: get params ***
+        
+        params = lj_get_params(resp)
     
-    params = get_params()
+    opener = session.opener
     
     # *** PHASE: publishing ***
     
@@ -159,6 +180,7 @@ def lj_post_blocking(username=None, password=None,
                     }).encode(),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
             )
     
     if resp.getcode() != 200 or resp.geturl() == lj_update_url:
@@ -166,28 +188,14 @@ def lj_post_blocking(username=None, password=None,
     
     # *** END ***
     
+    auth_session.release_session(session_pool, session_key, session)
+    
     post_url = resp.geturl()
     
     return post_url
 
 def lj_post(*args, callback=None, **kwargs):
-    callback = stack_context.wrap(callback)
-    
-    def lj_post_thread():
-        result = None
-        error = None
-        
-        try:
-            result = lj_post_blocking(*args, **kwargs)
-        except Exception as e:
-            error = type(e), str(e), traceback.format_exc()
-        
-        if callback is not None:
-            ioloop.IOLoop.instance().add_callback(lambda: callback(result, error))
-    
-    t = threading.Thread(target=lj_post_thread)
-    t.daemon = True
-    t.start()
+    worker_pool.run_blocking(lj_post_blocking, *args, callback=callback, **kwargs)
 
 def lj_acc_save(task_cfg, task):
     fd = task_cfg.out.get_fd(ext='accs.csv')
@@ -210,7 +218,8 @@ def get_lj_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
     task_begin_handle = stack_context.wrap(task_begin_handle)
     task_end_handle = stack_context.wrap(task_end_handle)
     
-    raw_accs_iter = get_items.get_random_infinite_items(task_cfg.accs, is_csv=True)
+    raw_accs_iter = get_items.get_random_infinite_items(
+            task_cfg.accs, is_csv=True, shard=task_cfg.acc_shard)
     if task_cfg.tags is not None:
         tags_iter = get_items.get_random_infinite_items(task_cfg.tags)
     else:
@@ -237,7 +246,14 @@ def get_lj_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
         
         raise NotImplementedError('not implemented account format')
     
-    for task_i in range(task_cfg.count):
+    for task_i in task_cfg.task_indexes:
+        if task_i is None:
+            # no task yet (see ``work_queue.QueueClient``)
+            
+            yield None
+            
+            continue
+        
         task = Task()
         
         task.i = task_i
@@ -246,6 +262,8 @@ def get_lj_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
         task.title, task.content = next(title_and_content_iter)
         task.ua_name = task_cfg.ua_name
         task.proxy_kwargs = task_cfg.proxy_kwargs
+        task.retry_policy = task_cfg.retry_policy
+        task.session_pool = task_cfg.session_pool
         
         if tags_iter is not None:
             tags_list = []
@@ -284,6 +302,8 @@ def lj_post_task(task, callback=None):
             tags=task.tags,
             ua_name=task.ua_name,
             proxy_kwargs=task.proxy_kwargs,
+            retry_policy=task.retry_policy,
+            session_pool=task.session_pool,
             )).args
     
     if task.task_end_handle is not None:
@@ -24,8 +24,11 @@ import os, os.path
 import traceback
 import html
 import weakref
+from urllib import parse as url
 from tornado import ioloop
-from . import task, out_mgr
+from . import task, out_mgr, urllib_request_helper, rate_limit, conc_ctrl
+from . import get_items, shard_run, journal, work_queue, auth_session
+from . import http_conn_pool, http_retry, dns_cache, proxy_pool, corpus
 
 DEFAULT_CONFIG_SECTION = 'wp-mass-news'
 DEFAULT_TOR_HOSTNAME = '127.0.0.1'
@@ -56,15 +59,17 @@ def task_end_handle(task_cfg, task):
         error_counter = 0
     
     if task.error is not None:
-        task_cfg.task_error_counter[task] = error_counter + 1
-        if error_counter < task_cfg.error_retry_count:
-            task_cfg.error_retry_list.append(task)
-        
         e_type, e_value, e_tb = task.error
         msg = '[{!r}/{!r}, tr{!r}] {!r}: error: {!r}: {}'.format(
                 task.i, task_cfg.count, error_counter, task.blog_id, e_type, e_value)
         tb_msg = '{}\n\n{}\n\n'.format(msg, e_tb)
         
+        task_cfg.task_error_counter[task] = error_counter + 1
+        if error_counter < task_cfg.error_retry_count:
+            task_cfg.error_retry_list.append(task)
+        elif task_cfg.queue_client is not None:
+            task_cfg.queue_client.fail(task.i, msg)
+        
         print(msg)
         task_cfg.out.write(msg, ext='log')
         task_cfg.out.write(msg, ext='err.log')
@@ -101,26 +106,179 @@ def task_end_handle(task_cfg, task):
     else:
         acc_save()
     
+    if task_cfg.journal is not None:
+        task_cfg.journal.mark_done(task.i)
+    
+    if task_cfg.queue_client is not None:
+        task_cfg.queue_client.complete(task.i, task_result)
+    
     msg = '[{!r}/{!r}, tr{!r}] {!r}: result: {!r}'.format(
             task.i, task_cfg.count, error_counter, task.blog_id, task_result)
     
     print(msg)
     task_cfg.out.write(msg, ext='log')
 
+def stats_handle(task_cfg, stats):
+    msg = 'pool: queue {!r}, busy {!r}/{!r}, done {!r}, utilisation {:.0%}, ' \
+            'retry queue {!r}'.format(
+                    stats['queue'], stats['busy'], stats['size'], stats['done'],
+                    stats['utilisation'], stats['retry'])
+    
+    print(msg)
+    task_cfg.out.write(msg, ext='log')
+
+def queue_error_handle(task_cfg, msg):
+    print(msg)
+    task_cfg.out.write(msg, ext='log')
+    task_cfg.out.write(msg, ext='err.log')
+
+def conc_handle(task_cfg, msg):
+    print(msg)
+    task_cfg.out.write(msg, ext='log')
+
+def dns_prefetch_handle(task_cfg, task_dns_cache, workers=None):
+    # for ``wp:0`` and ``wpapi:0`` -- ``blog_url`` is third column
+    
+    address_list = []
+    
+    for acc_row in get_items.get_finite_items(task_cfg.accs, is_csv=True):
+        if len(acc_row) != 5:
+            continue
+        
+        blog_url_parsed = url.urlparse(acc_row[2])
+        
+        if not blog_url_parsed.hostname:
+            continue
+        
+        address_list.append((
+                blog_url_parsed.hostname,
+                blog_url_parsed.port or (443 if blog_url_parsed.scheme == 'https' else 80),
+                ))
+    
+    dead_map = task_dns_cache.prefetch(address_list, workers=workers)
+    
+    for host, error in sorted(dead_map.items()):
+        msg = 'dns prefetch: dead host {!r}: {}'.format(host, error)
+        print(msg)
+        task_cfg.out.write(msg, ext='log')
+    
+    msg = 'dns prefetch: {!r} hosts, {!r} dead'.format(
+            len(set(host for host, port in address_list)), len(dead_map))
+    print(msg)
+    task_cfg.out.write(msg, ext='log')
+    
+    if address_list and all(host in dead_map for host, port in address_list):
+        raise UserError('all blog hosts are dead')
+    
+    if task_cfg.acc_shard is not None:
+        # accounts of dead hosts are dropped, so shard must have live one
+        
+        shard_host_set = set(
+                url.urlparse(acc_row[2]).hostname
+                for acc_row in get_items.shard_items(
+                        get_items.get_finite_items(task_cfg.accs, is_csv=True),
+                        task_cfg.acc_shard)
+                if len(acc_row) == 5
+                )
+        
+        if shard_host_set and shard_host_set <= set(dead_map):
+            raise UserError('all blog hosts of shard {!r} are dead'.format(task_cfg.acc_shard))
+    
+    task_cfg.dead_hosts = set(dead_map)
+
 def finish_handle(task_cfg):
+    if task_cfg.journal is not None:
+        task_cfg.journal_timer.stop()
+        task_cfg.journal.close()
+    
+    if task_cfg.queue_client is not None:
+        msg = 'queue: {}'.format(', '.join(
+                '{} {!r}'.format(state, count)
+                for state, count in sorted(task_cfg.queue_client.get_counts().items())))
+        print(msg)
+        task_cfg.out.write(msg, ext='log')
+        
+        task_cfg.queue_client.close()
+    
+    urllib_request_helper.close_conn_pool()
+    urllib_request_helper.close_parse_pool()
+    
+    task_proxy_pool = urllib_request_helper.get_proxy_pool()
+    if task_proxy_pool is not None:
+        for proxy_stats in task_proxy_pool.get_stats():
+            if proxy_stats['latency'] is not None:
+                latency_str = '{:.3f}s'.format(proxy_stats['latency'])
+            else:
+                latency_str = '-'
+            
+            msg = 'proxy {}: requests {!r}, errors {!r}, latency {}, down {!r} times'.format(
+                    proxy_stats['name'], proxy_stats['requests'], proxy_stats['errors'],
+                    latency_str, proxy_stats['down'])
+            print(msg)
+            task_cfg.out.write(msg, ext='log')
+        
+        urllib_request_helper.close_proxy_pool()
+    
+    traffic = urllib_request_helper.get_traffic_counter().get()
+    if traffic['body']:
+        msg = 'traffic: received {!r} bytes, decompressed {!r} bytes ' \
+                '(saved by compression {:.0%})'.format(
+                        traffic['wire'], traffic['body'],
+                        1.0 - traffic['wire'] / traffic['body'])
+        print(msg)
+        task_cfg.out.write(msg, ext='log')
+    
     msg = 'done!'
     print(msg)
     task_cfg.out.write(msg, ext='log')
     
     ioloop.IOLoop.instance().stop()
 
+def compile_main(argv):
+    parser = argparse.ArgumentParser(
+            prog='{} compile'.format(os.path.basename(sys.argv[0])),
+            description='compile items source (titles, content, tags, accs) to '
+                    'binary corpus, which is used instead of source.')
+    parser.add_argument('source', metavar='SOURCE',
+            help='path of items source (as it is in config file)')
+    parser.add_argument('--csv', action='store_true',
+            help='source is csv (accs)')
+    parser.add_argument('--compress', action='store_true',
+            help='compress records of corpus')
+    args = parser.parse_args(argv)
+    
+    try:
+        corpus_path, count = get_items.compile_items(
+                args.source, is_csv=args.csv, is_compressed=args.compress)
+    except get_items.NotFoundError as e:
+        raise UserError('compile error: {}'.format(e))
+    
+    print('{!r}: {} items'.format(corpus_path, count))
+
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'compile':
+        compile_main(sys.argv[2:])
+        
+        return
+    
     parser = argparse.ArgumentParser(
-            description='utility for massive posting news to WordPress blogs.')
+            description='utility for massive posting news to WordPress blogs. '
+                    'use "compile SOURCE" for compiling of items source')
     parser.add_argument('cfg', metavar='CONFIG-FILE',
             help='config file for task process')
+    parser.add_argument('--workers', metavar='N', type=int,
+            help='split task process into N child processes')
+    parser.add_argument('--resume', action='store_true',
+            help='skip tasks which are finished according to journal of previous run')
+    parser.add_argument('--shard', type=shard_run.parse_shard,
+            help=argparse.SUPPRESS)
+    parser.add_argument('--shard-out',
+            help=argparse.SUPPRESS)
     args = parser.parse_args()
     
+    if args.workers is not None and args.workers < 1:
+        raise UserError('invalid count of workers: {!r}'.format(args.workers))
+    
     cfg_dir = os.path.dirname(args.cfg)
     config = configparser.ConfigParser()
     task_cfg = TaskConfig()
@@ -137,27 +295,190 @@ def main():
         if task_cfg.tor_port is None:
             task_cfg.tor_port = DEFAULT_TOR_PORT
         
+        socks_proxies = config.get(DEFAULT_CONFIG_SECTION, 'socks_proxies', fallback=None)
+        if socks_proxies is not None:
+            try:
+                socks_proxies = proxy_pool.parse_address_list(
+                        socks_proxies, default_host=DEFAULT_TOR_HOSTNAME)
+            except ValueError as e:
+                raise UserError('config error: invalid socks_proxies: {}'.format(e))
+        
+        proxy_strategy = config.get(DEFAULT_CONFIG_SECTION, 'proxy_strategy', fallback=None)
+        if proxy_strategy is not None and proxy_strategy not in proxy_pool.STRATEGY_LIST:
+            raise UserError('config error: unknown proxy_strategy: {!r}'.format(proxy_strategy))
+        
+        proxy_pool_kwargs = {
+                'strategy': proxy_strategy,
+                'max_errors': config.getint(
+                        DEFAULT_CONFIG_SECTION, 'proxy_max_errors', fallback=None),
+                }
+        for proxy_pool_arg, proxy_pool_opt in (
+                ('check_interval', 'proxy_check_interval'),
+                ('check_timeout', 'proxy_check_timeout'),
+                ('down_time', 'proxy_down_time'),
+                ('max_latency', 'proxy_max_latency'),
+                ):
+            proxy_pool_kwargs[proxy_pool_arg] = config.getfloat(
+                    DEFAULT_CONFIG_SECTION, proxy_pool_opt, fallback=None)
+        
+        task_cfg.http_engine = config.get(DEFAULT_CONFIG_SECTION, 'http_engine', fallback=None)
+        if task_cfg.http_engine is None:
+            task_cfg.http_engine = urllib_request_helper.DEFAULT_HTTP_ENGINE
+        
+        if task_cfg.http_engine not in urllib_request_helper.HTTP_ENGINE_LIST:
+            raise UserError('config error: unknown http_engine: {!r}'.format(
+                    task_cfg.http_engine))
+        
+        http_pool_size = config.getint(
+                DEFAULT_CONFIG_SECTION, 'http_pool_size', fallback=None)
+        if http_pool_size is None:
+            http_pool_size = http_conn_pool.DEFAULT_POOL_SIZE
+        
+        http_pool_idle_timeout = config.getfloat(
+                DEFAULT_CONFIG_SECTION, 'http_pool_idle_timeout', fallback=None)
+        
+        use_dns_cache = config.getboolean(DEFAULT_CONFIG_SECTION, 'dns_cache', fallback=None)
+        if use_dns_cache is None:
+            use_dns_cache = True
+        
+        dns_ttl = config.getfloat(DEFAULT_CONFIG_SECTION, 'dns_ttl', fallback=None)
+        
+        dns_negative_ttl = config.getfloat(
+                DEFAULT_CONFIG_SECTION, 'dns_negative_ttl', fallback=None)
+        
+        dns_prefetch = config.getboolean(DEFAULT_CONFIG_SECTION, 'dns_prefetch', fallback=None)
+        if dns_prefetch is None:
+            dns_prefetch = False
+        
+        dns_prefetch_workers = config.getint(
+                DEFAULT_CONFIG_SECTION, 'dns_prefetch_workers', fallback=None)
+        
+        parse_workers = config.getint(DEFAULT_CONFIG_SECTION, 'parse_workers', fallback=None)
+        if parse_workers is None:
+            parse_workers = 0
+        
+        parse_min_size = config.getint(
+                DEFAULT_CONFIG_SECTION, 'parse_min_size', fallback=None)
+        
+        session_pool_size = config.getint(
+                DEFAULT_CONFIG_SECTION, 'session_pool_size', fallback=None)
+        if session_pool_size is None:
+            session_pool_size = auth_session.DEFAULT_POOL_SIZE
+        
+        session_idle_timeout = config.getfloat(
+                DEFAULT_CONFIG_SECTION, 'session_idle_timeout', fallback=None)
+        
+        session_dir = config.get(DEFAULT_CONFIG_SECTION, 'session_dir', fallback=None)
+        if session_dir is not None:
+            session_dir = os.path.join(cfg_dir, session_dir)
+        
+        http_retry_kwargs = {
+                'count': config.getint(
+                        DEFAULT_CONFIG_SECTION, 'http_retry_count', fallback=None),
+                }
+        for http_retry_arg, http_retry_opt in (
+                ('delay', 'http_retry_delay'),
+                ('delay_multiplier', 'http_retry_delay_multiplier'),
+                ('delay_max', 'http_retry_delay_max'),
+                ('jitter', 'http_retry_jitter'),
+                ('time_budget', 'task_time_budget'),
+                ):
+            http_retry_kwargs[http_retry_arg] = config.getfloat(
+                    DEFAULT_CONFIG_SECTION, http_retry_opt, fallback=None)
+        
+        http_retry_exceptions = config.get(
+                DEFAULT_CONFIG_SECTION, 'http_retry_exceptions', fallback=None)
+        http_retry_statuses = config.get(
+                DEFAULT_CONFIG_SECTION, 'http_retry_statuses', fallback=None)
+        try:
+            if http_retry_exceptions is not None:
+                http_retry_kwargs['exception_list'] = \
+                        http_retry.parse_exception_list(http_retry_exceptions)
+            
+            if http_retry_statuses is not None:
+                http_retry_kwargs['status_list'] = \
+                        http_retry.parse_status_list(http_retry_statuses)
+        except ValueError as e:
+            raise UserError('config error: {}'.format(e))
+        
+        retry_budget_ratio = config.getfloat(
+                DEFAULT_CONFIG_SECTION, 'retry_budget_ratio', fallback=None)
+        
+        retry_budget_min = config.getint(
+                DEFAULT_CONFIG_SECTION, 'retry_budget_min', fallback=None)
+        
         conc = config.getint(DEFAULT_CONFIG_SECTION, 'conc', fallback=None)
         
+        conc_auto = config.getboolean(DEFAULT_CONFIG_SECTION, 'conc_auto', fallback=None)
+        if conc_auto is None:
+            conc_auto = False
+        
+        conc_min = config.getint(DEFAULT_CONFIG_SECTION, 'conc_min', fallback=None)
+        
+        conc_max = config.getint(DEFAULT_CONFIG_SECTION, 'conc_max', fallback=None)
+        
+        conc_interval = config.getfloat(DEFAULT_CONFIG_SECTION, 'conc_interval', fallback=None)
+        
+        conc_target_latency = config.getfloat(
+                DEFAULT_CONFIG_SECTION, 'conc_target_latency', fallback=None)
+        
+        conc_max_error_rate = config.getfloat(
+                DEFAULT_CONFIG_SECTION, 'conc_max_error_rate', fallback=None)
+        
         delay = config.getfloat(DEFAULT_CONFIG_SECTION, 'delay', fallback=None)
         
         error_delay = config.getfloat(DEFAULT_CONFIG_SECTION, 'error_delay', fallback=None)
         
+        stats_interval = config.getfloat(DEFAULT_CONFIG_SECTION, 'stats_interval', fallback=None)
+        
+        rate_limit_kwargs = {}
+        for rate_limit_arg, rate_limit_opt in (
+                ('rate', 'rate_limit'),
+                ('burst', 'rate_limit_burst'),
+                ('host_rate', 'host_rate_limit'),
+                ('host_burst', 'host_rate_limit_burst'),
+                ):
+            rate_limit_kwargs[rate_limit_arg] = config.getfloat(
+                    DEFAULT_CONFIG_SECTION, rate_limit_opt, fallback=None)
+        
         out_file = config.get(DEFAULT_CONFIG_SECTION, 'out', fallback=None)
         if out_file is not None:
             out_file = os.path.join(cfg_dir, out_file)
         
+        # journal of whole run (child process reads it on resume)
+        run_journal_file = journal.get_journal_file(out_file)
+        
+        if args.shard is not None:
+            out_file = args.shard_out
+        
         task_cfg.accs = os.path.join(cfg_dir, config.get(DEFAULT_CONFIG_SECTION, 'accs'))
         
         task_cfg.acc_fmt = config.get(DEFAULT_CONFIG_SECTION, 'acc_fmt')
         
         task_cfg.count = config.getint(DEFAULT_CONFIG_SECTION, 'count')
         
+        task_cfg.wpapi_multicall_size = config.getint(
+                DEFAULT_CONFIG_SECTION, 'wpapi_multicall_size', fallback=None)
+        if task_cfg.wpapi_multicall_size is None:
+            task_cfg.wpapi_multicall_size = 1
+        
+        task_cfg.wpapi_multicall_wait = config.getfloat(
+                DEFAULT_CONFIG_SECTION, 'wpapi_multicall_wait', fallback=None)
+        
         task_cfg.error_retry_count = config.getint(
                 DEFAULT_CONFIG_SECTION, 'error_retry_count', fallback=None)
         if task_cfg.error_retry_count is None:
             task_cfg.error_retry_count = 0
         
+        error_retry_delay = config.getfloat(
+                DEFAULT_CONFIG_SECTION, 'error_retry_delay', fallback=None)
+        
+        error_retry_delay_multiplier = config.getfloat(
+                DEFAULT_CONFIG_SECTION, 'error_retry_delay_multiplier', fallback=None)
+        
+        error_retry_delay_max = config.getfloat(
+                DEFAULT_CONFIG_SECTION, 'error_retry_delay_max', fallback=None)
+        
         if not task_cfg.acc_fmt.startswith('ff:'):
             task_cfg.titles = config.get(DEFAULT_CONFIG_SECTION, 'titles')
         else:
@@ -171,9 +492,53 @@ def main():
             task_cfg.tags = os.path.join(cfg_dir, task_cfg.tags)
         
         task_cfg.content = os.path.join(cfg_dir, config.get(DEFAULT_CONFIG_SECTION, 'content'))
+        
+        queue_spec = config.get(DEFAULT_CONFIG_SECTION, 'queue', fallback=None)
+        
+        queue_node = config.get(DEFAULT_CONFIG_SECTION, 'queue_node', fallback=None)
+        
+        queue_batch = config.getint(DEFAULT_CONFIG_SECTION, 'queue_batch', fallback=None)
+        
+        queue_lease = config.getfloat(DEFAULT_CONFIG_SECTION, 'queue_lease', fallback=None)
     except configparser.Error as e:
         raise UserError('config error: {}'.format(e))
     
+    journal_file = journal.get_journal_file(out_file)
+    
+    if args.resume and journal_file is None:
+        # also before forking of shards (each of them needs journal)
+        
+        raise UserError('resume is not possible without out file')
+    
+    if args.resume and queue_spec is not None:
+        # queue keeps finished tasks itself. skipping of leased tasks (without
+        # completing them) would hold their leases forever
+        
+        raise UserError('resume is not needed with queue (it keeps finished tasks)')
+    
+    if args.shard is None and journal_file is not None:
+        # journals of child processes (left by killed run, or by run with
+        # other count of them) are merged into journal of run
+        
+        if args.resume:
+            shard_run.merge_shard_journals(out_file)
+        else:
+            shard_run.set_aside_journals(out_file)
+    
+    try:
+        # compiled corpus of wrong kind is found before forking of shards
+        
+        for items_path, is_csv in (
+                (task_cfg.accs, True),
+                (task_cfg.titles, False),
+                (task_cfg.tags, False),
+                (task_cfg.content, False),
+                ):
+            if items_path is not None and items_path != '__use_first_line__':
+                get_items.find_corpus(items_path, is_csv=is_csv)
+    except corpus.CorpusError as e:
+        raise UserError('corpus error: {}'.format(e))
+    
     task_cfg.out = out_mgr.OutMgr(out_file=out_file)
     task_cfg.out.get_fd()
     task_cfg.out.get_fd(ext='log')
@@ -182,16 +547,174 @@ def main():
     task_cfg.out.get_fd(ext='err-tb.log')
     task_cfg.out.get_fd(ext='accs.csv')
     
+    if args.workers is not None and args.workers > 1 and args.shard is None:
+        acc_count = sum(1 for acc_row in get_items.get_finite_items(task_cfg.accs, is_csv=True))
+        workers = min(args.workers, acc_count, task_cfg.count)
+        
+        if workers > 1:
+            if args.resume:
+                extra_args = ('--resume',)
+            else:
+                extra_args = None
+            
+            exit_code_list = shard_run.run_shards(
+                    args.cfg, out_file, workers, extra_args=extra_args)
+            shard_run.merge_shard_outputs(task_cfg.out, out_file, workers)
+            
+            for shard_i, exit_code in enumerate(exit_code_list):
+                if exit_code:
+                    msg = 'worker {!r}/{!r}: exit code {!r}'.format(shard_i, workers, exit_code)
+                    print(msg)
+                    task_cfg.out.write(msg, ext='log')
+                    task_cfg.out.write(msg, ext='err.log')
+            
+            msg = 'done!'
+            print(msg)
+            task_cfg.out.write(msg, ext='log')
+            
+            return
+    
+    if args.shard is not None:
+        task_cfg.acc_shard = args.shard
+        task_cfg.task_indexes = range(args.shard[0], task_cfg.count, args.shard[1])
+    else:
+        task_cfg.acc_shard = None
+        task_cfg.task_indexes = range(task_cfg.count)
+    
+    if queue_spec is not None:
+        if queue_node is not None and args.shard is not None:
+            queue_node = '{}:{}'.format(queue_node, args.shard[0])
+        
+        queue_backend = work_queue.open_backend(queue_spec, base_dir=cfg_dir)
+        queue_backend.init_tasks(task_cfg.count)
+        
+        task_cfg.queue_client = work_queue.QueueClient(
+                queue_backend,
+                node=queue_node,
+                batch_size=queue_batch,
+                lease_time=queue_lease,
+                error_callback=lambda msg: queue_error_handle(task_cfg, msg),
+                )
+        task_cfg.task_indexes = task_cfg.queue_client.iter_indexes()
+    else:
+        task_cfg.queue_client = None
+    
+    if args.resume:
+        done_set = journal.load_done_set(journal_file)
+        
+        if args.shard is not None and run_journal_file is not None:
+            done_set |= journal.load_done_set(run_journal_file)
+        task_cfg.task_indexes = (
+                task_i for task_i in task_cfg.task_indexes if task_i not in done_set)
+        
+        msg = 'resume: {!r} finished tasks are skipped'.format(len(done_set))
+        print(msg)
+        task_cfg.out.write(msg, ext='log')
+    
+    if journal_file is not None:
+        task_cfg.journal = journal.Journal(journal_file, is_resume=args.resume)
+        task_cfg.journal_timer = ioloop.PeriodicCallback(
+                task_cfg.journal.flush,
+                journal.DEFAULT_FLUSH_INTERVAL * 1000.0,
+                )
+        task_cfg.journal_timer.start()
+    else:
+        task_cfg.journal = None
+    
     task_cfg.task_error_counter = weakref.WeakKeyDictionary()
     task_cfg.error_retry_list = []
     
+    if task_cfg.http_engine == 'async':
+        if not task_cfg.acc_fmt.startswith('wpapi:'):
+            raise UserError('http_engine {!r} is not implemented for account type {!r}'.format(
+                    task_cfg.http_engine, task_cfg.acc_fmt))
+        
+        urllib_request_helper.init_async_client(
+                max_clients=conc if conc is not None else task.DEFAULT_CONCURRENCE)
+    
     if task_cfg.use_tor:
         task_cfg.proxy_kwargs = {
                 'proxy_address': (DEFAULT_TOR_HOSTNAME, task_cfg.tor_port),
                 }
+        
+        if socks_proxies:
+            urllib_request_helper.init_proxy_pool(socks_proxies, **proxy_pool_kwargs)
     else:
         task_cfg.proxy_kwargs = None
     
+    task_cfg.retry_policy = http_retry.RetryPolicy(
+            budget=http_retry.RetryBudget(
+                    ratio=retry_budget_ratio,
+                    min_count=retry_budget_min,
+                    ),
+            **http_retry_kwargs)
+    
+    if use_dns_cache and not task_cfg.use_tor:
+        task_dns_cache = dns_cache.DnsCache(ttl=dns_ttl, negative_ttl=dns_negative_ttl)
+    else:
+        task_dns_cache = None
+    
+    if http_pool_size > 0 or task_dns_cache is not None or task_cfg.proxy_kwargs is not None:
+        # dns cache and proxy are used by connections of pool. pool with zero
+        # size does not keep connections
+        
+        urllib_request_helper.init_conn_pool(
+                size=http_pool_size,
+                idle_timeout=http_pool_idle_timeout,
+                dns_cache=task_dns_cache,
+                )
+    
+    if parse_workers > 0:
+        urllib_request_helper.init_parse_pool(
+                workers=parse_workers, min_size=parse_min_size)
+    
+    task_cfg.dead_hosts = set()
+    
+    if dns_prefetch and task_dns_cache is not None and \
+            task_cfg.acc_fmt in ('wp:0', 'wpapi:0'):
+        dns_prefetch_handle(task_cfg, task_dns_cache, workers=dns_prefetch_workers)
+    
+    if session_dir is not None:
+        session_store = auth_session.SessionStore(session_dir)
+    else:
+        session_store = None
+    
+    if session_pool_size > 0 or session_store is not None:
+        task_cfg.session_pool = auth_session.SessionPool(
+                size=session_pool_size,
+                idle_timeout=session_idle_timeout,
+                store=session_store,
+                )
+    else:
+        task_cfg.session_pool = None
+    
+    if args.shard is not None:
+        # limits are shared by child processes
+        rate_limit_kwargs['scale'] = 1.0 / args.shard[1]
+    
+    rate_limiter = rate_limit.RateLimiter(**rate_limit_kwargs)
+    if not rate_limiter.is_active():
+        rate_limiter = None
+    
+    if conc_auto:
+        if conc_max is None:
+            conc_max = conc if conc is not None else task.DEFAULT_CONCURRENCE
+        
+        if conc_min is not None and conc_min > conc_max:
+            raise UserError('config error: conc_min is greater than conc_max')
+        
+        task_conc_ctrl = conc_ctrl.AimdController(
+                conc_max,
+                min_conc=conc_min,
+                conc=conc,
+                interval=conc_interval,
+                target_latency=conc_target_latency,
+                max_error_rate=conc_max_error_rate,
+                log_callback=lambda msg: conc_handle(task_cfg, msg),
+                )
+    else:
+        task_conc_ctrl = None
+    
     get_task_list = lambda get_task_list_func: get_task_list_func(
             task_cfg,
             task_begin_handle=lambda task: task_begin_handle(task_cfg, task),
@@ -233,7 +756,17 @@ def main():
             conc=conc,
             delay=delay,
             error_delay=error_delay,
+            retry_delay=error_retry_delay,
+            retry_delay_multiplier=error_retry_delay_multiplier,
+            retry_delay_max=error_retry_delay_max,
+            rate_limiter=rate_limiter,
+            conc_ctrl=task_conc_ctrl,
+            stats_interval=stats_interval,
+            stats_callback=lambda stats: stats_handle(task_cfg, stats),
             callback=lambda: finish_handle(task_cfg),
             )
     
     ioloop.IOLoop.instance().start()
+    
+    if task_cfg.queue_client is not None and task_cfg.queue_client.is_failed:
+        raise UserError('queue error (see err log)')
@@ -0,0 +1,79 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import os
+import multiprocessing
+from concurrent import futures
+
+DEFAULT_MIN_SIZE = 65536
+DEFAULT_CHUNK_SIZE = 16384
+
+def parse(parser, data, encoding, chunk_size=None):
+    # runs in child process. ``parser`` is fresh incremental parser
+    # (``html_stream.TagFinder``, ``html_stream.FormExtractor``).
+    # returned parser has only extracted fields (not the page)
+    
+    if chunk_size is None:
+        chunk_size = DEFAULT_CHUNK_SIZE
+    
+    text = data.decode(encoding, 'replace')
+    
+    for chunk_pos in range(0, len(text), chunk_size):
+        if parser.is_done:
+            break
+        
+        parser.feed(text[chunk_pos:chunk_pos + chunk_size])
+    
+    if not parser.is_done:
+        parser.close()
+    
+    parser.rawdata = ''
+    
+    return parser
+
+class ParsePool:
+    # parsing of pages in child processes, so it does not hold GIL of
+    # network threads. raw bytes are sent to child, parser with extracted
+    # fields is returned. small pages are parsed in place (sending them
+    # to child costs more than parsing)
+    
+    def __init__(self, workers=None, min_size=None):
+        if workers is None:
+            workers = os.cpu_count() or 1
+        
+        if min_size is None:
+            min_size = DEFAULT_MIN_SIZE
+        
+        # children are not forked from process which has running threads
+        self._executor = futures.ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('forkserver'),
+                )
+        self._min_size = min_size
+    
+    def parse(self, parser, data, encoding):
+        # this function is thread-safe. it blocks until parsing is done
+        
+        if len(data) < self._min_size:
+            return parse(parser, data, encoding)
+        
+        return self._executor.submit(parse, parser, data, encoding).result()
+    
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,251 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import time
+import socket
+import threading
+from . import socks5
+
+STRATEGY_LIST = ('round-robin', 'least-in-flight')
+DEFAULT_STRATEGY = 'round-robin'
+DEFAULT_CHECK_INTERVAL = 30.0
+DEFAULT_CHECK_TIMEOUT = 10.0
+DEFAULT_DOWN_TIME = 60.0
+DEFAULT_MAX_ERRORS = 5
+
+def parse_address_list(addresses_str, default_host=None):
+    # ``'127.0.0.1:9050, 9052'`` -> ``[('127.0.0.1', 9050), ('127.0.0.1', 9052)]``
+    
+    if default_host is None:
+        default_host = '127.0.0.1'
+    
+    address_list = []
+    
+    for address_str in addresses_str.split(','):
+        address_str = address_str.strip()
+        
+        if not address_str:
+            continue
+        
+        host, sep, port_str = address_str.rpartition(':')
+        
+        if not sep:
+            host = default_host
+        
+        address_list.append((host, int(port_str)))
+    
+    return address_list
+
+def check_socks5(address, timeout=None):
+    # SOCKS5 greeting (without authentication). returns latency in seconds
+    
+    if timeout is None:
+        timeout = DEFAULT_CHECK_TIMEOUT
+    
+    started = time.monotonic()
+    
+    with socket.create_connection(address, timeout=timeout) as sock:
+        sock.sendall(socks5.GREETING)
+        reply = b''
+        
+        while len(reply) < len(socks5.GREETING_REPLY):
+            chunk = sock.recv(len(socks5.GREETING_REPLY) - len(reply))
+            
+            if not chunk:
+                break
+            
+            reply += chunk
+    
+    socks5.check_greeting_reply(reply)
+    
+    return time.monotonic() - started
+
+class ProxyEndpoint:
+    def __init__(self, address):
+        self.address = address
+        self.in_flight = 0
+        self.request_count = 0
+        self.error_count = 0
+        self.latency_sum = 0.0
+        self.check_latency = None
+        self.down_count = 0
+        self.down_until = None
+        self.serial_error_count = 0
+    
+    def get_name(self):
+        return '{}:{}'.format(*self.address)
+
+class ProxyPool:
+    # several SOCKS endpoints (for example, several Tor instances).
+    # endpoints which fail health check (or too many requests in series),
+    # or which are slower than ``max_latency``, are not used for ``down_time``
+    # seconds. this class is thread-safe
+    
+    def __init__(self, address_list, strategy=None,
+            check_interval=None, check_timeout=None, down_time=None,
+            max_latency=None, max_errors=None):
+        if strategy is None:
+            strategy = DEFAULT_STRATEGY
+        
+        if check_interval is None:
+            check_interval = DEFAULT_CHECK_INTERVAL
+        
+        if check_timeout is None:
+            check_timeout = DEFAULT_CHECK_TIMEOUT
+        
+        if down_time is None:
+            down_time = DEFAULT_DOWN_TIME
+        
+        if max_errors is None:
+            max_errors = DEFAULT_MAX_ERRORS
+        
+        assert address_list
+        assert strategy in STRATEGY_LIST
+        
+        self._endpoint_list = [ProxyEndpoint(address) for address in address_list]
+        self._strategy = strategy
+        self._check_interval = check_interval
+        self._check_timeout = check_timeout
+        self._down_time = down_time
+        self._max_latency = max_latency
+        self._max_errors = max_errors
+        self._lock = threading.Lock()
+        self._next_i = 0
+        self._stop_event = threading.Event()
+        self._check_thread = None
+    
+    def _mark_down(self, endpoint):
+        if endpoint.down_until is None:
+            endpoint.down_count += 1
+        
+        endpoint.down_until = time.monotonic() + self._down_time
+    
+    def _is_up(self, endpoint, now):
+        return endpoint.down_until is None or endpoint.down_until <= now
+    
+    def acquire(self):
+        now = time.monotonic()
+        
+        with self._lock:
+            up_list = [e for e in self._endpoint_list if self._is_up(e, now)]
+            
+            if not up_list:
+                # all are down -- the one which will be up soonest
+                up_list = [min(self._endpoint_list, key=lambda e: e.down_until)]
+            
+            if self._strategy == 'least-in-flight':
+                endpoint = min(up_list, key=lambda e: e.in_flight)
+            else:
+                endpoint = up_list[self._next_i % len(up_list)]
+                self._next_i += 1
+            
+            endpoint.in_flight += 1
+            
+            return endpoint
+    
+    def release(self, endpoint, latency, is_error):
+        with self._lock:
+            endpoint.in_flight -= 1
+            endpoint.request_count += 1
+            endpoint.latency_sum += latency
+            
+            if not is_error:
+                endpoint.serial_error_count = 0
+                
+                return
+            
+            endpoint.error_count += 1
+            endpoint.serial_error_count += 1
+            
+            if endpoint.serial_error_count >= self._max_errors:
+                endpoint.serial_error_count = 0
+                self._mark_down(endpoint)
+    
+    def _check_endpoint(self, endpoint):
+        try:
+            latency = check_socks5(endpoint.address, timeout=self._check_timeout)
+        except OSError:
+            latency = None
+        
+        with self._lock:
+            endpoint.check_latency = latency
+            
+            if latency is None or \
+                    (self._max_latency is not None and latency > self._max_latency):
+                self._mark_down(endpoint)
+            elif endpoint.down_until is not None and \
+                    endpoint.down_until <= time.monotonic():
+                endpoint.down_until = None
+    
+    def check(self):
+        # endpoints are checked at once, so dead ones (waiting for
+        # ``check_timeout``) do not delay each other
+        
+        thread_list = [
+                threading.Thread(target=self._check_endpoint, args=(endpoint,))
+                for endpoint in self._endpoint_list
+                ]
+        
+        for thread in thread_list:
+            thread.start()
+        
+        for thread in thread_list:
+            thread.join()
+    
+    def _check_thread_func(self):
+        while not self._stop_event.wait(self._check_interval):
+            self.check()
+    
+    def start(self):
+        # first check is made here (not after ``check_interval``), so dead
+        # endpoints are down before the pool is used
+        
+        assert self._check_thread is None
+        
+        self.check()
+        
+        self._check_thread = threading.Thread(target=self._check_thread_func)
+        self._check_thread.daemon = True
+        self._check_thread.start()
+    
+    def stop(self):
+        if self._check_thread is None:
+            return
+        
+        self._stop_event.set()
+        self._check_thread = None
+    
+    def get_stats(self):
+        now = time.monotonic()
+        
+        with self._lock:
+            return [
+                    {
+                            'name': endpoint.get_name(),
+                            'in_flight': endpoint.in_flight,
+                            'requests': endpoint.request_count,
+                            'errors': endpoint.error_count,
+                            'latency': endpoint.latency_sum / endpoint.request_count
+                                    if endpoint.request_count else None,
+                            'check_latency': endpoint.check_latency,
+                            'down': endpoint.down_count,
+                            'is_up': self._is_up(endpoint, now),
+                            }
+                    for endpoint in self._endpoint_list
+                    ]
@@ -0,0 +1,153 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+from urllib import parse as url
+from tornado import ioloop, stack_context
+
+class TokenBucket:
+    def __init__(self, rate, burst=None):
+        if burst is None:
+            burst = max(rate, 1.0)
+        
+        assert rate > 0.0
+        assert burst >= 1.0
+        
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._time = None
+    
+    def _refill(self, now):
+        if self._time is not None:
+            self._tokens = min(
+                    self._tokens + (now - self._time) * self._rate,
+                    self._burst,
+                    )
+        
+        self._time = now
+    
+    def get_wait(self, now):
+        # seconds before one token will be available
+        
+        self._refill(now)
+        
+        if self._tokens >= 1.0:
+            return 0.0
+        
+        return (1.0 - self._tokens) / self._rate
+    
+    def take(self, now):
+        self._refill(now)
+        self._tokens -= 1.0
+
+def get_host(blog_id):
+    blog_url_parsed = url.urlparse(blog_id)
+    
+    if blog_url_parsed.scheme in ('https', 'http') and blog_url_parsed.hostname:
+        return blog_url_parsed.hostname
+    
+    # for ``lj:``, ``li:`` and ``ff:`` -- ``blog_id`` is account-id
+    
+    return blog_id
+
+def _scale_rate(rate, scale):
+    if rate is None:
+        return
+    
+    return rate * scale
+
+def _scale_burst(burst, scale):
+    if burst is None:
+        return
+    
+    # bucket must hold at least one token
+    return max(burst * scale, 1.0)
+
+class RateLimiter:
+    # limits rate of tasks (posts per second) globally (config keys
+    # ``rate_limit``, ``rate_limit_burst``) and per host (``host_rate_limit``,
+    # ``host_rate_limit_burst``). one process serves one platform (one
+    # ``acc_fmt``), so global limit is limit of platform as well.
+    # ``scale`` is share of limits for this process: with ``--workers N``
+    # each child process has ``1/N`` of them (accounts of one host may be in
+    # any child process), so limits hold for whole run.
+    # this class must be used from IOLoop thread
+    
+    def __init__(self,
+            rate=None, burst=None,
+            host_rate=None, host_burst=None,
+            scale=None):
+        if scale is not None:
+            rate, burst, host_rate, host_burst = (
+                    _scale_rate(rate, scale), _scale_burst(burst, scale),
+                    _scale_rate(host_rate, scale), _scale_burst(host_burst, scale),
+                    )
+        
+        self._io_loop = ioloop.IOLoop.instance()
+        self._host_rate = host_rate
+        self._host_burst = host_burst
+        self._host_bucket_map = {}
+        
+        if rate is not None:
+            self._bucket = TokenBucket(rate, burst=burst)
+        else:
+            self._bucket = None
+    
+    def is_active(self):
+        return self._bucket is not None or self._host_rate is not None
+    
+    def _get_bucket_list(self, task):
+        bucket_list = []
+        
+        if self._bucket is not None:
+            bucket_list.append(self._bucket)
+        
+        if self._host_rate is not None:
+            host = get_host(task.blog_id)
+            
+            try:
+                host_bucket = self._host_bucket_map[host]
+            except KeyError:
+                self._host_bucket_map[host] = host_bucket = TokenBucket(
+                        self._host_rate, burst=self._host_burst)
+            
+            bucket_list.append(host_bucket)
+        
+        return bucket_list
+    
+    def acquire(self, task, callback=None):
+        callback = stack_context.wrap(callback)
+        bucket_list = self._get_bucket_list(task)
+        
+        def try_acquire():
+            now = self._io_loop.time()
+            wait = max([bucket.get_wait(now) for bucket in bucket_list] + [0.0])
+            
+            if wait > 0.0:
+                self._io_loop.add_timeout(now + wait, try_acquire)
+                
+                return
+            
+            for bucket in bucket_list:
+                bucket.take(now)
+            
+            if callback is not None:
+                callback()
+        
+        try_acquire()
@@ -0,0 +1,138 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import sys
+import os, os.path
+import glob
+import subprocess
+from . import out_mgr
+from . import journal
+
+MERGE_CHUNK_SIZE = 1000000
+OUT_EXT_LIST = ('txt', 'log', 'anc.txt', 'err.log', 'err-tb.log', 'accs.csv')
+
+def parse_shard(shard_str):
+    # ``'I/N'`` -> ``(I, N)``
+    
+    shard_i, shard_n = map(int, shard_str.split('/', 1))
+    
+    if not 0 <= shard_i < shard_n:
+        raise ValueError('invalid shard: {!r}'.format(shard_str))
+    
+    return shard_i, shard_n
+
+def get_shard_out_file(out_file, shard_i):
+    if out_file is None:
+        return
+    
+    return '{}.shard-{}'.format(
+            out_mgr.normalize_ext(out_file).rsplit('.', 1)[0], shard_i)
+
+def get_shard_journal_list(out_file):
+    # journals of child processes (of any count of them) which are not
+    # merged yet
+    
+    if out_file is None:
+        return []
+    
+    return sorted(glob.glob('{}.shard-*.{}'.format(
+            glob.escape(out_mgr.normalize_ext(out_file).rsplit('.', 1)[0]),
+            journal.DEFAULT_EXT)))
+
+def merge_shard_journals(out_file):
+    # appends journals of child processes to journal of ``out_file`` and
+    # removes them. records are global task indexes, so count of child
+    # processes does not matter
+    
+    journal_file = journal.get_journal_file(out_file)
+    
+    for shard_journal_file in get_shard_journal_list(out_file):
+        journal.append_journal(journal_file, shard_journal_file)
+        os.remove(shard_journal_file)
+
+def set_aside_journals(out_file):
+    # for new (not resumed) run. journals of previous run are renamed
+    # (as ``out_mgr.create_file()`` does), so resume does not read them
+    
+    journal_file = journal.get_journal_file(out_file)
+    
+    for old_journal_file in [journal_file] + get_shard_journal_list(out_file):
+        if os.path.exists(old_journal_file):
+            out_mgr.rename_to_last(old_journal_file)
+
+def run_shards(cfg_path, out_file, workers, extra_args=None):
+    # starts ``workers`` child processes (each with its own IOLoop)
+    # and waits for them. returns list of exit codes
+    
+    if extra_args is None:
+        extra_args = ()
+    
+    proc_list = []
+    
+    for shard_i in range(workers):
+        cmd = [
+                sys.executable,
+                sys.argv[0],
+                cfg_path,
+                '--shard', '{}/{}'.format(shard_i, workers),
+                ]
+        
+        shard_out_file = get_shard_out_file(out_file, shard_i)
+        if shard_out_file is not None:
+            cmd += ['--shard-out', shard_out_file]
+        
+        cmd += extra_args
+        
+        proc_list.append(subprocess.Popen(cmd))
+    
+    return [proc.wait() for proc in proc_list]
+
+def merge_shard_outputs(out, out_file, workers, ext_list=None):
+    # appends outputs of child processes to files of ``out``
+    # (``out_mgr.OutMgr``) and their journals to journal of ``out_file``,
+    # and removes them
+    
+    if ext_list is None:
+        ext_list = OUT_EXT_LIST
+    
+    if out_file is None:
+        return
+    
+    for shard_i in range(workers):
+        shard_out_file = out_mgr.normalize_ext(get_shard_out_file(out_file, shard_i))
+        
+        for ext in ext_list:
+            shard_path = out_mgr.change_ext(shard_out_file, ext)
+            
+            if not os.path.isfile(shard_path):
+                continue
+            
+            with open(shard_path, 'r', encoding='utf-8', newline='\n', errors='replace') \
+                    as shard_fd:
+                while True:
+                    data = shard_fd.read(MERGE_CHUNK_SIZE)
+                    
+                    if not data:
+                        break
+                    
+                    out.write(data, ext=ext, end='')
+            
+            os.remove(shard_path)
+    
+    merge_shard_journals(out_file)
@@ -0,0 +1,435 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import io
+import time
+import ssl
+import socket
+import struct
+from urllib import parse as url
+from tornado import ioloop, iostream, stack_context, httpclient, httputil
+
+# greeting without authentication, and its successful reply
+GREETING = b'\x05\x01\x00'
+GREETING_REPLY = b'\x05\x00'
+
+DEFAULT_TIMEOUT = 60.0
+
+REPLY_ERROR_MAP = {
+        0x01: 'general SOCKS server failure',
+        0x02: 'connection not allowed by ruleset',
+        0x03: 'network unreachable',
+        0x04: 'host unreachable',
+        0x05: 'connection refused',
+        0x06: 'TTL expired',
+        0x07: 'command not supported',
+        0x08: 'address type not supported',
+        }
+
+class SocksError(OSError):
+    pass
+
+def get_connect_request(address):
+    # CONNECT by domain name. name is resolved by proxy (Tor needs it)
+    
+    host, port = address
+    host_bytes = host.encode('idna')
+    
+    if len(host_bytes) > 255:
+        raise SocksError('too long host name: {!r}'.format(host))
+    
+    return b'\x05\x01\x00\x03' + bytes((len(host_bytes),)) + host_bytes + \
+            struct.pack('!H', port)
+
+def check_greeting_reply(reply):
+    if reply != GREETING_REPLY:
+        raise SocksError('invalid SOCKS5 greeting reply: {!r}'.format(reply))
+
+def get_reply_tail_size(reply_head):
+    # ``reply_head`` is first 5 bytes of CONNECT reply: version, status,
+    # reserved, address type and first byte of address. returns size of rest
+    # of reply (address and port)
+    
+    if reply_head[0] != 0x05:
+        raise SocksError('invalid SOCKS5 reply: {!r}'.format(reply_head))
+    
+    if reply_head[1] != 0x00:
+        raise SocksError('SOCKS5 error: {}'.format(
+                REPLY_ERROR_MAP.get(reply_head[1], 'unknown error {!r}'.format(reply_head[1]))))
+    
+    if reply_head[3] == 0x01:
+        return 4 - 1 + 2
+    
+    if reply_head[3] == 0x03:
+        return reply_head[4] + 2
+    
+    if reply_head[3] == 0x04:
+        return 16 - 1 + 2
+    
+    raise SocksError('invalid SOCKS5 address type: {!r}'.format(reply_head[3]))
+
+def _recv_exactly(sock, size):
+    data = b''
+    
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        
+        if not chunk:
+            raise SocksError('SOCKS5 proxy closed connection')
+        
+        data += chunk
+    
+    return data
+
+def create_connection(proxy_address, address, timeout=socket._GLOBAL_DEFAULT_TIMEOUT,
+        source_address=None):
+    # the same as ``socket.create_connection()``, but connects through
+    # SOCKS5 proxy. it may be used as ``_create_connection`` of
+    # ``http.client.HTTPConnection``
+    
+    sock = socket.create_connection(proxy_address, timeout=timeout,
+            source_address=source_address)
+    try:
+        sock.sendall(GREETING)
+        check_greeting_reply(_recv_exactly(sock, len(GREETING_REPLY)))
+        
+        sock.sendall(get_connect_request(address))
+        reply_head = _recv_exactly(sock, 5)
+        _recv_exactly(sock, get_reply_tail_size(reply_head))
+    except:
+        sock.close()
+        raise
+    
+    return sock
+
+class _AsyncConnector:
+    # non-blocking variant of ``create_connection()`` on ``IOStream``
+    
+    def __init__(self, io_loop, proxy_address, address, callback):
+        self._io_loop = io_loop
+        self._proxy_address = proxy_address
+        self._address = address
+        self._callback = callback
+        self._stream = iostream.IOStream(
+                socket.socket(socket.AF_INET, socket.SOCK_STREAM), io_loop=io_loop)
+    
+    def start(self):
+        with stack_context.ExceptionStackContext(self._handle_exception):
+            self._stream.set_close_callback(self._on_close)
+            self._stream.connect(self._proxy_address, self._on_connect)
+    
+    def _handle_exception(self, typ, value, tb):
+        self._finish(None, value)
+        
+        return True
+    
+    def _finish(self, stream, error):
+        callback = self._callback
+        self._callback = None
+        
+        if callback is None:
+            return
+        
+        self._stream.set_close_callback(None)
+        
+        if error is not None:
+            self._stream.close()
+        
+        callback(stream, error)
+    
+    def close(self):
+        # cancels connecting
+        
+        self._callback = None
+        self._stream.set_close_callback(None)
+        self._stream.close()
+    
+    def _on_close(self):
+        error = self._stream.error
+        
+        if error is None:
+            error = SocksError('SOCKS5 proxy closed connection')
+        
+        self._finish(None, error)
+    
+    def _on_connect(self):
+        self._stream.write(GREETING)
+        self._stream.read_bytes(len(GREETING_REPLY), self._on_greeting_reply)
+    
+    def _on_greeting_reply(self, reply):
+        check_greeting_reply(reply)
+        
+        self._stream.write(get_connect_request(self._address))
+        self._stream.read_bytes(5, self._on_reply_head)
+    
+    def _on_reply_head(self, reply_head):
+        self._stream.read_bytes(get_reply_tail_size(reply_head), self._on_reply_tail)
+    
+    def _on_reply_tail(self, reply_tail):
+        self._finish(self._stream, None)
+
+def connect(proxy_address, address, callback, io_loop=None):
+    # calls ``callback(stream, error)``. ``stream`` is ``IOStream`` of
+    # tunnel to ``address``. returned object has ``close()`` to cancel
+    
+    if io_loop is None:
+        io_loop = ioloop.IOLoop.instance()
+    
+    connector = _AsyncConnector(
+            io_loop, proxy_address, address, stack_context.wrap(callback))
+    connector.start()
+    
+    return connector
+
+def _start_tls(io_loop, stream, server_hostname):
+    # ``IOStream`` of this version of Tornado can not be upgraded to TLS,
+    # so socket is taken out of plain stream and given to ``SSLIOStream``
+    # (which makes handshake before first write)
+    
+    sock = stream.socket
+    io_loop.remove_handler(sock.fileno())
+    stream.socket = None
+    
+    tls_sock = ssl.create_default_context().wrap_socket(
+            sock, server_hostname=server_hostname, do_handshake_on_connect=False)
+    
+    return iostream.SSLIOStream(tls_sock, io_loop=io_loop)
+
+class _Fetcher:
+    # minimal HTTP/1.1 client (one request per connection) over SOCKS5 tunnel.
+    # result is ``tornado.httpclient.HTTPResponse``, the same as
+    # ``AsyncHTTPClient.fetch()`` gives
+    
+    def __init__(self, io_loop, http_request, proxy_address, callback):
+        self._io_loop = io_loop
+        self._request = http_request
+        self._proxy_address = proxy_address
+        self._callback = callback
+        self._started = time.monotonic()
+        self._connector = None
+        self._stream = None
+        self._timeout = None
+        self._code = None
+        self._reason = None
+        self._headers = None
+        
+        if http_request.streaming_callback is None:
+            self._buffer = io.BytesIO()
+        else:
+            self._buffer = None
+        
+        self._parsed = url.urlsplit(http_request.url)
+        
+        if self._parsed.scheme not in ('http', 'https'):
+            raise ValueError('unsupported url scheme: {!r}'.format(http_request.url))
+    
+    def start(self):
+        timeout = self._request.request_timeout
+        if timeout is None:
+            timeout = DEFAULT_TIMEOUT
+        
+        with stack_context.ExceptionStackContext(self._handle_exception):
+            self._timeout = self._io_loop.add_timeout(
+                    self._io_loop.time() + timeout,
+                    lambda: self._finish(error=httpclient.HTTPError(599, 'Timeout')),
+                    )
+            
+            if self._parsed.scheme == 'https':
+                default_port = 443
+            else:
+                default_port = 80
+            
+            self._connector = connect(
+                    self._proxy_address,
+                    (self._parsed.hostname, self._parsed.port or default_port),
+                    self._on_connect,
+                    io_loop=self._io_loop,
+                    )
+    
+    def _handle_exception(self, typ, value, tb):
+        self._finish(error=value)
+        
+        return True
+    
+    def _finish(self, error=None):
+        callback = self._callback
+        self._callback = None
+        
+        if callback is None:
+            return
+        
+        if self._timeout is not None:
+            self._io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        
+        if self._stream is not None:
+            self._stream.set_close_callback(None)
+            self._stream.close()
+        elif self._connector is not None:
+            self._connector.close()
+        
+        request_time = time.monotonic() - self._started
+        
+        if error is not None:
+            resp = httpclient.HTTPResponse(
+                    self._request, 599, error=error, request_time=request_time)
+        else:
+            if self._buffer is not None:
+                self._buffer.seek(0)
+            
+            resp = httpclient.HTTPResponse(
+                    self._request, self._code,
+                    headers=self._headers,
+                    buffer=self._buffer,
+                    effective_url=self._request.url,
+                    request_time=request_time,
+                    reason=self._reason,
+                    )
+        
+        callback(resp)
+    
+    def _on_close(self):
+        error = self._stream.error
+        
+        if error is None:
+            error = httpclient.HTTPError(599, 'Connection closed')
+        
+        self._finish(error=error)
+    
+    def _on_connect(self, stream, error):
+        self._connector = None
+        
+        if error is not None:
+            self._finish(error=error)
+            
+            return
+        
+        if self._parsed.scheme == 'https':
+            stream = _start_tls(self._io_loop, stream, self._parsed.hostname)
+        
+        self._stream = stream
+        self._stream.set_close_callback(self._on_close)
+        
+        headers = httputil.HTTPHeaders(self._request.headers)
+        
+        if 'Host' not in headers:
+            headers['Host'] = self._parsed.netloc.rpartition('@')[2]
+        
+        headers['Connection'] = 'close'
+        
+        if self._request.body is not None:
+            headers['Content-Length'] = str(len(self._request.body))
+        
+        selector = self._parsed.path or '/'
+        
+        if self._parsed.query:
+            selector += '?' + self._parsed.query
+        
+        lines = ['{} {} HTTP/1.1'.format(self._request.method, selector)]
+        lines.extend('{}: {}'.format(name, value) for name, value in headers.get_all())
+        
+        self._stream.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        
+        if self._request.body is not None:
+            self._stream.write(self._request.body)
+        
+        self._stream.read_until(b'\r\n\r\n', self._on_headers)
+    
+    def _on_headers(self, data):
+        first_line, sep, header_data = data.decode('latin-1').partition('\r\n')
+        version, code_str, self._reason = (first_line.split(' ', 2) + [''])[:3]
+        
+        if not version.startswith('HTTP/'):
+            raise httpclient.HTTPError(599, 'invalid status line: {!r}'.format(first_line))
+        
+        self._code = int(code_str)
+        
+        if 100 <= self._code < 200:
+            # ``100 Continue`` and others -- real status is after it
+            
+            self._stream.read_until(b'\r\n\r\n', self._on_headers)
+            
+            return
+        
+        self._headers = httputil.HTTPHeaders.parse(header_data)
+        
+        if self._request.method == 'HEAD' or self._code in (204, 304):
+            self._finish()
+            
+            return
+        
+        if self._headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            self._stream.read_until(b'\r\n', self._on_chunk_size)
+        elif 'Content-Length' in self._headers:
+            self._stream.read_bytes(
+                    int(self._headers['Content-Length']),
+                    lambda data: self._on_body_end(),
+                    streaming_callback=self._on_body_chunk,
+                    )
+        else:
+            # body ends with connection
+            
+            self._stream.set_close_callback(None)
+            self._stream.read_until_close(
+                    lambda data: self._on_body_end(),
+                    streaming_callback=self._on_body_chunk,
+                    )
+    
+    def _on_body_chunk(self, chunk):
+        if not chunk:
+            return
+        
+        if self._buffer is not None:
+            self._buffer.write(chunk)
+        else:
+            self._request.streaming_callback(chunk)
+    
+    def _on_body_end(self):
+        self._finish()
+    
+    def _on_chunk_size(self, data):
+        size = int(data.split(b';', 1)[0].strip(), 16)
+        
+        if size == 0:
+            self._stream.read_until(b'\r\n', self._on_trailer)
+            
+            return
+        
+        self._stream.read_bytes(size + 2, self._on_chunk)
+    
+    def _on_chunk(self, data):
+        self._on_body_chunk(data[:-2])
+        self._stream.read_until(b'\r\n', self._on_chunk_size)
+    
+    def _on_trailer(self, data):
+        if data != b'\r\n':
+            self._stream.read_until(b'\r\n', self._on_trailer)
+            
+            return
+        
+        self._finish()
+
+def fetch(http_request, proxy_address, callback, io_loop=None):
+    # the same as ``AsyncHTTPClient.fetch()`` (for ``HTTPRequest`` only,
+    # redirects are not followed), but through SOCKS5 proxy
+    
+    if io_loop is None:
+        io_loop = ioloop.IOLoop.instance()
+    
+    _Fetcher(io_loop, http_request, proxy_address, stack_context.wrap(callback)).start()
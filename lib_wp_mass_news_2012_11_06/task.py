@@ -18,19 +18,181 @@
 assert str is not bytes
 
 import datetime
+import itertools
+import collections
+import heapq
+import weakref
 from tornado import ioloop, stack_context, gen
 from . import timeout_delay
+from . import worker_pool
 
 DEFAULT_CONCURRENCE = 20
+DEFAULT_RETRY_DELAY = 0.0
+DEFAULT_RETRY_DELAY_MULTIPLIER = 2.0
+DEFAULT_RETRY_DELAY_MAX = 600.0
+DEFAULT_POLL_DELAY = 0.5
+
+class TaskQueue:
+    # single continuous queue of fresh tasks and error-retry tasks.
+    # ``task_list`` may give ``None`` -- there is no task yet (for example,
+    # tasks are leased by other nodes), it is asked again after ``poll_delay``.
+    # this class must be used from IOLoop thread
+    
+    def __init__(self, task_list, error_retry_list,
+            retry_delay=None, retry_delay_multiplier=None, retry_delay_max=None,
+            poll_delay=None):
+        if retry_delay is None:
+            retry_delay = DEFAULT_RETRY_DELAY
+        
+        if retry_delay_multiplier is None:
+            retry_delay_multiplier = DEFAULT_RETRY_DELAY_MULTIPLIER
+        
+        if retry_delay_max is None:
+            retry_delay_max = DEFAULT_RETRY_DELAY_MAX
+        
+        if poll_delay is None:
+            poll_delay = DEFAULT_POLL_DELAY
+        
+        self._io_loop = ioloop.IOLoop.instance()
+        self._task_iter = iter(task_list)
+        self._is_task_iter_done = False
+        self._error_retry_list = error_retry_list
+        self._retry_delay = retry_delay
+        self._retry_delay_multiplier = retry_delay_multiplier
+        self._retry_delay_max = retry_delay_max
+        self._poll_delay = poll_delay
+        self._poll_timeout = None
+        self._retry_counter = weakref.WeakKeyDictionary()
+        self._retry_heap = []
+        self._retry_seq = itertools.count()
+        self._retry_timeout = None
+        self._retry_timeout_deadline = None
+        self._active_count = 0
+        self._waiter_list = collections.deque()
+    
+    def get(self, callback=None):
+        # ``callback(task)`` gets next task or ``None`` if all is done
+        
+        self._waiter_list.append(stack_context.wrap(callback))
+        self._dispatch()
+    
+    def task_done(self, task):
+        self._active_count -= 1
+        self._collect_retries()
+        self._dispatch()
+    
+    def get_retry_count(self):
+        return len(self._retry_heap)
+    
+    def _collect_retries(self):
+        if not self._error_retry_list:
+            return
+        
+        now = self._io_loop.time()
+        
+        for task in self._error_retry_list:
+            retry_i = self._retry_counter.get(task, 0)
+            self._retry_counter[task] = retry_i + 1
+            
+            retry_delay = min(
+                    self._retry_delay * self._retry_delay_multiplier ** retry_i,
+                    self._retry_delay_max,
+                    )
+            
+            heapq.heappush(self._retry_heap,
+                    (now + retry_delay, next(self._retry_seq), task))
+        
+        self._error_retry_list[:] = ()
+    
+    def _next_task(self):
+        if self._retry_heap and self._retry_heap[0][0] <= self._io_loop.time():
+            return heapq.heappop(self._retry_heap)[2]
+        
+        if not self._is_task_iter_done and self._poll_timeout is None:
+            try:
+                task = next(self._task_iter)
+            except StopIteration:
+                self._is_task_iter_done = True
+                
+                return
+            
+            if task is None:
+                self._poll_timeout = self._io_loop.add_timeout(
+                        self._io_loop.time() + self._poll_delay, self._on_poll_timeout)
+            
+            return task
+    
+    def _on_poll_timeout(self):
+        self._poll_timeout = None
+        self._dispatch()
+    
+    def _on_retry_timeout(self):
+        self._retry_timeout = None
+        self._retry_timeout_deadline = None
+        self._dispatch()
+    
+    def _dispatch(self):
+        self._collect_retries()
+        
+        while self._waiter_list:
+            task = self._next_task()
+            
+            if task is not None:
+                self._active_count += 1
+                waiter = self._waiter_list.popleft()
+                self._io_loop.add_callback(lambda _waiter=waiter, _task=task: _waiter(_task))
+                
+                continue
+            
+            if self._retry_heap:
+                deadline = self._retry_heap[0][0]
+                
+                if self._retry_timeout is not None and \
+                        self._retry_timeout_deadline > deadline:
+                    self._io_loop.remove_timeout(self._retry_timeout)
+                    self._retry_timeout = None
+                
+                if self._retry_timeout is None:
+                    self._retry_timeout_deadline = deadline
+                    self._retry_timeout = self._io_loop.add_timeout(
+                            deadline, self._on_retry_timeout)
+                
+                return
+            
+            if self._poll_timeout is not None:
+                # task list is asked again later
+                
+                return
+            
+            if self._active_count > 0:
+                # active tasks may return to queue as error-retry tasks
+                
+                return
+            
+            while self._waiter_list:
+                waiter = self._waiter_list.popleft()
+                self._io_loop.add_callback(lambda _waiter=waiter: _waiter(None))
 
 @gen.engine
-def task_thread(task_func, task_list,
-        delay=None, error_delay=None, callback=None):
+def task_thread(task_func, task_queue,
+        delay=None, error_delay=None, rate_limiter=None, conc_ctrl=None,
+        is_excess=None, callback=None):
     callback = stack_context.wrap(callback)
     
     io_loop = ioloop.IOLoop.instance()
     
-    for task in task_list:
+    while True:
+        if is_excess is not None and is_excess():
+            break
+        
+        task = yield gen.Task(task_queue.get)
+        
+        if task is None:
+            break
+        
+        if rate_limiter is not None:
+            yield gen.Task(rate_limiter.acquire, task)
+        
         if delay is not None:
             delay_wait_key = object()
             delay_cancel = timeout_delay.create_timeout_delay(
@@ -45,8 +207,14 @@ def task_thread(task_func, task_list,
                     callback=(yield gen.Callback(error_delay_wait_key)),
                     )
         
+        begin_time = io_loop.time()
         is_error = yield gen.Task(task_func, task)
         
+        if conc_ctrl is not None:
+            conc_ctrl.report(io_loop.time() - begin_time, is_error)
+        
+        task_queue.task_done(task)
+        
         if delay is not None:
             yield gen.Wait(delay_wait_key)
         
@@ -61,33 +229,91 @@ def task_thread(task_func, task_list,
 
 @gen.engine
 def bulk_task(task_func, task_list, error_retry_list,
-        conc=None, delay=None, error_delay=None, callback=None):
+        conc=None, delay=None, error_delay=None,
+        retry_delay=None, retry_delay_multiplier=None, retry_delay_max=None,
+        rate_limiter=None, conc_ctrl=None,
+        stats_interval=None, stats_callback=None, callback=None):
+    stats_callback = stack_context.wrap(stats_callback)
     callback = stack_context.wrap(callback)
     
-    if conc is None:
+    if conc_ctrl is not None:
+        conc = conc_ctrl.get_max_conc()
+    elif conc is None:
         conc = DEFAULT_CONCURRENCE
     
-    is_first_time = True
-    while is_first_time or error_retry_list:
-        if is_first_time:
-            is_first_time = False
-            
-            task_iter = iter(task_list)
-        else:
-            error_retry_list_copy = error_retry_list[:]
-            error_retry_list[:] = ()
-            task_iter = iter(error_retry_list_copy)
-        
-        wait_key_list = []
-        
-        for thread_i in range(conc):
-            wait_key = object()
-            wait_key_list.append(wait_key)
-            task_thread(task_func, task_iter, delay=delay, error_delay=error_delay,
-                    callback=(yield gen.Callback(wait_key)))
-        
-        for wait_key in wait_key_list:
-            yield gen.Wait(wait_key)
+    pool = worker_pool.init_pool(size=conc)
+    
+    task_queue = TaskQueue(
+            task_list,
+            error_retry_list,
+            retry_delay=retry_delay,
+            retry_delay_multiplier=retry_delay_multiplier,
+            retry_delay_max=retry_delay_max,
+            )
+    
+    def get_stats():
+        stats = pool.get_stats()
+        stats['retry'] = task_queue.get_retry_count()
+        
+        return stats
+    
+    if stats_interval is not None and stats_callback is not None:
+        stats_timer = ioloop.PeriodicCallback(
+                lambda: stats_callback(get_stats()),
+                stats_interval * 1000.0,
+                )
+        stats_timer.start()
+    else:
+        stats_timer = None
+    
+    finish_wait_key = object()
+    finish_callback = yield gen.Callback(finish_wait_key)
+    thread_count = 0
+    is_finished = False
+    
+    def get_conc():
+        if conc_ctrl is not None:
+            return conc_ctrl.get_conc()
+        
+        return conc
+    
+    def is_excess():
+        return thread_count > get_conc()
+    
+    def on_thread_done():
+        nonlocal thread_count, is_finished
+        
+        thread_count -= 1
+        
+        if not thread_count and not is_finished:
+            is_finished = True
+            finish_callback()
+    
+    def spawn_threads():
+        nonlocal thread_count
+        
+        while not is_finished and thread_count < get_conc():
+            thread_count += 1
+            task_thread(task_func, task_queue, delay=delay, error_delay=error_delay,
+                    rate_limiter=rate_limiter, conc_ctrl=conc_ctrl,
+                    is_excess=is_excess, callback=on_thread_done)
+    
+    if conc_ctrl is not None:
+        conc_ctrl.set_change_callback(spawn_threads)
+        conc_ctrl.start()
+    
+    spawn_threads()
+    
+    yield gen.Wait(finish_wait_key)
+    
+    if conc_ctrl is not None:
+        conc_ctrl.stop()
+    
+    if stats_timer is not None:
+        stats_timer.stop()
+        stats_callback(get_stats())
+    
+    worker_pool.shutdown_pool()
     
     if callback is not None:
         callback()
@@ -17,23 +17,35 @@
 
 assert str is not bytes
 
-import threading
+import datetime
 from tornado import ioloop, stack_context
 
 def create_timeout_delay(seconds, callback=None):
+    # ``cancel()`` finishes delay before time (``callback`` is called anyway).
+    # this function and ``cancel()`` must be called from IOLoop thread
+    
     callback = stack_context.wrap(callback)
     io_loop = ioloop.IOLoop.instance()
-    ev = threading.Event()
-    
-    def cancel():
-        ev.set()
+    is_done = False
     
-    def wait_thread():
-        ev.wait(timeout=seconds)
+    def done():
+        nonlocal is_done
+        
+        if is_done:
+            return
+        
+        is_done = True
         
         if callback is not None:
-            io_loop.add_callback(callback)
+            callback()
+    
+    timeout = io_loop.add_timeout(datetime.timedelta(seconds=seconds), done)
     
-    threading.Thread(target=wait_thread, daemon=True).start()
+    def cancel():
+        if is_done:
+            return
+        
+        io_loop.remove_timeout(timeout)
+        io_loop.add_callback(done)
     
     return cancel
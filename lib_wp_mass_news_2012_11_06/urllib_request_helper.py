@@ -18,26 +18,176 @@
 assert str is not bytes
 
 import time
+import codecs
+import threading
+import zlib
+import functools
 from http import client as http_client
-from lib_socks_proxy_2013_10_03 import socks_proxy_context
+from urllib import parse as url
+from urllib import request
+from urllib import error as url_error
+from tornado import ioloop, stack_context, gen, httpclient
+from . import http_conn_pool
+from . import http_retry
+from . import proxy_pool
+from . import socks5
+from . import parse_pool
 
 DEFAULT_USER_AGENT_NAME = 'Python'
 DEFAULT_TIMEOUT = 60.0
 DEFAULT_RESPONSE_LIMIT = 10000000
+DEFAULT_READ_CHUNK_SIZE = 16384
+DEFAULT_ACCEPT_ENCODING = 'gzip, deflate'
 
-DEFAULT_ERROR_RETRY_LIST = (
-        http_client.BadStatusLine,
-        )
-DEFAULT_ERROR_RETRY_COUNT = 5
-DEFAULT_ERROR_RETRY_DELAY = 0.5
-DEFAULT_ERROR_RETRY_DELAY_MULTIPLIER = 2.0
+DEFAULT_MAX_REDIRECTS = 10
+DEFAULT_ASYNC_MAX_CLIENTS = 1000
+
+HTTP_ENGINE_LIST = ('blocking', 'async')
+DEFAULT_HTTP_ENGINE = 'blocking'
+
+_default_retry_policy = http_retry.RetryPolicy()
+_traffic_counter = None
+_async_client = None
+_conn_pool = None
+_proxy_pool = None
+_parse_pool = None
+
+class TrafficCounter:
+    # bytes received from network (``wire``) and bytes of decompressed
+    # bodies (``body``). this class is thread-safe
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wire = 0
+        self._body = 0
+    
+    def add(self, wire=None, body=None):
+        with self._lock:
+            if wire is not None:
+                self._wire += wire
+            
+            if body is not None:
+                self._body += body
+    
+    def get(self):
+        with self._lock:
+            return {
+                    'wire': self._wire,
+                    'body': self._body,
+                    }
+
+def get_traffic_counter():
+    global _traffic_counter
+    
+    if _traffic_counter is None:
+        _traffic_counter = TrafficCounter()
+    
+    return _traffic_counter
+
+class DecodedResponse:
+    # wrapper of ``urllib.request`` response. body is decompressed
+    # (``Content-Encoding: gzip`` or ``deflate``) by chunks, so ``read(amt)``
+    # limits decompressed size. traffic is counted by ``TrafficCounter``
+    
+    def __init__(self, resp, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = DEFAULT_READ_CHUNK_SIZE
+        
+        self._resp = resp
+        self._chunk_size = chunk_size
+        self._traffic_counter = get_traffic_counter()
+        self._buf = bytearray()
+        self._is_eof = False
+        self._is_raw_deflate_checked = True
+        
+        content_encoding = resp.info().get('Content-Encoding', '').strip().lower()
+        
+        if content_encoding in ('gzip', 'x-gzip'):
+            self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif content_encoding == 'deflate':
+            self._decompressor = zlib.decompressobj()
+            self._is_raw_deflate_checked = False
+        else:
+            self._decompressor = None
+    
+    def getcode(self):
+        return self._resp.getcode()
+    
+    def geturl(self):
+        return self._resp.geturl()
+    
+    def info(self):
+        return self._resp.info()
+    
+    def _decompress(self, data):
+        if self._is_raw_deflate_checked:
+            return self._decompressor.decompress(data, self._chunk_size)
+        
+        self._is_raw_deflate_checked = True
+        
+        try:
+            return self._decompressor.decompress(data, self._chunk_size)
+        except zlib.error:
+            # some servers send ``deflate`` without zlib header
+            
+            self._decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        
+        return self._decompressor.decompress(data, self._chunk_size)
+    
+    def _fill(self):
+        if self._decompressor is not None and self._decompressor.unconsumed_tail:
+            data = self._decompressor.unconsumed_tail
+            is_new_data = False
+        else:
+            data = self._resp.read(self._chunk_size)
+            is_new_data = True
+            
+            self._traffic_counter.add(wire=len(data))
+        
+        if self._decompressor is None:
+            chunk = data
+        elif data:
+            chunk = self._decompress(data)
+        else:
+            chunk = self._decompressor.flush()
+        
+        if is_new_data and not data:
+            self._is_eof = True
+        
+        self._traffic_counter.add(body=len(chunk))
+        self._buf += chunk
+    
+    def read(self, amt=None):
+        while not self._is_eof and (amt is None or amt < 0 or len(self._buf) < amt):
+            self._fill()
+        
+        if amt is None or amt < 0:
+            amt = len(self._buf)
+        
+        data = bytes(self._buf[:amt])
+        del self._buf[:amt]
+        
+        return data
+    
+    def close(self):
+        self._buf = bytearray()
+        self._is_eof = True
+        self._resp.close()
 
 def ext_open(opener, *args,
         headers=None, new_headers=None, proxy_kwargs=None,
-        error_retry_list=None,
-        error_retry_count=None, error_retry_delay=None,
-        error_retry_delay_multiplier=None,
+        retry_policy=None,
         **kwargs):
+    # ``retry_policy`` is ``http_retry.RetryPolicy``. policy returned by
+    # ``RetryPolicy.begin()`` (once for whole task) also limits time of task.
+    # if ``init_proxy_pool()`` was called, ``proxy_address`` of
+    # ``proxy_kwargs`` is chosen by pool for each request
+    
+    if proxy_kwargs is not None and _conn_pool is None:
+        # without pool connections would go past proxy
+        
+        raise ValueError('proxy requires connection pool (init_conn_pool())')
+    
     if headers is not None:
         spec_headers = headers
     else:
@@ -47,36 +197,428 @@ def ext_open(opener, *args,
         spec_headers = list(spec_headers)
         spec_headers += new_headers
     
-    if error_retry_list is None:
-        error_retry_list = DEFAULT_ERROR_RETRY_LIST
-    
-    if error_retry_count is None:
-        error_retry_count = DEFAULT_ERROR_RETRY_COUNT
-    
-    if error_retry_delay is None:
-        error_retry_delay = DEFAULT_ERROR_RETRY_DELAY
+    if not any(header_name.lower() == 'accept-encoding'
+            for header_name, header_value in spec_headers):
+        spec_headers = list(spec_headers)
+        spec_headers.append(('Accept-Encoding', DEFAULT_ACCEPT_ENCODING))
     
-    if error_retry_delay_multiplier is None:
-        error_retry_delay_multiplier = DEFAULT_ERROR_RETRY_DELAY_MULTIPLIER
+    if retry_policy is None:
+        retry_policy = _default_retry_policy
     
     orig_headers = opener.addheaders
     opener.addheaders = spec_headers
     try:
+        retry_i = 0
+        
         while True:
+            timeout = retry_policy.get_timeout(kwargs.get('timeout'))
+            
+            if timeout is not None:
+                kwargs['timeout'] = timeout
+            
+            retry_policy.on_request()
+            
+            if proxy_kwargs is not None and _proxy_pool is not None:
+                proxy_endpoint = _proxy_pool.acquire()
+                req_proxy_kwargs = dict(proxy_kwargs, proxy_address=proxy_endpoint.address)
+            else:
+                proxy_endpoint = None
+                req_proxy_kwargs = proxy_kwargs
+            
+            started = time.monotonic()
+            
             try:
-                if proxy_kwargs is not None:
-                    with socks_proxy_context.socks_proxy_context(**proxy_kwargs):
-                        return opener.open(*args, **kwargs)
-                else:
-                    return opener.open(*args, **kwargs)
-            except error_retry_list:
-                if error_retry_count <= 0:
+                with http_conn_pool.proxy_key_context(req_proxy_kwargs):
+                    resp = opener.open(*args, **kwargs)
+            except Exception as e:
+                if proxy_endpoint is not None:
+                    # HTTP error status is answer of server, not fault of proxy
+                    
+                    _proxy_pool.release(proxy_endpoint, time.monotonic() - started,
+                            not isinstance(e, url_error.HTTPError))
+                
+                retry_delay = retry_policy.get_retry_delay(e, retry_i)
+                
+                if retry_delay is None:
                     raise
                 
-                error_retry_count -= 1
-                time.sleep(error_retry_delay)
-                error_retry_delay *= error_retry_delay_multiplier
+                if isinstance(e, url_error.HTTPError):
+                    # releases connection (to pool) before waiting
+                    
+                    e.close()
+                
+                # blocking flow waits in its worker thread (not in IOLoop as
+                # ``ext_fetch()`` does), but never beyond deadline of task
+                
+                retry_i += 1
+                time.sleep(retry_policy.get_sleep(retry_delay))
                 
                 continue
+            
+            if proxy_endpoint is not None:
+                _proxy_pool.release(proxy_endpoint, time.monotonic() - started, False)
+            
+            return DecodedResponse(resp)
     finally:
         opener.addheaders = orig_headers
+
+def stream_read(resp, parser, encoding=None, limit=None, chunk_size=None):
+    # feeds response to incremental ``parser`` (``feed()``, ``close()``) by
+    # chunks. reading is stopped (and response is closed) as soon as
+    # ``parser.is_done`` is ``True``, so rest of page is not downloaded.
+    # if ``init_parse_pool()`` was called, whole response is read and parsed
+    # in child process. returned parser (not ``parser`` argument) must be used
+    
+    if encoding is None:
+        encoding = 'utf-8'
+    
+    if limit is None:
+        limit = DEFAULT_RESPONSE_LIMIT
+    
+    if chunk_size is None:
+        chunk_size = DEFAULT_READ_CHUNK_SIZE
+    
+    if _parse_pool is not None:
+        try:
+            data = resp.read(limit)
+        finally:
+            resp.close()
+        
+        return _parse_pool.parse(parser, data, encoding)
+    
+    decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+    
+    try:
+        while limit > 0 and not parser.is_done:
+            chunk = resp.read(min(chunk_size, limit))
+            
+            if not chunk:
+                break
+            
+            limit -= len(chunk)
+            parser.feed(decoder.decode(chunk))
+        
+        if not parser.is_done:
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+    finally:
+        resp.close()
+    
+    return parser
+
+def init_conn_pool(size=None, idle_timeout=None, dns_cache=None):
+    # enables keep-alive connections for openers made by ``build_opener()``
+    
+    global _conn_pool
+    
+    close_conn_pool()
+    
+    _conn_pool = http_conn_pool.ConnPool(
+            size=size, idle_timeout=idle_timeout, dns_cache=dns_cache)
+    
+    return _conn_pool
+
+def get_conn_pool():
+    return _conn_pool
+
+def close_conn_pool():
+    global _conn_pool
+    
+    if _conn_pool is None:
+        return
+    
+    _conn_pool.close()
+    _conn_pool = None
+
+def init_proxy_pool(address_list, **kwargs):
+    # spreads requests made with ``proxy_kwargs`` across several SOCKS
+    # endpoints. ``kwargs`` are passed to ``proxy_pool.ProxyPool``
+    
+    global _proxy_pool
+    
+    close_proxy_pool()
+    
+    _proxy_pool = proxy_pool.ProxyPool(address_list, **kwargs)
+    _proxy_pool.start()
+    
+    return _proxy_pool
+
+def get_proxy_pool():
+    return _proxy_pool
+
+def close_proxy_pool():
+    global _proxy_pool
+    
+    if _proxy_pool is None:
+        return
+    
+    _proxy_pool.stop()
+    _proxy_pool = None
+
+def init_parse_pool(workers=None, min_size=None):
+    # moves parsing of ``stream_read()`` to child processes
+    
+    global _parse_pool
+    
+    close_parse_pool()
+    
+    _parse_pool = parse_pool.ParsePool(workers=workers, min_size=min_size)
+    
+    return _parse_pool
+
+def get_parse_pool():
+    return _parse_pool
+
+def close_parse_pool():
+    global _parse_pool
+    
+    if _parse_pool is None:
+        return
+    
+    _parse_pool.close()
+    _parse_pool = None
+
+def build_opener(*handlers):
+    # the same as ``request.build_opener()``, but uses connection pool
+    # (if it is initialized)
+    
+    if _conn_pool is not None:
+        handlers += (
+                http_conn_pool.PooledHTTPHandler(_conn_pool),
+                http_conn_pool.PooledHTTPSHandler(_conn_pool),
+                )
+    
+    return request.build_opener(*handlers)
+
+class AsyncResponse:
+    # the same subset of interface as ``urllib.request`` response has,
+    # but whole (limited) body is already received
+    
+    def __init__(self, code, resp_url, headers, body):
+        self._code = code
+        self._url = resp_url
+        self._headers = headers
+        self._body = body
+        self._pos = 0
+    
+    def getcode(self):
+        return self._code
+    
+    def geturl(self):
+        return self._url
+    
+    def info(self):
+        return self._headers
+    
+    def read(self, amt=None):
+        if amt is None or amt < 0:
+            end = len(self._body)
+        else:
+            end = min(self._pos + amt, len(self._body))
+        
+        data = self._body[self._pos:end]
+        self._pos = end
+        
+        return data
+    
+    def close(self):
+        self._body = b''
+        self._pos = 0
+
+class _CookieResponse:
+    # adapter for ``cookiejar.CookieJar.extract_cookies()``
+    
+    def __init__(self, headers):
+        self._headers = headers
+    
+    def info(self):
+        return self._headers
+
+def init_async_client(max_clients=None):
+    global _async_client
+    
+    if max_clients is None:
+        max_clients = DEFAULT_ASYNC_MAX_CLIENTS
+    
+    _async_client = httpclient.AsyncHTTPClient(
+            force_instance=True, max_clients=max_clients)
+    
+    return _async_client
+
+def get_async_client():
+    if _async_client is None:
+        return init_async_client()
+    
+    return _async_client
+
+def _get_redirect_request(req, code, new_url):
+    # the same rules as ``request.HTTPRedirectHandler.redirect_request()`` has
+    
+    method = req.get_method()
+    
+    if not (code in (301, 302, 303, 307) and method in ('GET', 'HEAD') or
+            code in (301, 302, 303) and method == 'POST'):
+        return
+    
+    new_headers = {
+            k: v for k, v in req.headers.items()
+            if k.lower() not in ('content-length', 'content-type')
+            }
+    
+    return request.Request(
+            new_url,
+            headers=new_headers,
+            origin_req_host=req.origin_req_host,
+            unverifiable=True,
+            )
+
+@gen.engine
+def ext_fetch(cookies, url_or_req, data=None,
+        headers=None, new_headers=None, proxy_kwargs=None,
+        timeout=None, response_limit=None, max_redirects=None,
+        retry_policy=None, callback=None):
+    # non-blocking variant of ``ext_open()``. instead of opener,
+    # ``http.cookiejar.CookieJar`` (or ``None``) is used. with ``proxy_kwargs``
+    # requests go through ``socks5.fetch()``
+    
+    callback = stack_context.wrap(callback)
+    
+    if timeout is None:
+        timeout = DEFAULT_TIMEOUT
+    
+    if response_limit is None:
+        response_limit = DEFAULT_RESPONSE_LIMIT
+    
+    if max_redirects is None:
+        max_redirects = DEFAULT_MAX_REDIRECTS
+    
+    if retry_policy is None:
+        retry_policy = _default_retry_policy
+    
+    io_loop = ioloop.IOLoop.instance()
+    
+    if isinstance(url_or_req, request.Request):
+        req = url_or_req
+        
+        if data is not None:
+            req.data = data
+    else:
+        req = request.Request(url_or_req, data=data)
+    
+    if headers is not None:
+        for header_name, header_value in headers:
+            req.add_header(header_name, header_value)
+    
+    if new_headers is not None:
+        for header_name, header_value in new_headers:
+            req.add_header(header_name, header_value)
+    
+    if req.data is not None and not req.has_header('Content-type'):
+        req.add_header('Content-type', 'application/x-www-form-urlencoded')
+    
+    client = get_async_client()
+    
+    for redirect_i in range(max_redirects + 1):
+        if cookies is not None:
+            cookies.add_cookie_header(req)
+        
+        retry_i = 0
+        
+        while True:
+            body_chunks = []
+            body_size = [0]
+            
+            def on_body_chunk(chunk):
+                if body_size[0] >= response_limit:
+                    return
+                
+                chunk = chunk[:response_limit - body_size[0]]
+                body_chunks.append(chunk)
+                body_size[0] += len(chunk)
+            
+            request_timeout = retry_policy.get_timeout(timeout)
+            retry_policy.on_request()
+            
+            proxy_endpoint = None
+            
+            if proxy_kwargs is None:
+                fetch = client.fetch
+            elif _proxy_pool is not None:
+                proxy_endpoint = _proxy_pool.acquire()
+                fetch = functools.partial(socks5.fetch, proxy_address=proxy_endpoint.address)
+            else:
+                fetch = functools.partial(
+                        socks5.fetch, proxy_address=proxy_kwargs['proxy_address'])
+            
+            started = io_loop.time()
+            
+            resp = yield gen.Task(fetch, httpclient.HTTPRequest(
+                    req.full_url,
+                    method=req.get_method(),
+                    headers=dict(req.header_items()),
+                    body=req.data,
+                    follow_redirects=False,
+                    connect_timeout=request_timeout,
+                    request_timeout=request_timeout,
+                    streaming_callback=on_body_chunk,
+                    use_gzip=False,
+                    ))
+            
+            if proxy_endpoint is not None:
+                _proxy_pool.release(proxy_endpoint, io_loop.time() - started, resp.code == 599)
+            
+            if resp.code == 599:
+                retry_error = resp.error
+            elif resp.code >= 400:
+                retry_error = url_error.HTTPError(
+                        req.full_url, resp.code, resp.reason, None, None)
+            else:
+                retry_error = None
+            
+            if retry_error is not None:
+                retry_delay = retry_policy.get_retry_delay(retry_error, retry_i)
+                
+                if retry_delay is not None:
+                    # waits without blocking IOLoop
+                    
+                    retry_i += 1
+                    yield gen.Task(io_loop.add_timeout, io_loop.time() + retry_delay)
+                    
+                    continue
+            
+            break
+        
+        if resp.code == 599:
+            raise resp.error
+        
+        resp_headers = http_client.HTTPMessage()
+        for header_name, header_value in resp.headers.get_all():
+            resp_headers[header_name] = header_value
+        
+        if cookies is not None:
+            cookies.extract_cookies(_CookieResponse(resp_headers), req)
+        
+        location = resp_headers.get('Location')
+        
+        if resp.code in (301, 302, 303, 307) and location is not None:
+            new_url = url.urljoin(req.full_url, location)
+            new_req = _get_redirect_request(req, resp.code, new_url)
+            
+            if new_req is not None:
+                req = new_req
+                
+                continue
+        
+        if resp.code >= 400:
+            raise url_error.HTTPError(
+                    req.full_url, resp.code, resp.reason, resp_headers, None)
+        
+        if callback is not None:
+            callback(AsyncResponse(
+                    resp.code, req.full_url, resp_headers, b''.join(body_chunks)))
+        
+        return
+    
+    raise url_error.HTTPError(
+            req.full_url, resp.code,
+            'redirect loop or too many redirects', resp_headers, None)
@@ -0,0 +1,391 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import os
+import time
+import socket
+import threading
+import collections
+import sqlite3
+from tornado import ioloop, stack_context
+from . import worker_pool
+
+DEFAULT_BACKEND = 'sqlite'
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_LEASE_TIME = 600.0
+DEFAULT_SQLITE_TIMEOUT = 60.0
+DEFAULT_POLL_INTERVAL = 5.0
+
+class SqliteBackend:
+    # task states: ``pending``, ``leased``, ``done``, ``failed``.
+    # leased task with expired lease is the same as pending one, so tasks
+    # of dead node are reclaimed by other nodes.
+    # nodes may be processes of one host, or hosts sharing the file on
+    # local disk of one of them. network file systems (NFS, SMB) do not
+    # give reliable locks, and sqlite database on them may be corrupted.
+    # each thread uses its own connection
+    
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._db_list = []
+        
+        db = self._get_db()
+        
+        db.execute(
+                'CREATE TABLE IF NOT EXISTS tasks ('
+                'i INTEGER PRIMARY KEY, '
+                'state TEXT NOT NULL, '
+                'node TEXT, '
+                'lease_expire REAL, '
+                'attempts INTEGER NOT NULL DEFAULT 0, '
+                'result TEXT, '
+                'error TEXT)'
+                )
+        db.execute(
+                'CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_expire)')
+    
+    def _get_db(self):
+        db = getattr(self._local, 'db', None)
+        
+        if db is None:
+            db = sqlite3.connect(
+                    self._path, timeout=DEFAULT_SQLITE_TIMEOUT, isolation_level=None,
+                    check_same_thread=False)
+            self._local.db = db
+            
+            with self._lock:
+                self._db_list.append(db)
+        
+        return db
+    
+    def init_tasks(self, count):
+        # adds tasks ``0..count-1`` which are not added yet
+        
+        db = self._get_db()
+        
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany(
+                    'INSERT OR IGNORE INTO tasks (i, state) VALUES (?, \'pending\')',
+                    ((task_i,) for task_i in range(count)),
+                    )
+    
+    def lease(self, node, batch_size, lease_time):
+        db = self._get_db()
+        now = time.time()
+        
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            task_i_list = [row[0] for row in db.execute(
+                    'SELECT i FROM tasks WHERE state = \'pending\' OR '
+                    '(state = \'leased\' AND lease_expire < ?) '
+                    'ORDER BY i LIMIT ?',
+                    (now, batch_size),
+                    )]
+            db.executemany(
+                    'UPDATE tasks SET state = \'leased\', node = ?, lease_expire = ?, '
+                    'attempts = attempts + 1 WHERE i = ?',
+                    ((node, now + lease_time, task_i) for task_i in task_i_list),
+                    )
+        
+        return task_i_list
+    
+    def renew(self, node, task_i_list, lease_time):
+        db = self._get_db()
+        
+        with db:
+            db.executemany(
+                    'UPDATE tasks SET lease_expire = ? '
+                    'WHERE i = ? AND state = \'leased\' AND node = ?',
+                    ((time.time() + lease_time, task_i, node) for task_i in task_i_list),
+                    )
+    
+    def complete(self, node, task_i, result):
+        # task is marked as done even if its lease was lost: the post is
+        # already published, it must not be published by other node
+        
+        db = self._get_db()
+        
+        with db:
+            db.execute(
+                    'UPDATE tasks SET state = \'done\', node = ?, lease_expire = NULL, '
+                    'result = ? WHERE i = ?',
+                    (node, result, task_i),
+                    )
+    
+    def fail(self, node, task_i, error):
+        db = self._get_db()
+        
+        with db:
+            db.execute(
+                    'UPDATE tasks SET state = \'failed\', lease_expire = NULL, '
+                    'error = ? WHERE i = ? AND state = \'leased\' AND node = ?',
+                    (error, task_i, node),
+                    )
+    
+    def get_counts(self):
+        return dict(self._get_db().execute(
+                'SELECT state, COUNT(*) FROM tasks GROUP BY state'))
+    
+    def close(self):
+        with self._lock:
+            for db in self._db_list:
+                db.close()
+            
+            self._db_list[:] = ()
+
+BACKEND_MAP = {
+        'sqlite': SqliteBackend,
+        }
+
+def open_backend(spec, base_dir=None):
+    # ``spec`` is ``'BACKEND:PATH'`` or just ``'PATH'`` (default backend)
+    
+    backend_name, sep, path = spec.partition(':')
+    
+    if not sep or backend_name not in BACKEND_MAP:
+        backend_name, path = DEFAULT_BACKEND, spec
+    
+    if base_dir is not None:
+        path = os.path.join(base_dir, path)
+    
+    return BACKEND_MAP[backend_name](path)
+
+def get_default_node():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+class QueueClient:
+    # one node of multi-node run. this class must be used from IOLoop thread.
+    # database is used in ``worker_pool`` only (waiting for lock of database
+    # does not stop IOLoop): next batch is leased in advance, ``complete()``
+    # and ``fail()`` are written in background. task is held (its lease is
+    # renewed) until its result is written. failed write is reported by
+    # ``error_callback(msg)`` and retried, and no more tasks are leased
+    
+    def __init__(self, backend, node=None, batch_size=None, lease_time=None,
+            poll_interval=None, error_callback=None):
+        if node is None:
+            node = get_default_node()
+        
+        if batch_size is None:
+            batch_size = DEFAULT_BATCH_SIZE
+        
+        if lease_time is None:
+            lease_time = DEFAULT_LEASE_TIME
+        
+        if poll_interval is None:
+            poll_interval = DEFAULT_POLL_INTERVAL
+        
+        self._io_loop = ioloop.IOLoop.instance()
+        self._backend = backend
+        self._node = node
+        self._batch_size = batch_size
+        self._lease_time = lease_time
+        self._poll_interval = poll_interval
+        self._error_callback = stack_context.wrap(error_callback)
+        self._held_set = set()
+        self._ready_list = collections.deque()
+        self._is_leasing = False
+        self._is_lease_done = False
+        self._next_lease_time = None
+        self._unwritten_map = {}
+        self._write_cond = threading.Condition()
+        self._write_count = 0
+        self._is_closed = False
+        self.is_failed = False
+        self._renew_timer = ioloop.PeriodicCallback(
+                self._renew, lease_time / 3.0 * 1000.0)
+    
+    def _report(self, msg):
+        self.is_failed = True
+        
+        if self._error_callback is not None:
+            self._error_callback(msg)
+    
+    def _renew(self):
+        if self._held_set:
+            worker_pool.run_blocking(
+                    self._backend.renew, self._node, tuple(self._held_set), self._lease_time,
+                    callback=self._on_renew_done)
+        
+        with self._write_cond:
+            unwritten_list = list(self._unwritten_map.items())
+            self._unwritten_map.clear()
+        
+        for task_i, write_args in unwritten_list:
+            # retry of failed write
+            
+            self._write(task_i, *write_args)
+    
+    def _on_renew_done(self, result, error):
+        if error is not None:
+            error_type, error_str, error_tb = error
+            self._report('queue: renew error: {}: {}'.format(error_type.__name__, error_str))
+    
+    def _lease_thread(self):
+        task_i_list = self._backend.lease(self._node, self._batch_size, self._lease_time)
+        
+        if task_i_list:
+            return task_i_list, None
+        
+        return task_i_list, self._backend.get_counts().get('leased')
+    
+    def _on_lease_done(self, result, error):
+        self._is_leasing = False
+        
+        if error is not None:
+            error_type, error_str, error_tb = error
+            self._report('queue: lease error: {}: {}'.format(error_type.__name__, error_str))
+            
+            return
+        
+        task_i_list, leased_count = result
+        
+        if task_i_list:
+            self._held_set.update(task_i_list)
+            self._ready_list.extend(task_i_list)
+        elif not leased_count:
+            self._is_lease_done = True
+        else:
+            # some tasks are leased and not finished (node of them may be dead,
+            # then its tasks are leased here when lease expires)
+            
+            self._next_lease_time = self._io_loop.time() + self._poll_interval
+    
+    def _start_lease(self):
+        if self._is_leasing or self._is_lease_done or self.is_failed:
+            return
+        
+        if self._next_lease_time is not None and \
+                self._io_loop.time() < self._next_lease_time:
+            return
+        
+        self._is_leasing = True
+        self._next_lease_time = None
+        worker_pool.run_blocking(self._lease_thread, callback=self._on_lease_done)
+    
+    def iter_indexes(self):
+        # gives ``None`` while there is no leased task yet
+        
+        self._renew_timer.start()
+        
+        while True:
+            if len(self._ready_list) <= self._batch_size // 2:
+                # next batch is leased in advance
+                
+                self._start_lease()
+            
+            if self._ready_list:
+                yield self._ready_list.popleft()
+                
+                continue
+            
+            if self._is_lease_done or self.is_failed:
+                return
+            
+            yield None
+    
+    def _write_thread(self, task_i, write_args):
+        # failed write is kept here (not in IOLoop callback), so ``close()``
+        # sees it
+        
+        func, *args = write_args
+        
+        try:
+            func(*args)
+        except Exception as e:
+            write_error = e
+        else:
+            write_error = None
+        
+        with self._write_cond:
+            if write_error is not None:
+                self._unwritten_map[task_i] = write_args
+            
+            self._write_count -= 1
+            self._write_cond.notify_all()
+        
+        return write_error
+    
+    def _on_write_done(self, task_i, write_error, error):
+        if write_error is None and error is None:
+            self._held_set.discard(task_i)
+            
+            return
+        
+        # task is still held (it must not be leased by other node). write is
+        # retried by renew timer
+        
+        if write_error is None:
+            error_type, error_str, error_tb = error
+            error_name = error_type.__name__
+        else:
+            error_name, error_str = type(write_error).__name__, str(write_error)
+        
+        self._report('queue: write error of task {!r}: {}: {}'.format(
+                task_i, error_name, error_str))
+    
+    def _write(self, task_i, *write_args):
+        if self._is_closed:
+            return
+        
+        with self._write_cond:
+            self._write_count += 1
+        
+        worker_pool.run_blocking(
+                self._write_thread, task_i, write_args,
+                callback=lambda result, error: self._on_write_done(task_i, result, error))
+    
+    def complete(self, task_i, result):
+        self._write(task_i, self._backend.complete, self._node, task_i, result)
+    
+    def fail(self, task_i, error):
+        self._write(task_i, self._backend.fail, self._node, task_i, error)
+    
+    def flush(self):
+        # waits until all ``complete()`` and ``fail()`` are written
+        
+        with self._write_cond:
+            while self._write_count:
+                self._write_cond.wait()
+    
+    def get_counts(self):
+        self.flush()
+        
+        return self._backend.get_counts()
+    
+    def close(self):
+        # last try of failed writes. tasks which are not written even now
+        # will be leased by other node when their lease expires
+        
+        self._renew_timer.stop()
+        self.flush()
+        self._is_closed = True
+        
+        for task_i, (func, *args) in sorted(self._unwritten_map.items()):
+            try:
+                func(*args)
+            except Exception as e:
+                self._report('queue: write error of task {!r}: {}: {}'.format(
+                        task_i, type(e).__name__, e))
+        
+        self._unwritten_map.clear()
+        self._backend.close()
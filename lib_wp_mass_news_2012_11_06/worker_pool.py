@@ -0,0 +1,160 @@
+# -*- mode: python; coding: utf-8 -*-
+#
+# Copyright 2013 Andrej A Antonov <polymorphm@gmail.com>.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+assert str is not bytes
+
+import time
+import threading
+import collections
+import traceback
+from tornado import ioloop, stack_context
+
+DEFAULT_POOL_SIZE = 20
+
+_pool = None
+
+class WorkerPool:
+    def __init__(self, size=None):
+        if size is None:
+            size = DEFAULT_POOL_SIZE
+        
+        assert size > 0
+        
+        self._size = size
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._thread_count = 0
+        self._idle_count = 0
+        self._busy_count = 0
+        self._busy_time = 0.0
+        self._done_count = 0
+        self._is_shutdown = False
+        self._stats_time = time.monotonic()
+        self._stats_busy_time = 0.0
+    
+    def _worker_thread(self):
+        while True:
+            with self._cond:
+                self._idle_count += 1
+                try:
+                    while not self._queue and not self._is_shutdown:
+                        self._cond.wait()
+                finally:
+                    self._idle_count -= 1
+                
+                if not self._queue:
+                    self._thread_count -= 1
+                    
+                    return
+                
+                func, args, kwargs, callback, io_loop = self._queue.popleft()
+                self._busy_count += 1
+            
+            begin_time = time.monotonic()
+            result = None
+            error = None
+            
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                error = type(e), str(e), traceback.format_exc()
+            
+            with self._cond:
+                self._busy_count -= 1
+                self._busy_time += time.monotonic() - begin_time
+                self._done_count += 1
+            
+            if callback is not None:
+                io_loop.add_callback(
+                        lambda _callback=callback, _result=result, _error=error:
+                                _callback(_result, _error))
+    
+    def submit(self, func, *args, callback=None, **kwargs):
+        # ``callback(result, error)`` will be called from IOLoop thread
+        
+        callback = stack_context.wrap(callback)
+        io_loop = ioloop.IOLoop.instance()
+        
+        with self._cond:
+            assert not self._is_shutdown
+            
+            self._queue.append((func, args, kwargs, callback, io_loop))
+            
+            if self._idle_count < len(self._queue) and \
+                    self._thread_count < self._size:
+                self._thread_count += 1
+                threading.Thread(target=self._worker_thread, daemon=True).start()
+            else:
+                self._cond.notify()
+    
+    def get_stats(self):
+        # utilisation is measured since previous ``get_stats()`` call
+        
+        with self._cond:
+            now = time.monotonic()
+            busy_time = self._busy_time - self._stats_busy_time
+            elapsed = now - self._stats_time
+            
+            self._stats_time = now
+            self._stats_busy_time = self._busy_time
+            
+            if elapsed > 0.0:
+                utilisation = min(busy_time / (elapsed * self._size), 1.0)
+            else:
+                utilisation = 0.0
+            
+            return {
+                    'size': self._size,
+                    'threads': self._thread_count,
+                    'busy': self._busy_count,
+                    'queue': len(self._queue),
+                    'done': self._done_count,
+                    'utilisation': utilisation,
+                    }
+    
+    def shutdown(self):
+        with self._cond:
+            self._is_shutdown = True
+            self._cond.notify_all()
+
+def init_pool(size=None):
+    global _pool
+    
+    if _pool is not None:
+        _pool.shutdown()
+    
+    _pool = WorkerPool(size=size)
+    
+    return _pool
+
+def get_pool():
+    if _pool is None:
+        return init_pool()
+    
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    
+    if _pool is None:
+        return
+    
+    _pool.shutdown()
+    _pool = None
+
+def run_blocking(func, *args, callback=None, **kwargs):
+    get_pool().submit(func, *args, callback=callback, **kwargs)
@@ -17,19 +17,21 @@
 
 assert str is not bytes
 
-import traceback
-import threading
+import time
 import json
 import csv
 import weakref
 from urllib import parse as url
-from http import cookiejar
-from urllib import request
-from tornado import ioloop, stack_context, gen
+from urllib import error as url_error
+from tornado import stack_context, gen
 from . import get_items
 from . import urllib_request_helper
-from . import lib_html_parse
-html_parse = lib_html_parse.import_module('html_parse')
+from . import worker_pool
+from . import auth_session
+from . import html_stream
+
+# WordPress nonce is valid from 12 to 24 hours
+INLINE_EDIT_PARAM_LIFETIME = 12.0 * 60.0 * 60.0
 
 _wp_acc_save_excl_list = weakref.WeakKeyDictionary()
 
@@ -45,33 +47,10 @@ class PublishWpError(WpError):
 class Task:
     pass
 
-def wp_post_blocking(blog_url=None, username=None, password=None,
-        title=None, content=None, slug=None, ua_name=None, proxy_kwargs=None):
-    assert blog_url is not None
-    assert username is not None
-    assert password is not None
-    assert title is not None
-    assert content is not None
-    
-    if ua_name is None:
-        ua_name = urllib_request_helper.DEFAULT_USER_AGENT_NAME
-    
-    blog_url_parsed = url.urlparse(blog_url)
-    
-    assert blog_url_parsed.scheme in ('https', 'http')
-    
+def wp_auth(opener, blog_url, username, password, ua_name,
+        proxy_kwargs=None, retry_policy=None):
     wp_login_url = url.urljoin(blog_url, 'wp-login.php')
     wp_admin_url = url.urljoin(blog_url, 'wp-admin/')
-    wp_post_url = url.urljoin(blog_url, 'wp-admin/post-new.php')
-    wp_edit_url = url.urljoin(blog_url, 'wp-admin/edit.php')
-    wp_ajax_url = url.urljoin(blog_url, 'wp-admin/admin-ajax.php')
-    
-    cookies = cookiejar.CookieJar()
-    opener = request.build_opener(
-            request.HTTPCookieProcessor(cookiejar=cookies),
-            )
-    
-    # *** PHASE: auth ***
     
     resp = urllib_request_helper.ext_open(
             opener,
@@ -93,16 +72,17 @@ def wp_post_blocking(blog_url=None, username=None, password=None,
                     }).encode(),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
             )
     
     if resp.getcode() != 200 or resp.geturl() != wp_admin_url:
         raise AuthWpError('wp auth error')
-    
-    # *** PHASE: get params ***
-    
+
+def wp_get_inline_edit_param(opener, wp_edit_url, ua_name,
+        proxy_kwargs=None, retry_policy=None):
     resp = urllib_request_helper.ext_open(
             opener,
-            wp_post_url,
+            wp_edit_url,
             headers=(
                     ('User-Agent', ua_name),
                     
@@ -113,41 +93,107 @@ def wp_post_blocking(blog_url=None, username=None, password=None,
                     ),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
             )
     
-    if resp.getcode() != 200 or resp.geturl() != wp_post_url:
-        raise WpError('wp get params error')
-    
-    data = resp.read(urllib_request_helper.DEFAULT_RESPONSE_LIMIT).decode('utf-8', 'replace')
-    
-    form_html_nodes = tuple(html_parse.find_tags(
-            (html_parse.html_parse(data),),
-            'form',
-            attrs={
-                    'id': 'post',
-                    'method': 'post',
-                    'action': 'post.php',
-                    },
-            ))
-    
-    def get_params():
-        params = {}
-        for node in html_parse.find_tags(
-                form_html_nodes,
-                'input',
-                ):
-            name = node.attrs.get('name')
-            if not name:
-                continue
-            value = node.attrs.get('value')
-            if not value:
-                continue
+    if resp.getcode() != 200 or resp.geturl() != wp_edit_url:
+        raise WpError('wp get edit-param error')
+    
+    inline_edit_param_finder = urllib_request_helper.stream_read(
+            resp,
+            html_stream.TagFinder(
+                    'input',
+                    attrs={
+                            'id': '_inline_edit',
+                            },
+                    ),
+            )
+    assert inline_edit_param_finder.tags
+    
+    return inline_edit_param_finder.tags[0].attrs['value']
+
+def wp_post_blocking(blog_url=None, username=None, password=None,
+        title=None, content=None, slug=None, ua_name=None, proxy_kwargs=None,
+        session_pool=None, retry_policy=None):
+    assert blog_url is not None
+    assert username is not None
+    assert password is not None
+    assert title is not None
+    assert content is not None
+    
+    if ua_name is None:
+        ua_name = urllib_request_helper.DEFAULT_USER_AGENT_NAME
+    
+    if retry_policy is not None:
+        # time budget of task starts now
+        retry_policy = retry_policy.begin()
+    
+    blog_url_parsed = url.urlparse(blog_url)
+    
+    assert blog_url_parsed.scheme in ('https', 'http')
+    
+    wp_post_url = url.urljoin(blog_url, 'wp-admin/post-new.php')
+    wp_edit_url = url.urljoin(blog_url, 'wp-admin/edit.php')
+    wp_ajax_url = url.urljoin(blog_url, 'wp-admin/admin-ajax.php')
+    
+    session_key = 'wp', blog_url, username, password
+    session = auth_session.acquire_session(session_pool, session_key)
+    
+    while True:
+        if session is not None:
+            is_new_session = False
+        else:
+            is_new_session = True
             
-            params[name] = value
+            # *** PHASE: auth ***
+            
+            session = auth_session.Session()
+            wp_auth(session.opener, blog_url, username, password, ua_name,
+                    proxy_kwargs=proxy_kwargs, retry_policy=retry_policy)
         
-        return params
-    
-    params = get_params()
+        opener = session.opener
+        
+        # *** PHASE: get params ***
+        
+        resp = urllib_request_helper.ext_open(
+                opener,
+                wp_post_url,
+                headers=(
+                        ('User-Agent', ua_name),
+                        
+                        # header-line for Blog.Com:
+                        ('Accept',
+                                'text/html,application/xhtml+xml,'
+                                'application/xml;q=0.9,*/*;q=0.8'),
+                        ),
+                timeout=urllib_request_helper.DEFAULT_TIMEOUT,
+                proxy_kwargs=proxy_kwargs,
+                retry_policy=retry_policy,
+                )
+        
+        if resp.getcode() == 200 and resp.geturl() == wp_post_url:
+            if is_new_session:
+                auth_session.save_session(session_pool, session_key, session)
+            
+            break
+        
+        if is_new_session:
+            raise WpError('wp get params error')
+        
+        # session from pool is logged out. try again with new session
+        
+        session = None
+    
+    params = urllib_request_helper.stream_read(
+            resp,
+            html_stream.FormExtractor(
+                    attrs={
+                            'id': 'post',
+                            'method': 'post',
+                            'action': 'post.php',
+                            },
+                    ),
+            ).get_params()
     
     # *** PHASE: autosave ***
     
@@ -182,117 +228,112 @@ def wp_post_blocking(blog_url=None, username=None, password=None,
             data=url.urlencode(post_data).encode(),
             timeout=urllib_request_helper.DEFAULT_TIMEOUT,
             proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
             )
     
     if resp.getcode() != 200 or resp.geturl() != wp_ajax_url:
         raise WpError('wp autosave error')
     
-    # *** PHASE: get edit-param ***
+    inline_edit_param, inline_edit_time = session.params.get('wp_inline_edit', (None, None))
     
-    resp = urllib_request_helper.ext_open(
-            opener,
-            wp_edit_url,
-            headers=(
-                    ('User-Agent', ua_name),
-                    
-                    # header-line for Blog.Com:
-                    ('Accept',
-                            'text/html,application/xhtml+xml,'
-                            'application/xml;q=0.9,*/*;q=0.8'),
-                    ),
-            timeout=urllib_request_helper.DEFAULT_TIMEOUT,
-            proxy_kwargs=proxy_kwargs,
-            )
-    
-    if resp.getcode() != 200 or resp.geturl() != wp_edit_url:
-        raise WpError('wp get edit-param error')
-    
-    data = resp.read(urllib_request_helper.DEFAULT_RESPONSE_LIMIT).decode('utf-8', 'replace')
-    
-    inline_edit_param_node = next(iter(html_parse.find_tags(
-            (html_parse.html_parse(data),),
-            'input',
-            attrs={
-                    'id': '_inline_edit',
-                    },
-            )), None)
-    assert inline_edit_param_node is not None
-    
-    inline_edit_param = inline_edit_param_node.attrs['value']
-    
-    # *** PHASE: publish ***
-    
-    post_data = {
-            'post_title': title,
-            'post_name': slug if slug is not None else '',
-            #NOT_NEED#'mm': params['cur_mm'],
-            #NOT_NEED#'jj': params['cur_jj'],
-            #NOT_NEED#'aa': params['cur_aa'],
-            #NOT_NEED#'hh': params['cur_hh'],
-            #NOT_NEED#'mn': params['cur_mn'],
-            #NOT_NEED#'ss': params['ss'],
-            'post_author': params['post_author'],
-            'post_password': '',
-            'post_category[]': params['post_category[]'],
-            'tax_input[post_tag]': '',
-            'comment_status': 'open',
-            'ping_status': 'open',
-            '_status': 'publish',
-            'post_format': '0',
-            '_inline_edit': inline_edit_param,
-            'post_view': 'list',
-            'screen': 'edit-post',
-            'action': 'inline-save',
-            'post_type': 'post',
-            'post_ID': params['post_ID'],
-            #NOT_NEED#'edit_date': 'true',
-            'post_status': 'all',
-            }
-    
-    resp = urllib_request_helper.ext_open(
-            opener,
-            wp_ajax_url,
-            headers=(
-                    ('User-Agent', ua_name),
-                    ('X-Requested-With', 'XMLHttpRequest'),
-                    
-                    # header-line for Blog.Com:
-                    ('Accept',
-                            'text/html,application/xhtml+xml,'
-                            'application/xml;q=0.9,*/*;q=0.8'),
-                    ),
-            data=url.urlencode(post_data).encode(),
-            timeout=urllib_request_helper.DEFAULT_TIMEOUT,
-            proxy_kwargs=proxy_kwargs,
-            )
+    if inline_edit_param is not None and \
+            time.monotonic() - inline_edit_time > INLINE_EDIT_PARAM_LIFETIME:
+        inline_edit_param = None
     
-    if resp.getcode() != 200 or resp.geturl() != wp_ajax_url:
-        raise PublishWpError('wp publish error')
+    while True:
+        if inline_edit_param is not None:
+            is_cached_inline_edit = True
+        else:
+            is_cached_inline_edit = False
+            
+            # *** PHASE: get edit-param ***
+            
+            inline_edit_param = wp_get_inline_edit_param(
+                    opener, wp_edit_url, ua_name,
+                    proxy_kwargs=proxy_kwargs, retry_policy=retry_policy)
+            session.params['wp_inline_edit'] = inline_edit_param, time.monotonic()
+        
+        # *** PHASE: publish ***
+        
+        post_data = {
+                'post_title': title,
+                'post_name': slug if slug is not None else '',
+                #NOT_NEED#'mm': params['cur_mm'],
+                #NOT_NEED#'jj': params['cur_jj'],
+                #NOT_NEED#'aa': params['cur_aa'],
+                #NOT_NEED#'hh': params['cur_hh'],
+                #NOT_NEED#'mn': params['cur_mn'],
+                #NOT_NEED#'ss': params['ss'],
+                'post_author': params['post_author'],
+                'post_password': '',
+                'post_category[]': params['post_category[]'],
+                'tax_input[post_tag]': '',
+                'comment_status': 'open',
+                'ping_status': 'open',
+                '_status': 'publish',
+                'post_format': '0',
+                '_inline_edit': inline_edit_param,
+                'post_view': 'list',
+                'screen': 'edit-post',
+                'action': 'inline-save',
+                'post_type': 'post',
+                'post_ID': params['post_ID'],
+                #NOT_NEED#'edit_date': 'true',
+                'post_status': 'all',
+                }
+        
+        try:
+            resp = urllib_request_helper.ext_open(
+                    opener,
+                    wp_ajax_url,
+                    headers=(
+                            ('User-Agent', ua_name),
+                            ('X-Requested-With', 'XMLHttpRequest'),
+                            
+                            # header-line for Blog.Com:
+                            ('Accept',
+                                    'text/html,application/xhtml+xml,'
+                                    'application/xml;q=0.9,*/*;q=0.8'),
+                            ),
+                    data=url.urlencode(post_data).encode(),
+                    timeout=urllib_request_helper.DEFAULT_TIMEOUT,
+                    proxy_kwargs=proxy_kwargs,
+                    retry_policy=retry_policy,
+                    )
+        except url_error.HTTPError as e:
+            if e.code != 403:
+                raise
+            
+            # newer WordPress rejects wrong nonce with 403
+            is_rejected = True
+        else:
+            if resp.getcode() != 200 or resp.geturl() != wp_ajax_url:
+                raise PublishWpError('wp publish error')
+            
+            data = resp.read(urllib_request_helper.DEFAULT_RESPONSE_LIMIT).decode(
+                    'utf-8', 'replace')
+            is_rejected = data.strip() == '-1'
+        
+        if not is_rejected:
+            break
+        
+        if not is_cached_inline_edit:
+            raise PublishWpError('wp publish error (edit-param is rejected)')
+        
+        # cached edit-param is expired. try again with fresh one
+        
+        inline_edit_param = None
     
     # *** END ***
     
+    auth_session.release_session(session_pool, session_key, session)
+    
     page_id = int(params['post_ID'])
     
     return url.urljoin(blog_url, '?{}'.format(url.urlencode({'page_id': page_id})))
 
 def wp_post(*args, callback=None, **kwargs):
-    callback = stack_context.wrap(callback)
-    
-    def wp_post_thread():
-        result = None
-        error = None
-        
-        try:
-            result = wp_post_blocking(*args, **kwargs)
-        except Exception as e:
-            error = type(e), str(e), traceback.format_exc()
-        
-        if callback is not None:
-            ioloop.IOLoop.instance().add_callback(lambda: callback(result, error))
-    
-    t = threading.Thread(target=wp_post_thread)
-    t.daemon = True
-    t.start()
+    worker_pool.run_blocking(wp_post_blocking, *args, callback=callback, **kwargs)
 
 def wp_acc_save(task_cfg, task):
     fd = task_cfg.out.get_fd(ext='accs.csv')
@@ -315,22 +356,29 @@ def get_wp_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
     task_begin_handle = stack_context.wrap(task_begin_handle)
     task_end_handle = stack_context.wrap(task_end_handle)
     
-    raw_accs_iter = get_items.get_random_infinite_items(task_cfg.accs, is_csv=True)
+    # accounts of dead hosts (found by dns prefetch) are dropped here, so
+    # iterator ends if all accounts of shard are dead
+    raw_accs_iter = get_items.get_random_infinite_items(
+            task_cfg.accs, is_csv=True, shard=task_cfg.acc_shard,
+            filter_func=lambda acc_row: len(acc_row) != 5 or
+                    url.urlparse(acc_row[2]).hostname not in task_cfg.dead_hosts)
     title_and_content_iter = get_items.get_title_and_content(\
             get_items.get_random_infinite_items, task_cfg.titles, task_cfg.content)
     
     def next_acc():
         if 'wp:0' == task_cfg.acc_fmt:
-            while True:
-                acc_row = next(raw_accs_iter)
-                
-                if len(acc_row) != 5:
-                    raise NotImplementedError(
-                            'invalid or not implemented account format')
-                
-                email, email_password, blog_url, username, password = acc_row
-                
-                return blog_url, username, password, acc_row
+            acc_row = next(raw_accs_iter, None)
+            
+            if acc_row is None:
+                raise WpError('no account with live host')
+            
+            if len(acc_row) != 5:
+                raise NotImplementedError(
+                        'invalid or not implemented account format')
+            
+            email, email_password, blog_url, username, password = acc_row
+            
+            return blog_url, username, password, acc_row
         
         # if 'wp:...' == task_cfg.acc_fmt:
         #  ...
@@ -338,7 +386,14 @@ def get_wp_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
         
         raise NotImplementedError('not implemented account format')
     
-    for task_i in range(task_cfg.count):
+    for task_i in task_cfg.task_indexes:
+        if task_i is None:
+            # no task yet (see ``work_queue.QueueClient``)
+            
+            yield None
+            
+            continue
+        
         task = Task()
         
         task.i = task_i
@@ -347,6 +402,8 @@ def get_wp_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=None
         task.title, task.content = next(title_and_content_iter)
         task.ua_name = task_cfg.ua_name
         task.proxy_kwargs = task_cfg.proxy_kwargs
+        task.retry_policy = task_cfg.retry_policy
+        task.session_pool = task_cfg.session_pool
         
         task.acc_save = lambda _task=task: wp_acc_save(
                 task_cfg,
@@ -374,6 +431,8 @@ def wp_post_task(task, callback=None):
             content=task.content,
             ua_name=task.ua_name,
             proxy_kwargs=task.proxy_kwargs,
+            retry_policy=task.retry_policy,
+            session_pool=task.session_pool,
             )).args
     
     if task.task_end_handle is not None:
@@ -18,7 +18,6 @@
 assert str is not bytes
 
 import traceback
-import threading
 import csv
 import weakref
 from xmlrpc import client as xmlrpc
@@ -27,6 +26,10 @@ from urllib import request
 from tornado import ioloop, stack_context, gen
 from . import get_items
 from . import urllib_request_helper
+from . import worker_pool
+
+DEFAULT_MULTICALL_SIZE = 1
+DEFAULT_MULTICALL_WAIT = 0.5
 
 _wpapi_acc_save_excl_list = weakref.WeakKeyDictionary()
 
@@ -42,51 +45,74 @@ class ResultWpapiError(WpapiError):
 class Task:
     pass
 
-def wpapi_post_blocking(blog_url=None, username=None, password=None,
-        title=None, content=None, slug=None, ua_name=None, proxy_kwargs=None):
-    assert blog_url is not None
-    assert username is not None
-    assert password is not None
-    assert title is not None
-    assert content is not None
-    
-    if ua_name is None:
-        ua_name = urllib_request_helper.DEFAULT_USER_AGENT_NAME
-    
-    xmlrpc_url = url.urljoin(blog_url, 'xmlrpc.php')
-    opener = request.build_opener()
-    
+def wpapi_post_params(username, password, title, content, slug=None):
     xmlrpc_data_content = {
             'title': title,
             'description': content,
             }
     if slug is not None:
         xmlrpc_data_content['wp_slug'] = slug
+    
+    return 0, username, password, xmlrpc_data_content, True
+
+def wpapi_xmlrpc_request(blog_url, xmlrpc_data, ua_name=None):
+    if ua_name is None:
+        ua_name = urllib_request_helper.DEFAULT_USER_AGENT_NAME
+    
+    xmlrpc_url = url.urljoin(blog_url, 'xmlrpc.php')
+    
+    return request.Request(
+            xmlrpc_url,
+            data=xmlrpc_data.encode('utf-8', 'replace'),
+            headers={
+                    'User-Agent': ua_name,
+                    'Content-Type': 'application/xml;charset=utf-8',
+                    },
+            )
+
+def wpapi_post_request(blog_url, username, password,
+        title, content, slug=None, ua_name=None):
     xmlrpc_data = xmlrpc.dumps(
-            (0, username, password, xmlrpc_data_content, True),
+            wpapi_post_params(username, password, title, content, slug=slug),
             'metaWeblog.newPost',
             )
     
-    resp = urllib_request_helper.ext_open(
-            opener,
-            request.Request(
-                    xmlrpc_url,
-                    data=xmlrpc_data.encode('utf-8', 'replace'),
-                    headers={
-                            'User-Agent': ua_name,
-                            'Content-Type': 'application/xml;charset=utf-8',
-                            },
-                    ),
-            timeout=urllib_request_helper.DEFAULT_TIMEOUT,
-            proxy_kwargs=proxy_kwargs,
+    return wpapi_xmlrpc_request(blog_url, xmlrpc_data, ua_name=ua_name)
+
+def wpapi_multicall_request(blog_url, post_kwargs_list, ua_name=None):
+    # one ``system.multicall`` for several ``metaWeblog.newPost``
+    
+    xmlrpc_data = xmlrpc.dumps(
+            ([
+                    {
+                            'methodName': 'metaWeblog.newPost',
+                            'params': wpapi_post_params(
+                                    post_kwargs['username'],
+                                    post_kwargs['password'],
+                                    post_kwargs['title'],
+                                    post_kwargs['content'],
+                                    slug=post_kwargs.get('slug'),
+                                    ),
+                            }
+                    for post_kwargs in post_kwargs_list
+                    ],),
+            'system.multicall',
             )
     
+    return wpapi_xmlrpc_request(blog_url, xmlrpc_data, ua_name=ua_name)
+
+def wpapi_post_result(blog_url, resp):
+    xmlrpc_url = url.urljoin(blog_url, 'xmlrpc.php')
+    
     if resp.getcode() != 200 or resp.geturl() != xmlrpc_url:
         raise HttpWpapiError('http error')
     
     data = resp.read(urllib_request_helper.DEFAULT_RESPONSE_LIMIT).decode('utf-8', 'replace')
     xmlrpc_resp_params, xmlrpc_resp_method = xmlrpc.loads(data) # or raise xmlrpc.client.Fault
     
+    return wpapi_post_url(blog_url, xmlrpc_resp_params)
+
+def wpapi_post_url(blog_url, xmlrpc_resp_params):
     if len(xmlrpc_resp_params) != 1 or not isinstance(xmlrpc_resp_params[0], str):
         raise ResultWpapiError('invalid result')
     
@@ -96,24 +122,245 @@ def wpapi_post_blocking(blog_url=None, username=None, password=None,
     
     return post_url
 
-def wpapi_post(*args, callback=None, **kwargs):
-    callback = stack_context.wrap(callback)
+def wpapi_multicall_result(blog_url, resp, count):
+    # returns list of ``(result, error)`` -- one item for each post
+    
+    xmlrpc_url = url.urljoin(blog_url, 'xmlrpc.php')
+    
+    if resp.getcode() != 200 or resp.geturl() != xmlrpc_url:
+        raise HttpWpapiError('http error')
     
-    def wpapi_post_thread():
+    data = resp.read(urllib_request_helper.DEFAULT_RESPONSE_LIMIT).decode('utf-8', 'replace')
+    xmlrpc_resp_params, xmlrpc_resp_method = xmlrpc.loads(data) # or raise xmlrpc.client.Fault
+    
+    if len(xmlrpc_resp_params) != 1 or not isinstance(xmlrpc_resp_params[0], list) or \
+            len(xmlrpc_resp_params[0]) != count:
+        raise ResultWpapiError('invalid multicall result')
+    
+    result_list = []
+    
+    for xmlrpc_call_result in xmlrpc_resp_params[0]:
         result = None
         error = None
         
         try:
-            result = wpapi_post_blocking(*args, **kwargs)
+            if isinstance(xmlrpc_call_result, dict):
+                raise xmlrpc.Fault(
+                        xmlrpc_call_result.get('faultCode'),
+                        xmlrpc_call_result.get('faultString'),
+                        )
+            
+            if not isinstance(xmlrpc_call_result, list):
+                raise ResultWpapiError('invalid result')
+            
+            result = wpapi_post_url(blog_url, xmlrpc_call_result)
         except Exception as e:
             error = type(e), str(e), traceback.format_exc()
         
-        if callback is not None:
-            ioloop.IOLoop.instance().add_callback(lambda: callback(result, error))
+        result_list.append((result, error))
+    
+    return result_list
+
+def wpapi_post_blocking(blog_url=None, username=None, password=None,
+        title=None, content=None, slug=None, ua_name=None, proxy_kwargs=None,
+        retry_policy=None):
+    assert blog_url is not None
+    assert username is not None
+    assert password is not None
+    assert title is not None
+    assert content is not None
+    
+    if retry_policy is not None:
+        # time budget of task starts now
+        retry_policy = retry_policy.begin()
+    
+    opener = urllib_request_helper.build_opener()
+    
+    resp = urllib_request_helper.ext_open(
+            opener,
+            wpapi_post_request(blog_url, username, password,
+                    title, content, slug=slug, ua_name=ua_name),
+            timeout=urllib_request_helper.DEFAULT_TIMEOUT,
+            proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
+            )
+    
+    return wpapi_post_result(blog_url, resp)
+
+def wpapi_post(*args, callback=None, **kwargs):
+    worker_pool.run_blocking(wpapi_post_blocking, *args, callback=callback, **kwargs)
+
+def wpapi_multicall_blocking(blog_url, post_kwargs_list, ua_name=None,
+        proxy_kwargs=None, retry_policy=None):
+    if retry_policy is not None:
+        # time budget of task starts now
+        retry_policy = retry_policy.begin()
+    
+    opener = urllib_request_helper.build_opener()
+    
+    resp = urllib_request_helper.ext_open(
+            opener,
+            wpapi_multicall_request(blog_url, post_kwargs_list, ua_name=ua_name),
+            timeout=urllib_request_helper.DEFAULT_TIMEOUT,
+            proxy_kwargs=proxy_kwargs,
+            retry_policy=retry_policy,
+            )
+    
+    return wpapi_multicall_result(blog_url, resp, len(post_kwargs_list))
+
+def wpapi_multicall(*args, callback=None, **kwargs):
+    worker_pool.run_blocking(wpapi_multicall_blocking, *args, callback=callback, **kwargs)
+
+@gen.engine
+def wpapi_post_async(blog_url=None, username=None, password=None,
+        title=None, content=None, slug=None, ua_name=None, proxy_kwargs=None,
+        retry_policy=None, callback=None):
+    # the same as ``wpapi_post()``, but without thread.
+    # ``callback(result, error)`` is called from IOLoop thread
+    
+    callback = stack_context.wrap(callback)
+    
+    assert blog_url is not None
+    assert username is not None
+    assert password is not None
+    assert title is not None
+    assert content is not None
+    
+    if retry_policy is not None:
+        # time budget of task starts now
+        retry_policy = retry_policy.begin()
+    
+    result = None
+    error = None
+    
+    try:
+        resp = yield gen.Task(
+                urllib_request_helper.ext_fetch,
+                None,
+                wpapi_post_request(blog_url, username, password,
+                        title, content, slug=slug, ua_name=ua_name),
+                timeout=urllib_request_helper.DEFAULT_TIMEOUT,
+                proxy_kwargs=proxy_kwargs,
+                retry_policy=retry_policy,
+                )
+        
+        result = wpapi_post_result(blog_url, resp)
+    except Exception as e:
+        error = type(e), str(e), traceback.format_exc()
     
-    t = threading.Thread(target=wpapi_post_thread)
-    t.daemon = True
-    t.start()
+    if callback is not None:
+        callback(result, error)
+
+@gen.engine
+def wpapi_multicall_async(blog_url, post_kwargs_list, ua_name=None, proxy_kwargs=None,
+        retry_policy=None, callback=None):
+    # the same as ``wpapi_multicall()``, but without thread
+    
+    callback = stack_context.wrap(callback)
+    
+    if retry_policy is not None:
+        # time budget of task starts now
+        retry_policy = retry_policy.begin()
+    
+    result = None
+    error = None
+    
+    try:
+        resp = yield gen.Task(
+                urllib_request_helper.ext_fetch,
+                None,
+                wpapi_multicall_request(blog_url, post_kwargs_list, ua_name=ua_name),
+                timeout=urllib_request_helper.DEFAULT_TIMEOUT,
+                proxy_kwargs=proxy_kwargs,
+                retry_policy=retry_policy,
+                )
+        
+        result = wpapi_multicall_result(blog_url, resp, len(post_kwargs_list))
+    except Exception as e:
+        error = type(e), str(e), traceback.format_exc()
+    
+    if callback is not None:
+        callback(result, error)
+
+class MulticallBatcher:
+    # collects posts to the same blog and sends them by one
+    # ``system.multicall``. batch is sent when it is full or when
+    # ``wait`` seconds passed after its first post.
+    # this class must be used from IOLoop thread
+    
+    def __init__(self, size=None, wait=None, http_engine=None):
+        if size is None:
+            size = DEFAULT_MULTICALL_SIZE
+        
+        if wait is None:
+            wait = DEFAULT_MULTICALL_WAIT
+        
+        self._size = size
+        self._wait = wait
+        self._http_engine = http_engine
+        self._io_loop = ioloop.IOLoop.instance()
+        # ``blog_url -> (list of (post_kwargs, callback), timeout)``
+        self._batch_map = {}
+    
+    def post(self, callback=None, **post_kwargs):
+        # the same interface as ``wpapi_post()`` has
+        
+        blog_url = post_kwargs['blog_url']
+        
+        try:
+            item_list, timeout = self._batch_map[blog_url]
+        except KeyError:
+            timeout = self._io_loop.add_timeout(
+                    self._io_loop.time() + self._wait,
+                    lambda: self._flush(blog_url),
+                    )
+            item_list = []
+            self._batch_map[blog_url] = item_list, timeout
+        
+        item_list.append((post_kwargs, stack_context.wrap(callback)))
+        
+        if len(item_list) >= self._size:
+            self._flush(blog_url)
+    
+    def _flush(self, blog_url):
+        try:
+            item_list, timeout = self._batch_map.pop(blog_url)
+        except KeyError:
+            return
+        
+        self._io_loop.remove_timeout(timeout)
+        
+        if self._http_engine == 'async':
+            post_func = wpapi_post_async
+            multicall_func = wpapi_multicall_async
+        else:
+            post_func = wpapi_post
+            multicall_func = wpapi_multicall
+        
+        if len(item_list) == 1:
+            post_kwargs, callback = item_list[0]
+            post_func(callback=callback, **post_kwargs)
+            
+            return
+        
+        post_kwargs_list = [post_kwargs for post_kwargs, callback in item_list]
+        
+        def on_multicall(result_list, error):
+            if error is not None:
+                result_list = [(None, error)] * len(item_list)
+            
+            for (post_kwargs, callback), (result, error) in zip(item_list, result_list):
+                if callback is not None:
+                    callback(result, error)
+        
+        multicall_func(
+                blog_url,
+                post_kwargs_list,
+                ua_name=post_kwargs_list[0].get('ua_name'),
+                proxy_kwargs=post_kwargs_list[0].get('proxy_kwargs'),
+                retry_policy=post_kwargs_list[0].get('retry_policy'),
+                callback=on_multicall,
+                )
 
 def wpapi_acc_save(task_cfg, task):
     fd = task_cfg.out.get_fd(ext='accs.csv')
@@ -136,22 +383,38 @@ def get_wpapi_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=N
     task_begin_handle = stack_context.wrap(task_begin_handle)
     task_end_handle = stack_context.wrap(task_end_handle)
     
-    raw_accs_iter = get_items.get_random_infinite_items(task_cfg.accs, is_csv=True)
+    # accounts of dead hosts (found by dns prefetch) are dropped here, so
+    # iterator ends if all accounts of shard are dead
+    raw_accs_iter = get_items.get_random_infinite_items(
+            task_cfg.accs, is_csv=True, shard=task_cfg.acc_shard,
+            filter_func=lambda acc_row: len(acc_row) != 5 or
+                    url.urlparse(acc_row[2]).hostname not in task_cfg.dead_hosts)
     title_and_content_iter = get_items.get_title_and_content(\
             get_items.get_random_infinite_items, task_cfg.titles, task_cfg.content)
     
+    if task_cfg.wpapi_multicall_size > 1:
+        multicall_batcher = MulticallBatcher(
+                size=task_cfg.wpapi_multicall_size,
+                wait=task_cfg.wpapi_multicall_wait,
+                http_engine=task_cfg.http_engine,
+                )
+    else:
+        multicall_batcher = None
+    
     def next_acc():
         if 'wpapi:0' == task_cfg.acc_fmt:
-            while True:
-                acc_row = next(raw_accs_iter)
-                
-                if len(acc_row) != 5:
-                    raise NotImplementedError(
-                            'invalid or not implemented account format')
-                
-                email, email_password, blog_url, username, password = acc_row
-                
-                return blog_url, username, password, acc_row
+            acc_row = next(raw_accs_iter, None)
+            
+            if acc_row is None:
+                raise WpapiError('no account with live host')
+            
+            if len(acc_row) != 5:
+                raise NotImplementedError(
+                        'invalid or not implemented account format')
+            
+            email, email_password, blog_url, username, password = acc_row
+            
+            return blog_url, username, password, acc_row
         
         # if 'wpapi:...' == task_cfg.acc_fmt:
         #  ...
@@ -159,7 +422,14 @@ def get_wpapi_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=N
         
         raise NotImplementedError('not implemented account format')
     
-    for task_i in range(task_cfg.count):
+    for task_i in task_cfg.task_indexes:
+        if task_i is None:
+            # no task yet (see ``work_queue.QueueClient``)
+            
+            yield None
+            
+            continue
+        
         task = Task()
         
         task.i = task_i
@@ -168,6 +438,9 @@ def get_wpapi_post_task_list(task_cfg, task_begin_handle=None, task_end_handle=N
         task.title, task.content = next(title_and_content_iter)
         task.ua_name = task_cfg.ua_name
         task.proxy_kwargs = task_cfg.proxy_kwargs
+        task.retry_policy = task_cfg.retry_policy
+        task.http_engine = task_cfg.http_engine
+        task.multicall_batcher = multicall_batcher
         
         task.acc_save = lambda _task=task: wpapi_acc_save(
                 task_cfg,
@@ -186,8 +459,15 @@ def wpapi_post_task(task, callback=None):
     if task.task_begin_handle is not None:
         task.task_begin_handle(task)
     
+    if task.multicall_batcher is not None:
+        post_func = task.multicall_batcher.post
+    elif task.http_engine == 'async':
+        post_func = wpapi_post_async
+    else:
+        post_func = wpapi_post
+    
     task.result, task.error = (yield gen.Task(
-            wpapi_post,
+            post_func,
             blog_url=task.blog_url,
             username=task.username,
             password=task.password,
@@ -195,6 +475,7 @@ def wpapi_post_task(task, callback=None):
             content=task.content,
             ua_name=task.ua_name,
             proxy_kwargs=task.proxy_kwargs,
+            retry_policy=task.retry_policy,
             )).args
     
     if task.task_end_handle is not None: